@@ -0,0 +1,101 @@
+"""Per-stage accounting for the mark_attendance admission pipeline.
+
+mark_attendance runs its checks cheapest-first. Each request walks the
+stages in order and either gets rejected at one of them or is accepted
+after the last. Counting passes, rejections and time per stage shows
+where a lecture rush spends its time and why submissions fail.
+"""
+import threading
+import time
+
+ADMISSION_STAGES = (
+    'replay',         # Idempotency-Key lookup; retries are answered (stopped) here
+    'content_length', # request size, from the header only
+    'qr_token',       # signature and age of the scanned QR token (HMAC only)
+    'course_window',  # course exists and is inside its attendance window
+    'fields',         # required form fields present and well-formed
+    'geofence',       # distance from the class location
+    'duplicate',      # in-flight guard and existing-record lookup
+    'photo_header',   # image format and dimensions, header only
+    'persist',        # write the raw photo and insert the row
+)
+
+
+class AdmissionStats:
+    """Thread-safe counters of passes, rejections and seconds spent per stage.
+
+    ``listener(stage, seconds, passed)``, if given, is also called for every
+    stage a request leaves, e.g. to export the same numbers as metrics.
+    """
+
+    def __init__(self, stages=ADMISSION_STAGES, listener=None):
+        self.stages = tuple(stages)
+        self.listener = listener
+        self._lock = threading.Lock()
+        self._passed = dict.fromkeys(self.stages, 0)
+        self._rejected = dict.fromkeys(self.stages, 0)
+        self._seconds = dict.fromkeys(self.stages, 0.0)
+        self._accepted = 0
+
+    def start(self):
+        """Begin tracking one request."""
+        return Admission(self)
+
+    def _record(self, stage, seconds, passed):
+        with self._lock:
+            self._seconds[stage] += seconds
+            if passed:
+                self._passed[stage] += 1
+            else:
+                self._rejected[stage] += 1
+        if self.listener is not None:
+            self.listener(stage, seconds, passed)
+
+    def _record_accepted(self):
+        with self._lock:
+            self._accepted += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'accepted': self._accepted,
+                'stages': [{
+                    'stage': stage,
+                    'passed': self._passed[stage],
+                    'rejected': self._rejected[stage],
+                    'total_ms': round(self._seconds[stage] * 1000, 2),
+                    'avg_ms': round(self._seconds[stage] * 1000 / (self._passed[stage] + self._rejected[stage]), 3)
+                    if self._passed[stage] + self._rejected[stage] else None,
+                } for stage in self.stages],
+            }
+
+
+class Admission:
+    """Tracks a single request; call stage() on entering each check."""
+
+    def __init__(self, stats):
+        self._stats = stats
+        self.current = None
+        self._started = None
+
+    def _close(self, passed):
+        if self.current is not None:
+            self._stats._record(self.current, time.perf_counter() - self._started, passed)
+            self.current = None
+
+    def stage(self, name):
+        """The previous stage passed; start timing ``name``."""
+        if name not in self._stats.stages:
+            raise ValueError(f'Unknown admission stage: {name}')
+        self._close(passed=True)
+        self.current = name
+        self._started = time.perf_counter()
+
+    def reject(self):
+        """The current stage rejected the request."""
+        self._close(passed=False)
+
+    def accept(self):
+        """The request passed every stage."""
+        self._close(passed=True)
+        self._stats._record_accepted()
@@ -0,0 +1,374 @@
+"""Attendance rates, lateness and absences across students, courses and departments.
+
+Attendance.student_id is whatever the student typed, so check-ins are
+matched to the Student roster by ID: a check-in counts towards the rates
+when it is by a registered student of the session's department. Check-ins
+matching nobody on the session department's roster (unknown IDs, typos,
+students of other departments) are reported as ``off_roster`` instead of
+being dropped silently. Sessions are Course rows; a course in these
+rollups is every session with the same course code in a department.
+
+Nothing records which courses a student takes (departments run courses for
+every year, and students carry no year), so enrolment is inferred from
+attendance: a student takes a course when they checked in to at least one
+of its sessions in the range, and is expected at every session of it held
+in the range. A course expects its sessions times the students taking it.
+Students with no check-in in the range can't be placed in any course; they
+are counted per department as ``no_checkins`` rather than given a rate.
+
+Everything is computed by grouped SQL queries over the check-ins in the
+range; the Course x Student roster is never expanded into rows. Only
+sessions that have started count as held.
+
+Lateness is the minutes from a session's start to the check-in, bucketed
+in the database; ON_TIME_MINUTES is the same cut-off view_attendee uses.
+
+A date range that ended before today gains no new check-ins (sessions only
+accept them for ATTENDANCE_WINDOW after they start), so results for closed
+ranges are cached per process for ``ttl`` seconds, which bounds how long
+admin corrections to past attendance take to show. Ranges reaching today
+are always recomputed.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime, time as clock, timedelta
+
+from sqlalchemy import Float, and_, case, exists, func, select
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+
+# Check-ins up to this many minutes after the start are on time
+ON_TIME_MINUTES = 15
+# Upper bounds, in minutes after the start, of the lateness distribution's buckets
+LATENESS_BUCKETS = (5, 10, 15, 20, 25, 30)
+
+
+class minutes_late(FunctionElement):
+    """``minutes_late(timestamp, start)``: minutes from ``start`` to ``timestamp`` as a float."""
+
+    type = Float()
+    name = 'minutes_late'
+    inherit_cache = True
+
+
+@compiles(minutes_late)
+def _minutes_late(element, compiler, **kw):
+    timestamp, start = [compiler.process(clause, **kw) for clause in element.clauses]
+    return f'EXTRACT(EPOCH FROM ({timestamp} - {start})) / 60.0'
+
+
+@compiles(minutes_late, 'sqlite')
+def _minutes_late_sqlite(element, compiler, **kw):
+    timestamp, start = [compiler.process(clause, **kw) for clause in element.clauses]
+    return f'(julianday({timestamp}) - julianday({start})) * 1440.0'
+
+
+@compiles(minutes_late, 'mysql')
+def _minutes_late_mysql(element, compiler, **kw):
+    timestamp, start = [compiler.process(clause, **kw) for clause in element.clauses]
+    return f'TIMESTAMPDIFF(SECOND, {start}, {timestamp}) / 60.0'
+
+
+def _rate(part, whole):
+    """``part`` of ``whole`` as a percentage, or None when nothing was expected."""
+    return round(100.0 * part / whole, 1) if whole else None
+
+
+class AttendanceAnalytics:
+    """Attendance rollups over the ``courses``, ``students``, ``attendance`` and ``departments`` tables.
+
+    ``engine`` is a callable returning the engine to read with. Date ranges
+    are inclusive and select sessions by their start time. Rates are
+    percentages, None where no check-ins were expected.
+    """
+
+    def __init__(self, engine, courses, students, attendance, departments, ttl=3600, maxsize=256):
+        self.engine = engine
+        self.course_table = courses
+        self.student_table = students
+        self.attendance_table = attendance
+        self.department_table = departments
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._query_seconds = 0.0
+
+    def _held(self, start, end, department_id=None, now=None):
+        """Conditions selecting the sessions held from ``start`` to ``end``."""
+        c = self.course_table.c
+        conditions = [c.start_time >= datetime.combine(start, clock.min),
+                      c.start_time < datetime.combine(end + timedelta(days=1), clock.min),
+                      c.start_time <= (now or datetime.now())]
+        if department_id is not None:
+            conditions.append(c.department_id == department_id)
+        return conditions
+
+    def _roster_match(self):
+        """Join condition from a check-in to the registered student of its session's department."""
+        s, a, c = self.student_table.c, self.attendance_table.c, self.course_table.c
+        return and_(s.student_id == a.student_id, s.department_id == c.department_id)
+
+    def _lateness(self):
+        return minutes_late(self.attendance_table.c.timestamp, self.course_table.c.start_time)
+
+    def _on_time(self):
+        late = self._lateness()
+        return case((and_(late >= 0, late <= ON_TIME_MINUTES), 1), else_=0)
+
+    def _enrolment(self, held):
+        """Distinct ``(student, department_id, course_code)``: the registered students taking each course."""
+        a, c, s = self.attendance_table.c, self.course_table.c, self.student_table.c
+        return (select(s.id.label('student'), c.department_id, c.course_code)
+                .select_from(self.attendance_table.join(self.course_table, a.course_id == c.id)
+                             .join(self.student_table, self._roster_match()))
+                .where(*held).distinct().subquery())
+
+    def _per_course(self, held):
+        """Sessions, students taking it and check-in counts per course code and department."""
+        a, c, s = self.attendance_table.c, self.course_table.c, self.student_table.c
+        return (select(c.department_id, c.course_code, func.max(c.course_name).label('course_name'),
+                       func.count(c.id.distinct()).label('sessions'),
+                       func.count(s.id.distinct()).label('students'),
+                       func.count(a.id).label('checkins'),
+                       func.count(s.id).label('roster_checkins'),
+                       func.sum(case((a.location_verified.is_(True), 1), else_=0)).label('verified'),
+                       func.sum(self._on_time()).label('on_time'))
+                .select_from(self.course_table.outerjoin(self.attendance_table, a.course_id == c.id)
+                             .outerjoin(self.student_table, self._roster_match()))
+                .where(*held).group_by(c.department_id, c.course_code).subquery())
+
+    def _roster_sizes(self):
+        s = self.student_table.c
+        return (select(s.department_id, func.count().label('roster'))
+                .where(s.department_id.isnot(None)).group_by(s.department_id).subquery())
+
+    def _run(self, key, end, compute):
+        """``compute(conn)``, cached under ``key`` when the range ending on ``end`` is closed."""
+        closed = end < date.today()
+        if closed:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry[1] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return entry[0]
+        started = time.perf_counter()
+        with self.engine().connect() as conn:
+            result = compute(conn)
+        with self._lock:
+            self._misses += 1
+            self._query_seconds += time.perf_counter() - started
+            if closed:
+                self._entries[key] = (result, time.monotonic() + self.ttl)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return result
+
+    def departments(self, start, end):
+        """Roster size, sessions held, check-ins and attendance rate for every department.
+
+        ``no_checkins`` counts the registered students without a check-in in
+        the range, who have no courses to be rated against.
+        """
+        def compute(conn):
+            a, c, d, s = self.attendance_table.c, self.course_table.c, self.department_table.c, self.student_table.c
+            held = self._held(start, end)
+            per_course = self._per_course(held)
+            totals = (select(per_course.c.department_id,
+                             func.sum(per_course.c.sessions).label('sessions'),
+                             func.sum(per_course.c.sessions * per_course.c.students).label('expected'),
+                             func.sum(per_course.c.checkins).label('checkins'),
+                             func.sum(per_course.c.roster_checkins).label('roster_checkins'),
+                             func.sum(per_course.c.verified).label('verified'),
+                             func.sum(per_course.c.on_time).label('on_time'))
+                      .group_by(per_course.c.department_id).subquery())
+            active = (select(c.department_id, func.count(s.id.distinct()).label('active'))
+                      .select_from(self.attendance_table.join(self.course_table, a.course_id == c.id)
+                                   .join(self.student_table, self._roster_match()))
+                      .where(*held).group_by(c.department_id).subquery())
+            roster = self._roster_sizes()
+            rows = conn.execute(
+                select(d.id, d.code, d.name, func.coalesce(roster.c.roster, 0).label('roster'),
+                       func.coalesce(active.c.active, 0).label('active'),
+                       *[func.coalesce(totals.c[name], 0).label(name) for name in
+                         ('sessions', 'expected', 'checkins', 'roster_checkins', 'verified', 'on_time')])
+                .select_from(self.department_table.outerjoin(roster, roster.c.department_id == d.id)
+                             .outerjoin(active, active.c.department_id == d.id)
+                             .outerjoin(totals, totals.c.department_id == d.id))
+                .order_by(d.name))
+            return [{
+                'department_id': row.id,
+                'code': row.code,
+                'name': row.name,
+                'students': row.roster,
+                'no_checkins': row.roster - row.active,
+                'sessions': row.sessions,
+                'expected': row.expected,
+                'checkins': row.checkins,
+                'off_roster': row.checkins - row.roster_checkins,
+                'verified': row.verified,
+                'on_time': row.on_time,
+                'rate': _rate(row.roster_checkins, row.expected),
+            } for row in rows]
+
+        return self._run(('departments', start, end), end, compute)
+
+    def courses(self, start, end, department_id=None):
+        """Sessions held, students taking it, check-ins and attendance rate per course code and department."""
+        def compute(conn):
+            per_course = self._per_course(self._held(start, end, department_id))
+            rows = conn.execute(select(per_course)
+                                .order_by(per_course.c.department_id, per_course.c.course_code))
+            return [{
+                'department_id': row.department_id,
+                'course_code': row.course_code,
+                'course_name': row.course_name,
+                'students': row.students,
+                'sessions': row.sessions,
+                'expected': row.sessions * row.students,
+                'checkins': row.checkins,
+                'off_roster': row.checkins - row.roster_checkins,
+                'verified': row.verified,
+                'on_time': row.on_time,
+                'rate': _rate(row.roster_checkins, row.sessions * row.students),
+            } for row in rows]
+
+        return self._run(('courses', start, end, department_id), end, compute)
+
+    def students(self, start, end, department_id=None, below=None, limit=None):
+        """Per-student rates over the sessions of the courses they take, lowest first.
+
+        ``below`` keeps the students under that attendance percentage.
+        Students without a check-in in the range take no courses and are
+        left out; departments() counts them.
+        """
+        def compute(conn):
+            a, c, s = self.attendance_table.c, self.course_table.c, self.student_table.c
+            held = self._held(start, end, department_id)
+            enrolment = self._enrolment(held)
+            sessions = (select(c.department_id, c.course_code, func.count().label('sessions'))
+                        .where(*held).group_by(c.department_id, c.course_code).subquery())
+            expected = (select(enrolment.c.student, func.count().label('courses'),
+                               func.sum(sessions.c.sessions).label('sessions'))
+                        .select_from(enrolment.join(sessions, and_(
+                            sessions.c.department_id == enrolment.c.department_id,
+                            sessions.c.course_code == enrolment.c.course_code)))
+                        .group_by(enrolment.c.student).subquery())
+            attended = (select(s.id, func.count().label('attended'), func.sum(self._on_time()).label('on_time'))
+                        .select_from(self.attendance_table.join(self.course_table, a.course_id == c.id)
+                                     .join(self.student_table, self._roster_match()))
+                        .where(*held).group_by(s.id).subquery())
+            query = (select(s.student_id, s.full_name, s.department_id, expected.c.courses, expected.c.sessions,
+                            attended.c.attended, func.coalesce(attended.c.on_time, 0).label('on_time'))
+                     .select_from(self.student_table.join(expected, expected.c.student == s.id)
+                                  .join(attended, attended.c.id == s.id))
+                     .order_by(attended.c.attended * 1.0 / expected.c.sessions, s.student_id))
+            if below is not None:
+                query = query.where(attended.c.attended * 100.0 < expected.c.sessions * below)
+            if limit is not None:
+                query = query.limit(limit)
+            return [{
+                'student_id': row.student_id,
+                'full_name': row.full_name,
+                'department_id': row.department_id,
+                'courses': row.courses,
+                'sessions': row.sessions,
+                'attended': row.attended,
+                'absences': row.sessions - row.attended,
+                'on_time': row.on_time,
+                'late': row.attended - row.on_time,
+                'rate': _rate(row.attended, row.sessions),
+            } for row in conn.execute(query)]
+
+        return self._run(('students', start, end, department_id, below, limit), end, compute)
+
+    def lateness(self, start, end, department_id=None, course_code=None):
+        """Distribution of check-ins by minutes after the session start, in LATENESS_BUCKETS."""
+        def compute(conn):
+            a, c = self.attendance_table.c, self.course_table.c
+            late = self._lateness()
+            lowers = (0,) + LATENESS_BUCKETS[:-1]
+            labels = [f'{lower}-{upper}' for lower, upper in zip(lowers, LATENESS_BUCKETS)]
+            whens = [(late < 0, 'early')] + [(late <= upper, label) for upper, label in zip(LATENESS_BUCKETS, labels)]
+            bucket = case(*whens, else_=f'{LATENESS_BUCKETS[-1]}+').label('bucket')
+            query = (select(bucket, func.count().label('checkins'))
+                     .select_from(self.attendance_table.join(self.course_table, a.course_id == c.id))
+                     .where(*self._held(start, end, department_id)).group_by(bucket))
+            if course_code is not None:
+                query = query.where(c.course_code == course_code)
+            counts = dict(conn.execute(query).all())
+            total = sum(counts.values())
+            on_time = sum(counts.get(label, 0) for upper, label in zip(LATENESS_BUCKETS, labels)
+                          if upper <= ON_TIME_MINUTES)
+            return {
+                'checkins': total,
+                'on_time': on_time,
+                'late': total - on_time - counts.get('early', 0),
+                'on_time_minutes': ON_TIME_MINUTES,
+                'buckets': [{'bucket': label, 'checkins': counts.get(label, 0)}
+                            for label in ['early'] + labels + [f'{LATENESS_BUCKETS[-1]}+']],
+            }
+
+        return self._run(('lateness', start, end, department_id, course_code), end, compute)
+
+    def absentees(self, course_id, since=None):
+        """Registered students taking a session's course who did not check in to it.
+
+        Students take the course when they checked in to another of its
+        sessions, starting from ``since`` when given.
+        """
+        a, c, s = self.attendance_table.c, self.course_table.c, self.student_table.c
+        checkin = self.attendance_table.alias('checkin')
+        checked_in = exists().where(checkin.c.course_id == course_id, checkin.c.student_id == s.student_id)
+        with self.engine().connect() as conn:
+            session = conn.execute(select(c.department_id, c.course_code).where(c.id == course_id)).first()
+            if session is None:
+                return []
+            query = (select(s.student_id, s.full_name, s.email)
+                     .select_from(self.attendance_table.join(self.course_table, a.course_id == c.id)
+                                  .join(self.student_table, self._roster_match()))
+                     .where(c.department_id == session.department_id, c.course_code == session.course_code,
+                            ~checked_in)
+                     .distinct().order_by(s.student_id))
+            if since is not None:
+                query = query.where(c.start_time >= since)
+            return [dict(row._mapping) for row in conn.execute(query)]
+
+    def missed_sessions(self, student_id, start, end):
+        """Sessions held of the courses a registered student takes that they did not check in to."""
+        a, c, s = self.attendance_table.c, self.course_table.c, self.student_table.c
+        held = self._held(start, end)
+        taken = (select(c.department_id, c.course_code)
+                 .select_from(self.attendance_table.join(self.course_table, a.course_id == c.id)
+                              .join(self.student_table, self._roster_match()))
+                 .where(s.student_id == student_id, *held).distinct().subquery())
+        checked_in = exists().where(a.course_id == c.id, a.student_id == student_id)
+        with self.engine().connect() as conn:
+            rows = conn.execute(
+                select(c.id, c.course_code, c.course_name, c.start_time)
+                .select_from(self.course_table.join(taken, and_(taken.c.department_id == c.department_id,
+                                                                taken.c.course_code == c.course_code)))
+                .where(*held, ~checked_in)
+                .order_by(c.start_time))
+            return [{'course_id': row.id, 'course_code': row.course_code, 'course_name': row.course_name,
+                     'start_time': row.start_time.isoformat()} for row in rows]
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl_seconds': self.ttl,
+                'hits': self._hits,
+                'misses': self._misses,
+                'avg_query_ms': round(self._query_seconds * 1000 / self._misses, 3) if self._misses else None,
+            }
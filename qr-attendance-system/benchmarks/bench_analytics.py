@@ -0,0 +1,139 @@
+"""Per-student attendance rates: export-and-loop vs the grouped SQL analytics.
+
+Seeds ``--students`` registered students across the sample departments,
+``--sessions`` past sessions and check-ins by ~``--rate`` of each session's
+roster (plus a few off-roster IDs), then against a scratch database measures:
+
+* ``loop``: loading every course, student and check-in of the range through
+  the ORM and counting in Python, which is what answering "who is below 75%"
+  took before;
+* ``students``, ``courses``, ``departments``, ``lateness``: the
+  AttendanceAnalytics rollups over an open range (always recomputed);
+* ``cached``: the students rollup again over a range that has ended.
+
+    python benchmarks/bench_analytics.py --students 6000 --sessions 600
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+
+def seed(students, sessions, rate, rng):
+    from main import app, db, Attendance, Course, Department, Student, User
+
+    with app.app_context():
+        instructor = User.query.filter_by(username='admin').first()
+        departments = [d.id for d in Department.query]
+        engine = db.get_engine(app)
+        with engine.begin() as conn:
+            conn.execute(Student.__table__.insert(), [
+                {'student_id': f'20{i:07d}', 'full_name': f'Student {i}', 'department_id': departments[i % len(departments)]}
+                for i in range(students)])
+            first = datetime.combine(date.today() - timedelta(days=120), datetime.min.time())
+            conn.execute(Course.__table__.insert(), [
+                {'course_name': f'Module {i % 40}', 'course_code': f'M{i % 40:03d}', 'class_location': 'Hall',
+                 'start_time': first + timedelta(days=i * 120 // sessions, hours=8 + i % 8),
+                 'end_time': first + timedelta(days=i * 120 // sessions, hours=10 + i % 8),
+                 'instructor_id': instructor.id, 'department_id': departments[i % len(departments)],
+                 'max_distance': 100.0, 'year': 100, 'session': 'regular'}
+                for i in range(sessions)])
+        roster = {}
+        for i in range(students):
+            roster.setdefault(departments[i % len(departments)], []).append(f'20{i:07d}')
+        rows = 0
+        for course in Course.query:
+            batch = []
+            for student_id in roster[course.department_id]:
+                if rng.random() < rate:
+                    batch.append(student_id)
+            batch += [f'X{course.id}-{k}' for k in range(3)]
+            with engine.begin() as conn:
+                conn.execute(Attendance.__table__.insert(), [
+                    {'student_id': student_id, 'student_name': student_id, 'course_id': course.id,
+                     'timestamp': course.start_time + timedelta(minutes=rng.uniform(-2, 30)), 'photo_path': 'seed.jpg',
+                     'latitude': 0.0, 'longitude': 0.0, 'location_verified': rng.random() < 0.9}
+                    for student_id in batch])
+            rows += len(batch)
+    return rows
+
+
+def run_loop(start, end):
+    from main import app, Attendance, Course, Student
+
+    with app.app_context():
+        started = time.perf_counter()
+        since = datetime.combine(start, datetime.min.time())
+        until = datetime.combine(end + timedelta(days=1), datetime.min.time())
+        courses = Course.query.filter(Course.start_time >= since, Course.start_time < until,
+                                      Course.start_time <= datetime.now()).all()
+        by_id = {course.id: course for course in courses}
+        held = {}
+        for course in courses:
+            held.setdefault((course.department_id, course.course_code), set()).add(course.id)
+        attended = {}
+        for attendance in Attendance.query.filter(Attendance.course_id.in_(list(by_id))):
+            attended.setdefault(attendance.student_id, set()).add(attendance.course_id)
+        below = 0
+        for student in Student.query:
+            mine = {course_id for course_id in attended.get(student.student_id, set())
+                    if by_id[course_id].department_id == student.department_id}
+            # The courses a student takes are the ones they checked in to
+            taken = {(by_id[course_id].department_id, by_id[course_id].course_code) for course_id in mine}
+            sessions = sum(len(held[course]) for course in taken)
+            if sessions and len(mine) * 100 < sessions * 75:
+                below += 1
+        seconds = time.perf_counter() - started
+    return {'below_75': below, 'seconds': round(seconds, 3)}
+
+
+def timed(call):
+    started = time.perf_counter()
+    result = call()
+    return result, round(time.perf_counter() - started, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--students', type=int, default=6000)
+    parser.add_argument('--sessions', type=int, default=600)
+    parser.add_argument('--rate', type=float, default=0.8, help='Fraction of a roster checking in to a session')
+    parser.add_argument('--seed', type=int, default=5)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix='analytics-bench-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp, 'analytics.db')}"
+    os.environ['UPLOAD_FOLDER'] = os.path.join(tmp, 'uploads')
+    from main import init_db, attendance_analytics
+
+    init_db()
+    report = {'checkins': seed(args.students, args.sessions, args.rate, random.Random(args.seed))}
+    start, end = date.today() - timedelta(days=130), date.today()
+
+    report['loop'] = run_loop(start, end)
+    print(json.dumps(report['loop']), file=sys.stderr)
+    students, seconds = timed(lambda: attendance_analytics.students(start, end, below=75))
+    report['students'] = {'below_75': len(students), 'seconds': seconds}
+    for name in ('courses', 'departments'):
+        rows, seconds = timed(lambda: getattr(attendance_analytics, name)(start, end))
+        report[name] = {'rows': len(rows), 'seconds': seconds}
+    _, seconds = timed(lambda: attendance_analytics.lateness(start, end))
+    report['lateness'] = {'seconds': seconds}
+
+    closed = end - timedelta(days=1)
+    attendance_analytics.students(start, closed, below=75)
+    _, seconds = timed(lambda: attendance_analytics.students(start, closed, below=75))
+    report['cached'] = {'seconds': seconds}
+    report['speedup_students'] = round(report['loop']['seconds'] / max(report['students']['seconds'], 0.001), 1)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""Peak RSS of the streaming attendance export versus row count.
+
+For each ``--rows`` size a scratch SQLite database is loaded (with the
+bench_indexes loader), then a fresh child process streams the export and
+reports its peak RSS over the baseline after importing the app. The
+``all`` mode loads the same rows as ORM objects with ``.all()``, the way
+attendance_report does, for comparison.
+
+    python benchmarks/bench_export.py --rows 1000 100000 2000000
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+sys.path.insert(0, HERE)
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def child(path, mode):
+    os.environ.setdefault('PHOTO_PIPELINE_MODE', 'sync')
+    from flask import request
+    from main import app, db, Attendance, attendance_filters, export_attendance
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    with app.app_context():
+        db.session.execute(db.text('SELECT 1'))
+    baseline = _peak_rss_mb()
+
+    started = time.perf_counter()
+    size = 0
+    rows = 0
+    with app.test_request_context(f'/admin/attendance/export.{mode}'):
+        if mode == 'all':
+            rows = len(Attendance.query.order_by(Attendance.timestamp).all())
+        else:
+            response = export_attendance(attendance_filters(request.args), mode, 'bench')
+            for chunk in response.response:
+                size += len(chunk)
+    print(json.dumps({
+        'baseline_mb': round(baseline, 1),
+        'peak_mb': round(_peak_rss_mb(), 1),
+        'delta_mb': round(_peak_rss_mb() - baseline, 1),
+        'seconds': round(time.perf_counter() - started, 2),
+        'bytes': size,
+        'rows_loaded': rows or None,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000, 1000000])
+    parser.add_argument('--courses', type=int, default=2000)
+    parser.add_argument('--modes', nargs='+', default=['csv', 'xlsx', 'all'])
+    parser.add_argument('--child', nargs=2, metavar=('DB', 'MODE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(*args.child)
+        return
+
+    from bench_indexes import load
+
+    report = []
+    for rows in args.rows:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'bench.db')
+            engine, indexes, _ = load(path, rows, min(args.courses, rows))
+            for index in indexes:
+                index.create(engine)
+            engine.dispose()
+            for mode in args.modes:
+                out = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', path, mode],
+                                     cwd=os.path.join(HERE, '..'), check=True, capture_output=True, text=True)
+                result = json.loads(out.stdout.strip().splitlines()[-1])
+                report.append(dict(rows=rows, mode=mode, **result))
+                print(json.dumps(report[-1]), file=sys.stderr)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Bulk geofence re-verification versus the per-row ORM path.
+
+Loads ``--rows`` attendance records with the bench_indexes loader, moves
+every course by ``--shift`` meters so a share of the records changes
+verification, then re-verifies a copy of the database both ways:
+
+* ``per_row``: load Attendance objects with their course, recompute each
+  with haversine_distance and let the session flush the changes, the way
+  admin_update_attendance does one record at a time.
+* ``bulk``: geofence.reverify, NumPy chunks and executemany UPDATEs.
+
+Both must leave identical verification results.
+
+    python benchmarks/bench_geofence.py --rows 10000 100000 1000000
+"""
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+sys.path.insert(0, HERE)
+os.environ.setdefault('PHOTO_PIPELINE_MODE', 'sync')
+
+from sqlalchemy.orm import joinedload  # noqa: E402
+
+from bench_indexes import load  # noqa: E402
+from main import app, db, Attendance, Course  # noqa: E402
+from geo import METERS_PER_DEGREE, haversine_distance  # noqa: E402
+import geofence  # noqa: E402
+
+
+def per_row(path):
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    with app.app_context():
+        db.get_engine(app).dispose()
+        started = time.perf_counter()
+        for attendance in Attendance.query.options(joinedload(Attendance.course)).all():
+            course = attendance.course
+            if course.latitude and course.longitude and attendance.latitude and attendance.longitude:
+                distance = haversine_distance(attendance.latitude, attendance.longitude,
+                                              course.latitude, course.longitude)
+                attendance.distance_from_class = distance
+                attendance.location_verified = distance <= (course.max_distance or 100.0)
+        db.session.commit()
+        seconds = time.perf_counter() - started
+        db.session.remove()
+        db.get_engine(app).dispose()
+    return seconds
+
+
+def bulk(path, chunk_rows):
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    with app.app_context():
+        db.get_engine(app).dispose()
+        result = geofence.reverify(db.get_engine(app), Attendance.__table__, Course.__table__,
+                                   chunk_rows=chunk_rows)
+        db.get_engine(app).dispose()
+    return result['seconds'], result['updated']
+
+
+def verified_ids(path):
+    conn = sqlite3.connect(path)
+    ids = {row[0] for row in conn.execute('SELECT id FROM attendance WHERE location_verified = 1')}
+    conn.close()
+    return ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--courses', type=int, default=2000)
+    parser.add_argument('--shift', type=float, default=50.0, help='Meters to move every course north')
+    parser.add_argument('--chunk-rows', type=int, default=geofence.CHUNK_ROWS)
+    args = parser.parse_args()
+
+    report = []
+    for rows in args.rows:
+        with tempfile.TemporaryDirectory() as tmp:
+            base = os.path.join(tmp, 'base.db')
+            engine, indexes, _ = load(base, rows, min(args.courses, rows))
+            for index in indexes:
+                index.create(engine)
+            engine.dispose()
+            conn = sqlite3.connect(base)
+            conn.execute('UPDATE course SET latitude = latitude + ?', (args.shift / METERS_PER_DEGREE,))
+            conn.commit()
+            conn.close()
+
+            paths = {mode: os.path.join(tmp, f'{mode}.db') for mode in ('per_row', 'bulk')}
+            for path in paths.values():
+                shutil.copy(base, path)
+
+            per_row_seconds = per_row(paths['per_row'])
+            bulk_seconds, updated = bulk(paths['bulk'], args.chunk_rows)
+            report.append({
+                'rows': rows,
+                'updated': updated,
+                'per_row_seconds': round(per_row_seconds, 3),
+                'bulk_seconds': round(bulk_seconds, 3),
+                'speedup': round(per_row_seconds / bulk_seconds, 1) if bulk_seconds else None,
+                'results_match': verified_ids(paths['per_row']) == verified_ids(paths['bulk']),
+            })
+            print(json.dumps(report[-1]), file=sys.stderr)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
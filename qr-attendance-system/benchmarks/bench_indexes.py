@@ -0,0 +1,149 @@
+"""Query plans and latencies of the attendance hot paths with and without indexes.
+
+Builds a scratch SQLite database from the models in main.py, loads
+``--rows`` attendance records, then runs each hot-path query first with
+the secondary indexes dropped and again after creating them.
+
+    python benchmarks/bench_indexes.py --rows 1000000
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from sqlalchemy import create_engine  # noqa: E402
+
+from main import db  # noqa: E402
+
+SEMESTER_START = datetime(2026, 1, 12, 8, 0)
+
+
+def load(path, rows, courses, departments=6):
+    engine = create_engine(f'sqlite:///{path}')
+    db.metadata.create_all(engine)
+    indexes = [index for table in ('attendance', 'course') for index in db.metadata.tables[table].indexes]
+    for index in indexes:
+        index.drop(engine)
+
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO user (id, username, password, role) VALUES (1, 'bench', 'x', 'instructor')")
+    conn.executemany(
+        'INSERT INTO department (id, name, code) VALUES (?, ?, ?)',
+        [(d, f'Department {d}', f'D{d}') for d in range(1, departments + 1)]
+    )
+    course_rows = []
+    for c in range(1, courses + 1):
+        start = SEMESTER_START + timedelta(days=c % 120, hours=c % 10)
+        course_rows.append((c, f'Course {c}', f'C{c}', 'Hall', start, start + timedelta(hours=2),
+                            1, (c % departments) + 1, 5.6, -0.18, 100.0, 100, 'regular'))
+    conn.executemany(
+        'INSERT INTO course (id, course_name, course_code, class_location, start_time, end_time, instructor_id, '
+        'department_id, latitude, longitude, max_distance, year, session) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        course_rows
+    )
+
+    rng = random.Random(42)
+    per_course = max(1, rows // courses)
+    # Consecutive rows share a course, so student ids stay unique within each course
+    students = max(per_course, 20000)
+    batch = []
+    for i in range(rows):
+        course_id = (i // per_course) % courses + 1
+        start = course_rows[course_id - 1][4]
+        batch.append((f'S{i % students:05d}', 'Student', course_id,
+                      start + timedelta(seconds=rng.randint(0, 1800)), 'photo.jpg', 5.6, -0.18,
+                      rng.uniform(0, 150), rng.random() < 0.8))
+        if len(batch) == 50000:
+            conn.executemany(
+                'INSERT INTO attendance (student_id, student_name, course_id, timestamp, photo_path, latitude, '
+                'longitude, distance_from_class, location_verified) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', batch)
+            batch = []
+    if batch:
+        conn.executemany(
+            'INSERT INTO attendance (student_id, student_name, course_id, timestamp, photo_path, latitude, '
+            'longitude, distance_from_class, location_verified) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', batch)
+    conn.commit()
+    conn.close()
+    return engine, indexes, course_rows
+
+
+def queries(course_rows):
+    course_id = len(course_rows) // 2
+    day = course_rows[course_id - 1][4].replace(hour=0)
+    student = 'S00000'
+    return {
+        # A first check-in: no matching row yet, so without an index this scans the table
+        'duplicate_check': ('SELECT id FROM attendance WHERE student_id = ? AND course_id = ? LIMIT 1',
+                            (student, course_id)),
+        'course_report': ('SELECT * FROM attendance WHERE course_id = ? ORDER BY timestamp', (course_id,)),
+        'attend_today_date_func': ('SELECT id FROM course WHERE department_id = ? AND date(start_time) = ? '
+                                   'ORDER BY start_time', (1, day.date().isoformat())),
+        'attend_today_range': ('SELECT id FROM course WHERE department_id = ? AND start_time >= ? '
+                               'AND start_time < ? ORDER BY start_time', (1, day, day + timedelta(days=1))),
+        'verified_count': ('SELECT COUNT(*) FROM attendance WHERE location_verified = 1', ()),
+        'admin_first_page': ('SELECT * FROM attendance ORDER BY timestamp DESC, id DESC LIMIT 51', ()),
+        'student_history': ('SELECT * FROM attendance WHERE student_id = ?', (student,)),
+    }
+
+
+def measure(path, course_rows, repeat):
+    conn = sqlite3.connect(path)
+    results = {}
+    for name, (sql, params) in queries(course_rows).items():
+        plan = [row[-1] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            conn.execute(sql, params).fetchall()
+            timings.append(time.perf_counter() - started)
+        results[name] = {'plan': plan, 'median_ms': round(statistics.median(timings) * 1000, 3)}
+    conn.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--courses', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        started = time.perf_counter()
+        engine, indexes, course_rows = load(path, args.rows, args.courses)
+        load_seconds = time.perf_counter() - started
+
+        before = measure(path, course_rows, args.repeat)
+        started = time.perf_counter()
+        for index in indexes:
+            index.create(engine)
+        index_seconds = time.perf_counter() - started
+        after = measure(path, course_rows, args.repeat)
+
+    report = {
+        'rows': args.rows,
+        'courses': args.courses,
+        'load_seconds': round(load_seconds, 1),
+        'index_build_seconds': round(index_seconds, 1),
+        'queries': {
+            name: {
+                'before': before[name],
+                'after': after[name],
+                'speedup': round(before[name]['median_ms'] / max(after[name]['median_ms'], 0.001), 1),
+            } for name in before
+        },
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
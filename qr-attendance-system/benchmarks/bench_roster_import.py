@@ -0,0 +1,132 @@
+"""Roster import throughput: one student per form post vs the batched import.
+
+Generates a ``--rows`` student roster (with ~1% bad rows: unknown
+departments, missing names, repeated IDs) as CSV and XLSX, then against a
+scratch database measures:
+
+* ``per_row``: what admin_create_student does for each student, an existence
+  query, an insert and a commit, over the first ``--baseline-rows`` rows;
+* ``csv`` and ``xlsx``: RosterImport of the whole file into an empty table;
+* ``csv_upsert``: the CSV again with ``upsert``, so every row is an update.
+
+    python benchmarks/bench_roster_import.py --rows 100000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+HEADER = ['student_id', 'full_name', 'email', 'phone', 'department']
+
+
+def roster_rows(count, codes, rng):
+    for i in range(count):
+        student_id = f'10{i:07d}'
+        department = rng.choice(codes)
+        name = f'Student {i}'
+        roll = rng.random()
+        if roll < 0.004:
+            department = 'NOPE'
+        elif roll < 0.007:
+            name = ''
+        elif roll < 0.01 and i:
+            student_id = f'10{i - 1:07d}'
+        yield (student_id, name, f's{i}@students.example.edu', f'02{rng.randint(0, 99999999):08d}', department)
+
+
+def run_import(path, upsert, batch_rows):
+    from main import student_import
+    from roster import parse_roster, read_roster
+
+    roster_import = student_import(upsert, batch_rows)
+    started = time.perf_counter()
+    with open(path, 'rb') as f:
+        for _ in roster_import.run(parse_roster(read_roster(f, path))):
+            pass
+    seconds = time.perf_counter() - started
+    report = roster_import.report()
+    return {
+        'rows': report['rows'],
+        'inserted': report['inserted'],
+        'updated': report['updated'],
+        'rejected': report['failed'],
+        'seconds': round(seconds, 2),
+        'rows_per_second': round(report['rows'] / seconds, 1),
+    }
+
+
+def run_per_row(path, rows):
+    from main import app, db, Department, Student
+    from roster import parse_roster, read_roster
+
+    with app.app_context():
+        departments = {d.code: d.id for d in Department.query}
+        done = 0
+        started = time.perf_counter()
+        with open(path, 'rb') as f:
+            for _, record in parse_roster(read_roster(f, path)):
+                if done == rows:
+                    break
+                done += 1
+                if not record['full_name'] or record['department'] not in departments:
+                    continue
+                if Student.query.filter_by(student_id=record['student_id']).first():
+                    continue
+                db.session.add(Student(student_id=record['student_id'], full_name=record['full_name'],
+                                       email=record['email'], phone=record['phone'],
+                                       department_id=departments[record['department']]))
+                db.session.commit()
+        seconds = time.perf_counter() - started
+    return {'rows': done, 'seconds': round(seconds, 2), 'rows_per_second': round(done / seconds, 1)}
+
+
+def clear_students():
+    from main import app, db
+    with app.app_context():
+        db.session.execute(db.text('DELETE FROM student'))
+        db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--baseline-rows', type=int, default=2000, help='Rows imported one form post at a time')
+    parser.add_argument('--batch-rows', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix='roster-bench-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp, 'roster.db')}"
+    os.environ['UPLOAD_FOLDER'] = os.path.join(tmp, 'uploads')
+    from main import app, init_db, Department
+    from spreadsheets import iter_csv, iter_xlsx
+
+    init_db()
+    with app.app_context():
+        codes = [d.code for d in Department.query]
+    paths = {'csv': os.path.join(tmp, 'roster.csv'), 'xlsx': os.path.join(tmp, 'roster.xlsx')}
+    for kind, writer in (('csv', iter_csv), ('xlsx', iter_xlsx)):
+        with open(paths[kind], 'wb') as f:
+            for chunk in writer(HEADER, roster_rows(args.rows, codes, random.Random(args.seed))):
+                f.write(chunk)
+
+    report = {'file_bytes': {kind: os.path.getsize(path) for kind, path in paths.items()}}
+    report['per_row'] = run_per_row(paths['csv'], args.baseline_rows)
+    print(json.dumps(report['per_row']), file=sys.stderr)
+    for name, kind, upsert in (('csv', 'csv', False), ('csv_upsert', 'csv', True), ('xlsx', 'xlsx', False)):
+        if not upsert:
+            clear_students()
+        report[name] = run_import(paths[kind], upsert, args.batch_rows)
+        print(json.dumps(report[name]), file=sys.stderr)
+    report['speedup_csv'] = round(report['csv']['rows_per_second'] / report['per_row']['rows_per_second'], 1)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""Scheduling a semester: one course form post per session vs weekly series.
+
+Creates ``--series`` weekly courses lasting ``--weeks`` weeks against a
+scratch database and measures:
+
+* ``per_row``: what add_course does for every session, an ORM insert and a
+  commit, over the first ``--baseline-rows`` sessions;
+* ``semester``: SessionScheduler.materialize of every series up to its last
+  week (flask generate-sessions --days);
+* ``rolling``: materialize with the default horizon, as a worker does on its
+  first request of the day;
+* ``reconcile``: an edit to one series (new time and room) applied to its
+  upcoming sessions.
+
+    python benchmarks/bench_sessions.py --series 600 --weeks 14
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, datetime, time as clock, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+
+def make_series(count, weeks, rng):
+    from main import app, db, CourseSeries, Department, User
+    from recurrence import format_weekdays
+
+    first = date.today()
+    with app.app_context():
+        instructor = User.query.filter_by(username='admin').first()
+        departments = [d.id for d in Department.query]
+        for i in range(count):
+            db.session.add(CourseSeries(
+                course_name=f'Module {i}', course_code=f'M{i:04d}', class_location=f'Room {i % 40}',
+                instructor_id=instructor.id, department_id=rng.choice(departments),
+                latitude=5.65 + rng.uniform(-0.01, 0.01), longitude=-0.187 + rng.uniform(-0.01, 0.01),
+                max_distance=100.0, year=rng.choice([100, 200, 300, 400]), session='regular',
+                weekdays=format_weekdays([rng.randrange(5)]), start_clock=clock(rng.randrange(8, 18)),
+                duration_minutes=120, first_date=first, last_date=first + timedelta(weeks=weeks) - timedelta(days=1),
+                generated_until=first - timedelta(days=1)))
+        db.session.commit()
+
+
+def run_per_row(rows):
+    from main import app, db, Course, CourseSeries
+    from recurrence import parse_weekdays, session_dates
+
+    with app.app_context():
+        done = 0
+        started = time.perf_counter()
+        for series in CourseSeries.query.order_by(CourseSeries.id):
+            for day in session_dates(parse_weekdays(series.weekdays), series.first_date, series.last_date):
+                if done == rows:
+                    break
+                start = datetime.combine(day, series.start_clock)
+                db.session.add(Course(course_name=series.course_name, course_code=series.course_code,
+                                      class_location=series.class_location, department_id=series.department_id,
+                                      start_time=start, end_time=start + timedelta(minutes=series.duration_minutes),
+                                      instructor_id=series.instructor_id, latitude=series.latitude,
+                                      longitude=series.longitude, max_distance=series.max_distance,
+                                      year=series.year, session=series.session))
+                db.session.commit()
+                done += 1
+        seconds = time.perf_counter() - started
+        Course.query.delete()
+        db.session.commit()
+    return {'sessions': done, 'seconds': round(seconds, 2), 'sessions_per_second': round(done / seconds, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--series', type=int, default=600)
+    parser.add_argument('--weeks', type=int, default=14)
+    parser.add_argument('--baseline-rows', type=int, default=1000, help='Sessions created one form post at a time')
+    parser.add_argument('--seed', type=int, default=3)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix='sessions-bench-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp, 'sessions.db')}"
+    os.environ['UPLOAD_FOLDER'] = os.path.join(tmp, 'uploads')
+    from main import app, db, init_db, session_scheduler, CourseSeries
+
+    init_db()
+    make_series(args.series, args.weeks, random.Random(args.seed))
+    report = {'per_row': run_per_row(args.baseline_rows)}
+    print(json.dumps(report['per_row']), file=sys.stderr)
+
+    with app.app_context():
+        db.session.execute(db.text("UPDATE course_series SET generated_until = date(first_date, '-1 day')"))
+        db.session.commit()
+        semester = session_scheduler.materialize(horizon_days=args.weeks * 7)
+        report['semester'] = dict(semester, sessions_per_second=round(semester['sessions'] / semester['seconds'], 1))
+        print(json.dumps(report['semester']), file=sys.stderr)
+
+        db.session.execute(db.text('DELETE FROM course'))
+        db.session.execute(db.text("UPDATE course_series SET generated_until = date(first_date, '-1 day')"))
+        db.session.commit()
+        report['rolling'] = session_scheduler.materialize()
+        print(json.dumps(report['rolling']), file=sys.stderr)
+
+        series = CourseSeries.query.first()
+        series.start_clock = clock(series.start_clock.hour, 30)
+        series.class_location = 'Main Auditorium'
+        db.session.commit()
+        started = time.perf_counter()
+        result = session_scheduler.reconcile(series.id, now=datetime.combine(date.today(), clock.min))
+        report['reconcile'] = {key: value for key, value in result.items() if key != 'course_ids'}
+        report['reconcile']['seconds'] = round(time.perf_counter() - started, 4)
+
+    report['speedup_semester'] = round(report['semester']['sessions_per_second']
+                                       / report['per_row']['sessions_per_second'], 1)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""Concurrent attendance write throughput with and without the SQLite tuning.
+
+Runs gunicorn's shape of concurrency against a scratch database: ``--workers``
+processes with ``--threads`` threads each, every thread saving ``--writes``
+Attendance rows with save_attendance, the way mark_attendance does. The
+``before`` profile restores the previous settings (rollback journal,
+synchronous=FULL, pysqlite's 5 s busy timeout, default page cache, a new
+connection per request); ``after`` uses the defaults from main.py, still
+committing once per row. The ``group_commit`` profiles add the write-behind
+buffer, on top of the defaults and of synchronous=FULL, where every commit
+pays for an fsync. Each profile gets its own copy of the database, since the
+journal mode is stored in the file.
+
+    python benchmarks/bench_sqlite_writes.py --workers 3 --threads 4 --writes 200
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+sys.path.insert(0, HERE)
+
+PROFILES = {
+    'before': {
+        'SQLITE_JOURNAL_MODE': 'DELETE',
+        'SQLITE_SYNCHRONOUS': 'FULL',
+        'SQLITE_BUSY_TIMEOUT_MS': '5000',
+        'SQLITE_MMAP_SIZE': '0',
+        'SQLITE_CACHE_SIZE_KB': '2000',
+        'DB_POOL_SIZE': '0',
+    },
+    'after': {},
+    'group_commit': {'ATTENDANCE_WRITE_BEHIND': '1'},
+    'group_commit_full': {'ATTENDANCE_WRITE_BEHIND': '1', 'SQLITE_SYNCHRONOUS': 'FULL'},
+}
+
+
+def child(worker, threads, writes, start_at):
+    from sqlalchemy.exc import OperationalError
+    from main import app, db, save_attendance
+
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def run(thread):
+        with app.app_context():
+            course_id = db.session.execute(db.text('SELECT MIN(id) FROM course')).scalar()
+            mine, failed = [], 0
+            while time.time() < start_at:
+                time.sleep(0.001)
+            for i in range(writes):
+                started = time.perf_counter()
+                try:
+                    save_attendance(dict(student_id=f'W{worker}T{thread}N{i}', student_name='Bench',
+                                         course_id=course_id, timestamp=datetime.utcnow(), photo_path='bench.jpg',
+                                         latitude=5.6, longitude=-0.18, distance_from_class=10.0,
+                                         location_verified=True))
+                    mine.append(time.perf_counter() - started)
+                except OperationalError:
+                    db.session.rollback()
+                    failed += 1
+            db.session.remove()
+        with lock:
+            latencies.extend(mine)
+            errors.append(failed)
+
+    workers = [threading.Thread(target=run, args=(t,)) for t in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    print(json.dumps({'commits': len(latencies), 'locked': sum(errors), 'finished': time.time(),
+                      'latencies': latencies}))
+
+
+def run_profile(path, profile, args):
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{path}', PHOTO_PIPELINE_MODE='sync', **PROFILES[profile])
+    # Give every worker time to import the app before the common start time
+    start_at = time.time() + 5
+    procs = [subprocess.Popen([sys.executable, os.path.abspath(__file__), '--child', str(w), str(args.threads),
+                               str(args.writes), str(start_at)],
+                              cwd=os.path.join(HERE, '..'), env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              text=True)
+             for w in range(args.workers)]
+    results = []
+    for proc in procs:
+        out, _ = proc.communicate()
+        results.append(json.loads(out.strip().splitlines()[-1]))
+
+    latencies = sorted(l for r in results for l in r['latencies'])
+    commits = len(latencies)
+    seconds = max(r['finished'] for r in results) - start_at
+    return {
+        'profile': profile,
+        'commits': commits,
+        'locked_errors': sum(r['locked'] for r in results),
+        'seconds': round(seconds, 2),
+        'commits_per_second': round(commits / seconds, 1) if seconds > 0 else None,
+        'latency_p50_ms': round(statistics.median(latencies) * 1000, 2) if latencies else None,
+        'latency_p95_ms': round(latencies[int(0.95 * (commits - 1))] * 1000, 2) if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--writes', type=int, default=200, help='Commits per thread')
+    parser.add_argument('--rows', type=int, default=100000, help='Attendance rows loaded beforehand')
+    parser.add_argument('--profiles', nargs='+', default=list(PROFILES), choices=list(PROFILES))
+    parser.add_argument('--child', nargs=4, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        worker, threads, writes, start_at = args.child
+        child(int(worker), int(threads), int(writes), float(start_at))
+        return
+
+    from bench_indexes import load
+
+    report = []
+    with tempfile.TemporaryDirectory() as tmp:
+        base = os.path.join(tmp, 'base.db')
+        engine, indexes, _ = load(base, args.rows, min(2000, args.rows))
+        for index in indexes:
+            index.create(engine)
+        engine.dispose()
+        for profile in args.profiles:
+            path = os.path.join(tmp, f'{profile}.db')
+            shutil.copy(base, path)
+            report.append(run_profile(path, profile, args))
+            print(json.dumps(report[-1]), file=sys.stderr)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,365 @@
+"""Lecture-rush load test: phones opening the attendance page and submitting.
+
+Seeds a scratch database with courses that are taking attendance now and a
+student per phone, then replays the start of a lecture: ``--phones`` phones
+arrive spread over ``--window`` seconds, each loading /attend/<department>
+and posting /mark_attendance/<course_id> with a ~``--photo-kb`` KB photo
+(multipart, or a base64 data URL for ``--data-url`` of them) and a GPS fix
+jittered around the course location. A share of phones stand outside the
+geofence or double-tap submit, as in a real rush. At most ``--concurrency``
+phones are in flight at once.
+
+``--server testclient`` drives the app in-process through Flask's test
+client; ``--server gunicorn`` starts a local gunicorn with gunicorn.conf.py
+on the scratch database and drives it over HTTP. The JSON report has
+p50/p95/p99 latency, status and error breakdowns per step and throughput,
+so runs can be compared across changes.
+
+    python benchmarks/load_lecture_rush.py --phones 500 --window 120 --concurrency 64
+    python benchmarks/load_lecture_rush.py --server gunicorn --window 0 --out rush.json
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(HERE, '..')
+sys.path.insert(0, APP_DIR)
+
+from PIL import Image, ImageDraw, ImageFilter  # noqa: E402
+
+# Courses are laid out around this point, a few hundred meters apart
+CAMPUS = (5.6508, -0.1869)
+METERS_PER_DEGREE = 111195
+
+
+def _jpeg(img, quality):
+    buffer = io.BytesIO()
+    img.save(buffer, 'JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def make_photo(seed, target_bytes, size=(720, 960)):
+    """A phone-camera-like JPEG of about ``target_bytes``: soft shapes over sensor noise."""
+    rng = random.Random(seed)
+    img = Image.new('RGB', size, tuple(rng.randint(60, 200) for _ in range(3)))
+    draw = ImageDraw.Draw(img)
+    for _ in range(12):
+        x, y = rng.randint(0, size[0]), rng.randint(0, size[1])
+        r = rng.randint(40, 260)
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=tuple(rng.randint(0, 255) for _ in range(3)))
+    img = img.filter(ImageFilter.GaussianBlur(6))
+    noise = Image.effect_noise(size, rng.randint(18, 30)).convert('RGB')
+    img = Image.blend(img, noise, 0.18)
+    # Binary-search the quality that lands closest to the target size
+    low, high, best = 10, 95, None
+    while low <= high:
+        quality = (low + high) // 2
+        data = _jpeg(img, quality)
+        if best is None or abs(len(data) - target_bytes) < abs(len(best) - target_bytes):
+            best = data
+        if len(data) < target_bytes:
+            low = quality + 1
+        else:
+            high = quality - 1
+    return best
+
+
+def unique_photo(base, tag):
+    """``base`` with a JPEG comment segment, so content-addressed storage can't deduplicate phones."""
+    comment = f'phone {tag} {uuid.uuid4()}'.encode()
+    return base[:2] + b'\xff\xfe' + (len(comment) + 2).to_bytes(2, 'big') + comment + base[2:]
+
+
+def offset(lat, lon, meters, bearing):
+    """The point ``meters`` from (lat, lon) towards ``bearing`` radians, on a flat-earth approximation."""
+    import math
+    dlat = meters * math.cos(bearing) / METERS_PER_DEGREE
+    dlon = meters * math.sin(bearing) / (METERS_PER_DEGREE * math.cos(math.radians(lat)))
+    return lat + dlat, lon + dlon
+
+
+def seed(courses, phones, rng):
+    """Fill the scratch database; returns the course rows as dicts."""
+    from main import app, db, init_db, Course, Department, Student, User
+
+    init_db()
+    with app.app_context():
+        instructor = User(username='loadtest', fullname='Load Test', role='instructor')
+        instructor.set_password('loadtest')
+        db.session.add(instructor)
+        db.session.flush()
+        departments = [d.id for d in Department.query.order_by(Department.id)]
+        start = datetime.now() - timedelta(minutes=2)
+        rows = []
+        for i in range(courses):
+            lat, lon = offset(*CAMPUS, 300 * (i + 1), rng.uniform(0, 6.283))
+            course = Course(course_name=f'Load Test {i + 1}', course_code=f'LT{i + 1:03d}',
+                            class_location=f'Hall {i + 1}', start_time=start, end_time=start + timedelta(hours=2),
+                            instructor_id=instructor.id, department_id=departments[i % len(departments)],
+                            latitude=lat, longitude=lon, max_distance=100.0, year=100, session='regular')
+            db.session.add(course)
+            db.session.flush()
+            rows.append({'id': course.id, 'department_id': course.department_id,
+                         'latitude': lat, 'longitude': lon, 'max_distance': 100.0})
+        for p in range(phones):
+            db.session.add(Student(student_id=f'LT{p:05d}', full_name=f'Student {p}',
+                                   department_id=rows[p % courses]['department_id']))
+        db.session.commit()
+    return rows
+
+
+def plan(courses, args, rng):
+    """One dict per phone: when it arrives, where it is and how it submits."""
+    phones = []
+    for p in range(args.phones):
+        course = courses[p % len(courses)]
+        if rng.random() < args.out_of_range:
+            distance = course['max_distance'] * rng.uniform(1.5, 3)
+        else:
+            # GPS scatter inside the room, rarely near the edge of the geofence
+            distance = min(abs(rng.gauss(0, course['max_distance'] / 3)), course['max_distance'] * 0.9)
+        lat, lon = offset(course['latitude'], course['longitude'], distance, rng.uniform(0, 6.283))
+        phones.append({
+            'student_id': f'LT{p:05d}',
+            'course': course,
+            'arrival': rng.uniform(0, args.window),
+            'latitude': lat,
+            'longitude': lon,
+            'data_url': rng.random() < args.data_url,
+            'double_tap': rng.random() < args.double_tap,
+            'photo': p % args.photo_variants,
+        })
+    return phones
+
+
+class TestClientTransport:
+    """Requests through Flask's test client; one client per thread."""
+
+    def __init__(self):
+        from main import app
+        self.app = app
+        self._local = threading.local()
+
+    def request(self, method, path, fields=None, photo=None):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        if method == 'GET':
+            response = client.get(path)
+        elif photo is not None:
+            data = dict(fields, photo=(io.BytesIO(photo), 'photo.jpg', 'image/jpeg'))
+            response = client.post(path, data=data, content_type='multipart/form-data')
+        else:
+            response = client.post(path, data=fields)
+        return response.status_code, response.get_json(silent=True)
+
+
+class HttpTransport:
+    """Requests over HTTP with the standard library."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, path, fields=None, photo=None):
+        headers = {}
+        body = None
+        if method == 'POST':
+            if photo is not None:
+                boundary = uuid.uuid4().hex
+                parts = [f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+                         for name, value in fields.items()]
+                parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="photo"; filename="photo.jpg"\r\n'
+                             f'Content-Type: image/jpeg\r\n\r\n'.encode() + photo + b'\r\n')
+                parts.append(f'--{boundary}--\r\n'.encode())
+                body = b''.join(parts)
+                headers['Content-Type'] = f'multipart/form-data; boundary={boundary}'
+            else:
+                body = urllib.parse.urlencode(fields).encode()
+                headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        req = urllib.request.Request(self.base_url + path, data=body, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(req, timeout=120) as response:
+                status, payload = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status, payload = e.code, e.read()
+        try:
+            return status, json.loads(payload)
+        except ValueError:
+            return status, None
+
+
+def start_gunicorn(env):
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    proc = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+                             '--bind', f'127.0.0.1:{port}', 'wsgi:application'],
+                            cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError('gunicorn exited during startup (is it installed?)')
+        try:
+            with urllib.request.urlopen(base_url + '/readyz', timeout=2):
+                return proc, base_url
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.25)
+    proc.terminate()
+    raise RuntimeError('gunicorn did not become ready within 60s')
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(records):
+    steps = {}
+    by_step = defaultdict(list)
+    for record in records:
+        by_step[record['step']].append(record)
+    for step, items in by_step.items():
+        latencies = sorted(r['seconds'] * 1000 for r in items)
+        steps[step] = {
+            'requests': len(items),
+            'p50_ms': round(_percentile(latencies, 50), 2),
+            'p95_ms': round(_percentile(latencies, 95), 2),
+            'p99_ms': round(_percentile(latencies, 99), 2),
+            'max_ms': round(latencies[-1], 2),
+            'status': dict(Counter(str(r['status']) for r in items)),
+        }
+    errors = Counter(f"{r['step']} {r['status']}: {r['error']}" for r in records if r['error'])
+    return steps, dict(errors.most_common())
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    tmp = tempfile.mkdtemp(prefix='lecture-rush-')
+    env = {
+        'DATABASE_URL': f"sqlite:///{os.path.join(tmp, 'load.db')}",
+        'UPLOAD_FOLDER': os.path.join(tmp, 'uploads'),
+    }
+    if args.pipeline:
+        env['PHOTO_PIPELINE_MODE'] = args.pipeline
+    os.environ.update(env)
+
+    courses = seed(args.courses, args.phones, rng)
+    phones = plan(courses, args, rng)
+    photos = [make_photo(args.seed + i, args.photo_kb * 1024) for i in range(args.photo_variants)]
+
+    server = None
+    if args.server == 'gunicorn':
+        server, base_url = start_gunicorn(dict(os.environ, PROMETHEUS_MULTIPROC_DIR=os.path.join(tmp, 'metrics')))
+        transport = HttpTransport(base_url)
+    else:
+        transport = TestClientTransport()
+
+    records = []
+    lock = threading.Lock()
+
+    def timed(step, method, path, fields=None, photo=None):
+        started = time.perf_counter()
+        error = None
+        try:
+            status, payload = transport.request(method, path, fields, photo)
+            if status >= 400 or (isinstance(payload, dict) and payload.get('success') is False):
+                error = (payload or {}).get('message', '')[:60] if isinstance(payload, dict) else ''
+        except Exception as e:
+            status, error = 'exception', type(e).__name__
+        with lock:
+            records.append({'step': step, 'status': status, 'seconds': time.perf_counter() - started,
+                            'error': error})
+
+    def phone(p, start):
+        delay = start + p['arrival'] - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        course = p['course']
+        timed('attend_page', 'GET', f"/attend/{course['department_id']}")
+        photo = unique_photo(photos[p['photo']], p['student_id'])
+        fields = {'student_id': p['student_id'], 'student_name': f"Student {p['student_id']}",
+                  'latitude': f"{p['latitude']:.7f}", 'longitude': f"{p['longitude']:.7f}"}
+        if p['data_url']:
+            fields['photo_path'] = 'data:image/jpeg;base64,' + base64.b64encode(photo).decode()
+            photo = None
+        path = f"/mark_attendance/{course['id']}"
+        for _ in range(2 if p['double_tap'] else 1):
+            timed('mark_attendance', 'POST', path, fields, photo)
+
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            for p in phones:
+                pool.submit(phone, p, start)
+        wall = time.perf_counter() - start
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    steps, errors = summarize(records)
+    report = {
+        'config': {key: value for key, value in vars(args).items() if key != 'out'},
+        'wall_seconds': round(wall, 2),
+        'requests_per_second': round(len(records) / wall, 1),
+        'submissions_per_second': round(steps.get('mark_attendance', {}).get('requests', 0) / wall, 1),
+        'steps': steps,
+        'errors': errors,
+    }
+    if args.server == 'testclient':
+        from main import app, Attendance, photo_pipeline
+        with app.app_context():
+            report['attendance_rows'] = Attendance.query.count()
+        photo_pipeline.shutdown()
+        report['photo_pipeline'] = photo_pipeline.stats()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--server', choices=['testclient', 'gunicorn'], default='testclient')
+    parser.add_argument('--phones', type=int, default=500)
+    parser.add_argument('--window', type=float, default=120.0, help='Seconds over which phones arrive (0: all at once)')
+    parser.add_argument('--concurrency', type=int, default=64, help='Phones in flight at once')
+    parser.add_argument('--courses', type=int, default=4, help='Lectures starting together')
+    parser.add_argument('--photo-kb', type=int, default=100)
+    parser.add_argument('--photo-variants', type=int, default=8, help='Distinct base photos to generate')
+    parser.add_argument('--data-url', type=float, default=0.2, help='Share of phones sending base64 data URLs')
+    parser.add_argument('--out-of-range', type=float, default=0.03, help='Share of phones outside the geofence')
+    parser.add_argument('--double-tap', type=float, default=0.02, help='Share of phones submitting twice')
+    parser.add_argument('--pipeline', choices=['process', 'thread', 'sync'],
+                        help='PHOTO_PIPELINE_MODE for the app (default: the app default)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--out', help='Also write the JSON report to this file')
+    args = parser.parse_args()
+
+    report = run(args)
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
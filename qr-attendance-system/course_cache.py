@@ -0,0 +1,35 @@
+"""Per-process cache of the course metadata used by mark_attendance.
+
+During a lecture the same handful of courses receive thousands of
+submissions in their attendance window, so the attendance path reads an
+immutable snapshot from here instead of loading the Course row each time.
+Routes that change courses invalidate entries explicitly (see ttl_cache.py).
+"""
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from ttl_cache import TTLCache
+
+# Students can mark attendance from the start time until this long after it
+ATTENDANCE_WINDOW = timedelta(minutes=30)
+
+
+class CourseSnapshot(namedtuple('CourseSnapshot', [
+        'id', 'department_id', 'course_code', 'instructor_id', 'latitude', 'longitude', 'max_distance',
+        'start_time', 'end_time'])):
+    """Detached, read-only copy of the Course fields needed to admit attendance."""
+
+    __slots__ = ()
+
+    @classmethod
+    def from_course(cls, course):
+        return cls(course.id, course.department_id, course.course_code, course.instructor_id, course.latitude,
+                   course.longitude, course.max_distance or 100.0, course.start_time, course.end_time)
+
+    def is_active(self, now=None):
+        now = now or datetime.now()
+        return self.start_time <= now <= self.start_time + ATTENDANCE_WINDOW
+
+
+class CourseCache(TTLCache):
+    """``course_id -> CourseSnapshot`` cache; ``loader(course_id)`` returns a snapshot or None."""
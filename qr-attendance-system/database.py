@@ -0,0 +1,90 @@
+"""Database engine configuration.
+
+Database is Flask-SQLAlchemy with two additions, both read from app.config
+when an engine is created, so a URI set after import still gets them:
+
+* Pool settings (DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT,
+  DB_POOL_RECYCLE) for any database. For SQLite, Flask-SQLAlchemy otherwise
+  opens a fresh connection for every checkout, which throws away the page
+  cache and re-runs the pragmas each request; a DB_POOL_SIZE of 0 keeps that.
+* SQLite pragmas applied to every new connection. WAL lets readers carry on
+  while a writer commits, and with synchronous=NORMAL a commit appends to
+  the WAL without an fsync (durable once checkpointed; a power cut can lose
+  the last commits but never corrupts the file). busy_timeout makes a
+  writer wait for the lock instead of failing with "database is locked".
+"""
+from functools import partial
+
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.pool import NullPool, QueuePool
+
+DEFAULT_DATABASE_URI = 'sqlite:///attendance.db'
+
+
+def database_url(url):
+    """Normalise a DATABASE_URL; SQLAlchemy 1.4 no longer accepts the ``postgres://`` scheme."""
+    if url.startswith('postgres://'):
+        return 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def sqlite_pragmas(config):
+    """PRAGMA statements, in order, for the SQLITE_* settings in ``config``."""
+    return [
+        f"PRAGMA journal_mode={config['SQLITE_JOURNAL_MODE']}",
+        f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}",
+        f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT_MS'])}",
+        f"PRAGMA mmap_size={int(config['SQLITE_MMAP_SIZE'])}",
+        # Negative sizes are in KiB rather than pages
+        f"PRAGMA cache_size=-{int(config['SQLITE_CACHE_SIZE_KB'])}",
+    ]
+
+
+def _apply_pragmas(pragmas, dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in pragmas:
+            cursor.execute(pragma)
+    finally:
+        cursor.close()
+
+
+def _is_memory(sa_url):
+    return sa_url.database in (None, '', ':memory:')
+
+
+class Database(SQLAlchemy):
+    """SQLAlchemy extension that applies the DB_* pool and SQLITE_* pragma settings."""
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        sqlite = sa_url.drivername.startswith('sqlite')
+        # An in-memory SQLite database lives in its one StaticPool connection
+        if not (sqlite and _is_memory(sa_url)):
+            pool_size = app.config['DB_POOL_SIZE']
+            options.setdefault('pool_size', pool_size)
+            if pool_size:
+                options.setdefault('max_overflow', app.config['DB_MAX_OVERFLOW'])
+                options.setdefault('pool_timeout', app.config['DB_POOL_TIMEOUT'])
+                options.setdefault('pool_recycle', app.config['DB_POOL_RECYCLE'])
+                if sqlite:
+                    # SQLAlchemy 1.4 defaults file databases to NullPool. Pooled connections
+                    # are handed between request threads, one at a time
+                    options.setdefault('poolclass', QueuePool)
+                    options.setdefault('connect_args', {}).setdefault('check_same_thread', False)
+        sa_url, options = super().apply_driver_hacks(app, sa_url, options)
+        if sqlite:
+            if options.get('poolclass') is NullPool:
+                # Set by Flask-SQLAlchemy for a pool size of 0; it takes no sizing arguments
+                for key in ('pool_size', 'max_overflow', 'pool_timeout', 'pool_recycle'):
+                    options.pop(key, None)
+            if not _is_memory(sa_url):
+                options['sqlite_pragmas'] = sqlite_pragmas(app.config)
+        return sa_url, options
+
+    def create_engine(self, sa_url, engine_opts):
+        pragmas = engine_opts.pop('sqlite_pragmas', None)
+        engine = super().create_engine(sa_url, engine_opts)
+        if pragmas:
+            event.listen(engine, 'connect', partial(_apply_pragmas, pragmas))
+        return engine
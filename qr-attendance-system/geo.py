@@ -0,0 +1,175 @@
+"""Distance helpers and a spatial index of active course geofences.
+
+Every distance in the app goes through haversine_distance. CourseLocator
+answers "which class am I in": it keeps the day's course snapshots in a
+grid of ``cell_degrees`` cells, each course registered in every cell its
+geofence's bounding box touches, so a GPS fix only looks at the courses in
+its own cell. Those are filtered by bounding box before any trigonometry,
+then by exact distance and the attendance window.
+"""
+import math
+import threading
+import time
+from datetime import datetime, timedelta
+
+from course_cache import ATTENDANCE_WINDOW
+
+EARTH_RADIUS_M = 6371000
+# Length of one degree of latitude, and of longitude at the equator
+METERS_PER_DEGREE = EARTH_RADIUS_M * math.pi / 180
+DEFAULT_MAX_DISTANCE = 100.0
+
+
+def haversine_distance(lat1, lon1, lat2, lon2):
+    """Distance in meters between two lat/lon points."""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    a = math.sin((phi2 - phi1) / 2) ** 2 + \
+        math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(min(a, 1.0)))
+
+
+def bounding_box(lat, lon, radius):
+    """``(min_lat, min_lon, max_lat, max_lon)`` enclosing the circle of ``radius`` meters around a point."""
+    dlat = radius / METERS_PER_DEGREE
+    cos_lat = math.cos(math.radians(lat))
+    # Near the poles a circle can span every longitude
+    dlon = 180.0 if cos_lat < 1e-6 else min(180.0, dlat / cos_lat)
+    return lat - dlat, lon - dlon, lat + dlat, lon + dlon
+
+
+def in_box(box, lat, lon):
+    min_lat, min_lon, max_lat, max_lon = box
+    return min_lat <= lat <= max_lat and min_lon <= lon <= max_lon
+
+
+class CourseLocator:
+    """Grid index of course geofences around the current day.
+
+    ``loader(since, until)`` returns the CourseSnapshots starting in that
+    range: the day, plus the ATTENDANCE_WINDOW before midnight, whose
+    sessions still take attendance after it. The index is loaded in full when first used, when the day
+    changes and every ``ttl`` seconds (edits made through other workers);
+    in between, course edits in this worker update it with ``update`` and
+    ``remove``.
+    """
+
+    def __init__(self, loader, ttl=60, cell_degrees=0.01):
+        self.loader = loader
+        self.ttl = ttl
+        self.cell_degrees = cell_degrees
+        self._lock = threading.Lock()
+        self._courses = {}  # course_id -> (snapshot, bounding box, cells)
+        self._cells = {}    # cell -> set of course ids
+        self._day = None
+        self._expires = 0.0
+        self._rebuilds = 0
+        self._updates = 0
+        self._lookups = 0
+        self._candidates = 0
+        self._distance_checks = 0
+
+    def _cell(self, lat, lon):
+        return math.floor(lat / self.cell_degrees), math.floor(lon / self.cell_degrees)
+
+    def _covered_cells(self, box):
+        min_lat, min_lon, max_lat, max_lon = box
+        (lat0, lon0), (lat1, lon1) = self._cell(min_lat, min_lon), self._cell(max_lat, max_lon)
+        return [(i, j) for i in range(lat0, lat1 + 1) for j in range(lon0, lon1 + 1)]
+
+    def _remove(self, course_id):
+        entry = self._courses.pop(course_id, None)
+        if entry is None:
+            return
+        for cell in entry[2]:
+            ids = self._cells[cell]
+            ids.discard(course_id)
+            if not ids:
+                del self._cells[cell]
+
+    def _add(self, snapshot):
+        self._remove(snapshot.id)
+        if snapshot.latitude is None or snapshot.longitude is None:
+            return
+        box = bounding_box(snapshot.latitude, snapshot.longitude, snapshot.max_distance or DEFAULT_MAX_DISTANCE)
+        cells = self._covered_cells(box)
+        self._courses[snapshot.id] = (snapshot, box, cells)
+        for cell in cells:
+            self._cells.setdefault(cell, set()).add(snapshot.id)
+
+    @staticmethod
+    def _day_range(now):
+        start = datetime.combine(now.date(), datetime.min.time())
+        return start - ATTENDANCE_WINDOW, start + timedelta(days=1)
+
+    def _ensure_loaded(self, now):
+        with self._lock:
+            if self._day == now.date() and self._expires > time.monotonic():
+                return
+        snapshots = self.loader(*self._day_range(now))
+        with self._lock:
+            self._courses.clear()
+            self._cells.clear()
+            for snapshot in snapshots:
+                self._add(snapshot)
+            self._day = now.date()
+            self._expires = time.monotonic() + self.ttl
+            self._rebuilds += 1
+
+    def update(self, snapshot):
+        """Add or move one course after it was created or edited."""
+        with self._lock:
+            if self._day is None:
+                return
+            self._updates += 1
+            start, end = self._day_range(datetime.combine(self._day, datetime.min.time()))
+            if start <= snapshot.start_time < end:
+                self._add(snapshot)
+            else:
+                self._remove(snapshot.id)
+
+    def remove(self, course_id):
+        with self._lock:
+            self._updates += 1
+            self._remove(course_id)
+
+    def invalidate(self):
+        """Reload the whole index on next use, after courses were changed in bulk."""
+        with self._lock:
+            self._expires = 0.0
+
+    def locate(self, lat, lon, now=None):
+        """Active courses whose geofence contains the point, nearest first, as ``(distance, snapshot)``."""
+        now = now or datetime.now()
+        self._ensure_loaded(now)
+        with self._lock:
+            self._lookups += 1
+            candidates = [self._courses[course_id] for course_id in self._cells.get(self._cell(lat, lon), ())]
+            self._candidates += len(candidates)
+        matches = []
+        checks = 0
+        for snapshot, box, _ in candidates:
+            if not in_box(box, lat, lon) or not snapshot.is_active(now):
+                continue
+            checks += 1
+            distance = haversine_distance(lat, lon, snapshot.latitude, snapshot.longitude)
+            if distance <= (snapshot.max_distance or DEFAULT_MAX_DISTANCE):
+                matches.append((distance, snapshot))
+        with self._lock:
+            self._distance_checks += checks
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+    def stats(self):
+        with self._lock:
+            return {
+                'courses': len(self._courses),
+                'cells': len(self._cells),
+                'cell_degrees': self.cell_degrees,
+                'ttl_seconds': self.ttl,
+                'rebuilds': self._rebuilds,
+                'updates': self._updates,
+                'lookups': self._lookups,
+                'avg_candidates': round(self._candidates / self._lookups, 2) if self._lookups else None,
+                'avg_distance_checks': round(self._distance_checks / self._lookups, 2) if self._lookups else None,
+            }
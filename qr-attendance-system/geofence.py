@@ -0,0 +1,114 @@
+"""Bulk geofence re-verification of stored attendance.
+
+Attendance rows keep the distance and verification result computed when
+they were submitted, so editing a course's coordinates or max_distance
+leaves them stale. ``reverify`` recomputes them for whole courses: rows are
+read in id order, ``chunk_rows`` at a time, into NumPy arrays, distances
+are computed for the whole chunk at once, and only rows whose result
+changed are written back, with one executemany UPDATE per chunk. Each
+chunk commits on its own, so a semester-wide re-audit never holds the
+SQLite write lock for long.
+
+The results match mark_attendance: a row is verified when both it and its
+course have coordinates and the distance is within the course's
+max_distance; otherwise its distance is cleared and it is unverified.
+"""
+import time
+
+import numpy as np
+from sqlalchemy import and_, bindparam, select
+
+from geo import DEFAULT_MAX_DISTANCE, EARTH_RADIUS_M
+
+CHUNK_ROWS = 5000
+# Stored distances closer than this to the recomputed one are left alone
+DISTANCE_TOLERANCE_M = 0.01
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """geo.haversine_distance over arrays of points, element-wise."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def _column(rows, index):
+    # NULLs become NaN, which propagates through the distance math
+    return np.array([np.nan if row[index] is None else row[index] for row in rows], dtype=np.float64)
+
+
+def evaluate(rows):
+    """Recompute a chunk of rows.
+
+    ``rows`` are ``(id, latitude, longitude, distance, verified, course_latitude,
+    course_longitude, max_distance)`` tuples. Returns ``(ids, distances, verified,
+    was_verified, changed)`` arrays, with NaN distances where either point has
+    no coordinates.
+    """
+    ids = np.array([row[0] for row in rows], dtype=np.int64)
+    lat, lon, stored = _column(rows, 1), _column(rows, 2), _column(rows, 3)
+    course_lat, course_lon, max_distance = _column(rows, 5), _column(rows, 6), _column(rows, 7)
+    was_verified = np.array([bool(row[4]) for row in rows], dtype=bool)
+
+    distances = haversine_m(lat, lon, course_lat, course_lon)
+    known = ~np.isnan(distances)
+    max_distance = np.where(np.isnan(max_distance), DEFAULT_MAX_DISTANCE, max_distance)
+    verified = known & (np.where(known, distances, np.inf) <= max_distance)
+
+    stored_known = ~np.isnan(stored)
+    same_distance = np.where(known & stored_known, np.abs(distances - stored) <= DISTANCE_TOLERANCE_M,
+                             known == stored_known)
+    changed = (verified != was_verified) | ~same_distance
+    return ids, distances, verified, was_verified, changed
+
+
+def reverify(engine, attendance, course, course_ids=None, since=None, until=None, chunk_rows=CHUNK_ROWS):
+    """Re-verify the attendance of ``course_ids`` (all courses when None).
+
+    ``attendance`` and ``course`` are the Table objects; ``since``/``until``
+    bound the attendance timestamps. Returns a dict of counts.
+    """
+    a, c = attendance.c, course.c
+    query = (
+        select(a.id, a.latitude, a.longitude, a.distance_from_class, a.location_verified,
+               c.latitude, c.longitude, c.max_distance)
+        .select_from(attendance.join(course, a.course_id == c.id))
+        .order_by(a.id)
+        .limit(chunk_rows)
+    )
+    conditions = []
+    if course_ids is not None:
+        conditions.append(a.course_id.in_(list(course_ids)))
+    if since is not None:
+        conditions.append(a.timestamp >= since)
+    if until is not None:
+        conditions.append(a.timestamp < until)
+
+    update = (
+        attendance.update()
+        .where(a.id == bindparam('_id'))
+        .values(distance_from_class=bindparam('_distance'), location_verified=bindparam('_verified'))
+    )
+
+    started = time.perf_counter()
+    result = {'rows': 0, 'updated': 0, 'newly_verified': 0, 'newly_unverified': 0, 'chunks': 0}
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(query.where(and_(a.id > last_id, *conditions))).all()
+            if not rows:
+                break
+            ids, distances, verified, was_verified, changed = evaluate(rows)
+            last_id = int(ids[-1])
+            if changed.any():
+                conn.execute(update, [
+                    {'_id': int(i), '_distance': None if np.isnan(d) else float(d), '_verified': bool(v)}
+                    for i, d, v in zip(ids[changed], distances[changed], verified[changed])
+                ])
+        result['rows'] += len(rows)
+        result['chunks'] += 1
+        result['updated'] += int(changed.sum())
+        result['newly_verified'] += int((verified & ~was_verified).sum())
+        result['newly_unverified'] += int((was_verified & ~verified).sum())
+    result['seconds'] = round(time.perf_counter() - started, 3)
+    return result
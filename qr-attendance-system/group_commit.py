@@ -0,0 +1,149 @@
+"""Write-behind group commit for attendance inserts.
+
+At the start of a lecture hundreds of submissions arrive within a minute,
+and committing each on its own costs one journal sync per student.
+GroupCommitter queues rows from request threads and a background thread
+inserts them in batches, one transaction per batch: a batch is flushed once
+``max_batch`` rows are waiting or ``max_delay`` seconds after its first row
+arrived. ``submit`` returns a Future that resolves to the new row's id once
+the transaction has committed (or to the error that stopped it), so a
+request that waits on it never acknowledges a row that is not yet durable.
+``shutdown`` flushes everything still queued before the worker exits.
+
+If a batch hits an IntegrityError, its rows are retried one transaction
+each, so only the offending row fails.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from sqlalchemy.exc import IntegrityError
+
+
+class GroupCommitter:
+    """Batches inserts into ``table`` on a background thread.
+
+    ``engine`` is a callable returning the engine to write with. Each flush
+    checks a connection out of its pool, so callers must not hold one while
+    they wait on a Future, or a full pool can deadlock.
+    ``on_flush(connection, rows)``, if given, runs inside each committed
+    transaction with the list of inserted values.
+    """
+
+    def __init__(self, engine, table, max_batch=50, max_delay=0.02, on_flush=None):
+        self.engine = engine
+        self.table = table
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.on_flush = on_flush
+        self._cond = threading.Condition()
+        self._pending = deque()
+        self._thread = None
+        self._closing = False
+        self._batches = 0
+        self._rows = 0
+        self._retried_batches = 0
+        self._failed_rows = 0
+        self._flush_seconds = 0.0
+        self._largest_batch = 0
+
+    def submit(self, values):
+        """Queue one row; returns a Future of its primary key."""
+        future = Future()
+        with self._cond:
+            if self._closing:
+                raise RuntimeError('The attendance writer has been shut down')
+            if self._thread is None:
+                # Started lazily so every gunicorn worker gets its own thread after the fork
+                self._thread = threading.Thread(target=self._run, name='group-commit', daemon=True)
+                self._thread.start()
+            self._pending.append((time.monotonic(), values, future))
+            # Wake the writer for the first row of a batch (to start its timer) and a full batch
+            if len(self._pending) == 1 or len(self._pending) >= self.max_batch:
+                self._cond.notify()
+        return future
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._pending:
+                if self._closing:
+                    return None
+                self._cond.wait()
+            # Wait for the batch to fill, but no longer than max_delay after its first row
+            deadline = self._pending[0][0] + self.max_delay
+            while len(self._pending) < self.max_batch and not self._closing:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return [self._pending.popleft() for _ in range(min(self.max_batch, len(self._pending)))]
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            self._flush(batch)
+
+    def _insert(self, rows):
+        insert = self.table.insert()
+        with self.engine().begin() as conn:
+            ids = [conn.execute(insert, values).inserted_primary_key[0] for values in rows]
+            if self.on_flush is not None:
+                self.on_flush(conn, rows)
+        return ids
+
+    def _flush(self, batch):
+        started = time.perf_counter()
+        rows = [values for _, values, _ in batch]
+        failed = 0
+        try:
+            ids = self._insert(rows)
+        except IntegrityError:
+            # Find the offending rows without failing the rest of the batch
+            with self._cond:
+                self._retried_batches += 1
+            for _, values, future in batch:
+                try:
+                    future.set_result(self._insert([values])[0])
+                except Exception as e:
+                    future.set_exception(e)
+                    failed += 1
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+            failed = len(batch)
+        else:
+            for (_, _, future), row_id in zip(batch, ids):
+                future.set_result(row_id)
+        with self._cond:
+            self._batches += 1
+            self._rows += len(batch) - failed
+            self._failed_rows += failed
+            self._largest_batch = max(self._largest_batch, len(batch))
+            self._flush_seconds += time.perf_counter() - started
+
+    def shutdown(self, timeout=None):
+        """Flush every queued row, then stop the background thread."""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'max_batch': self.max_batch,
+                'max_delay_ms': round(self.max_delay * 1000, 2),
+                'queued': len(self._pending),
+                'batches': self._batches,
+                'rows': self._rows,
+                'failed_rows': self._failed_rows,
+                'retried_batches': self._retried_batches,
+                'avg_batch_size': round((self._rows + self._failed_rows) / self._batches, 2) if self._batches else None,
+                'largest_batch': self._largest_batch,
+                'avg_flush_ms': round(self._flush_seconds * 1000 / self._batches, 3) if self._batches else None,
+            }
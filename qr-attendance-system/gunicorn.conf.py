@@ -1,4 +1,7 @@
+import glob
 import os
+import tempfile
+
 bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
 workers = 3
 worker_class = "gthread"
@@ -6,3 +9,19 @@ threads = 4
 timeout = 120
 keepalive = 5
 loglevel = "info"
+
+# Workers keep their metrics in files here so /metrics can add up all of them (see metrics.py)
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'qr-attendance-metrics'))
+
+
+def on_starting(server):
+    # Files left by a previous run would be added to this run's counters
+    path = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    os.makedirs(path, exist_ok=True)
+    for stale in glob.glob(os.path.join(path, '*.db')):
+        os.remove(stale)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -1,33 +1,137 @@
-from flask import Flask, render_template, redirect, url_for, flash, request, send_from_directory, jsonify
-from flask_sqlalchemy import SQLAlchemy
+from flask import Flask, render_template, redirect, url_for, flash, request, jsonify, abort, \
+    Response, send_file, stream_with_context
+from flask_migrate import Migrate
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import RequestEntityTooLarge
 from datetime import datetime, date, timedelta
 import os
 from PIL import Image
-import qrcode
+import time
 import base64
 import io
-from functools import wraps
-import math
-from sqlalchemy import text
+from functools import wraps, partial
+import atexit
+import threading
+import hashlib
+import mimetypes
+import json
+import zipfile
+import tempfile
+import click
+from sqlalchemy import text, or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, contains_eager
+from pagination import keyset_paginate
+from photo_pipeline import PhotoPipeline, sniff_photo, make_derivative, PHOTO_EXTENSIONS, PHOTO_SIZES
+from admission import AdmissionStats
+from course_cache import ATTENDANCE_WINDOW, CourseCache, CourseSnapshot
+from user_cache import UserCache, UserSnapshot
+from page_cache import PageCache
+from stats import StatCounters
+from group_commit import GroupCommitter
+from spreadsheets import iter_csv, iter_xlsx, gzip_chunks
+from roster import BATCH_ROWS, RosterImport, parse_roster, read_roster
+from analytics import ON_TIME_MINUTES, AttendanceAnalytics
+from rollups import DailyRollups
+from recurrence import WEEKDAY_NAMES, SessionScheduler, format_weekdays, parse_weekdays
+from qr_codes import QR_FORMATS, QRImageCache, QRSigner
+from storage import PhotoStore, create_backend
+import geofence
+import metrics
+from database import DEFAULT_DATABASE_URI, Database, database_url
+from geo import CourseLocator, haversine_distance
 
 
 app = Flask(__name__, template_folder='app/templates',static_folder="app/static")
 app.config['SECRET_KEY'] = 'savethebest123boom'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///attendance.db'
-app.config['UPLOAD_FOLDER'] = 'uploads'
+# Any SQLAlchemy URL, e.g. postgresql+psycopg2://...; relative SQLite paths are under the app directory
+app.config['SQLALCHEMY_DATABASE_URI'] = database_url(os.environ.get('DATABASE_URL', DEFAULT_DATABASE_URI))
+app.config['UPLOAD_FOLDER'] = os.environ.get('UPLOAD_FOLDER', 'uploads')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-# Create uploads directory if it doesn't exist
-uploads_dir = os.path.abspath("uploads")  
-print(f"Uploads directory: {uploads_dir}")  
-os.makedirs(uploads_dir, exist_ok=True) 
-
-db = SQLAlchemy(app)
+# Upper bound on any request body; attend.html recompresses photos above 5 MB
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_CONTENT_LENGTH', 10 * 1024 * 1024))
+# 'process', 'thread' or 'sync' (inline, for tests)
+app.config['PHOTO_PIPELINE_MODE'] = os.environ.get('PHOTO_PIPELINE_MODE', 'process')
+app.config['PHOTO_PIPELINE_WORKERS'] = int(os.environ.get('PHOTO_PIPELINE_WORKERS', 2))
+# Safety net for course snapshots cached by other workers after an edit
+app.config['COURSE_CACHE_TTL_SECONDS'] = int(os.environ.get('COURSE_CACHE_TTL_SECONDS', 60))
+# How long other workers may keep a user's old role, or a deleted user logged in
+app.config['USER_CACHE_TTL_SECONDS'] = int(os.environ.get('USER_CACHE_TTL_SECONDS', 60))
+# How long other workers may serve the departments and attend pages from before an edit
+app.config['PAGE_CACHE_TTL_SECONDS'] = int(os.environ.get('PAGE_CACHE_TTL_SECONDS', 30))
+# How often dashboard counters are reconciled against real COUNT(*)s
+app.config['STATS_TTL_SECONDS'] = int(os.environ.get('STATS_TTL_SECONDS', 300))
+# How long analytics for date ranges that have ended are reused
+app.config['ANALYTICS_CACHE_TTL_SECONDS'] = int(os.environ.get('ANALYTICS_CACHE_TTL_SECONDS', 3600))
+# Sessions of recurring courses exist this many days ahead; flask generate-sessions goes further
+app.config['SESSION_HORIZON_DAYS'] = int(os.environ.get('SESSION_HORIZON_DAYS', 14))
+# Course QR codes rotate every QR_ROTATION_SECONDS; a scanned token is accepted for QR_TOKEN_MAX_AGE_SECONDS
+app.config['QR_ROTATION_SECONDS'] = int(os.environ.get('QR_ROTATION_SECONDS', 30))
+app.config['QR_TOKEN_MAX_AGE_SECONDS'] = int(os.environ.get('QR_TOKEN_MAX_AGE_SECONDS', 300))
+app.config['QR_CACHE_SIZE'] = int(os.environ.get('QR_CACHE_SIZE', 256))
+# When enabled, mark_attendance only admits submissions made through a scanned QR code
+app.config['QR_TOKEN_REQUIRED'] = os.environ.get('QR_TOKEN_REQUIRED', '0') == '1'
+# Photo storage: 'local' (files under UPLOAD_FOLDER), 's3' (an S3-compatible bucket, endpoint optional
+# for MinIO and the like) or 's3-local' (the object-store code path against a directory stand-in)
+app.config['PHOTO_STORAGE'] = os.environ.get('PHOTO_STORAGE', 'local')
+app.config['PHOTO_S3_BUCKET'] = os.environ.get('PHOTO_S3_BUCKET')
+app.config['PHOTO_S3_PREFIX'] = os.environ.get('PHOTO_S3_PREFIX', '')
+app.config['PHOTO_S3_ENDPOINT_URL'] = os.environ.get('PHOTO_S3_ENDPOINT_URL')
+# Connections pooled per worker process; 0 opens a new SQLite connection for every checkout
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 5))
+app.config['DB_MAX_OVERFLOW'] = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+app.config['DB_POOL_TIMEOUT'] = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+app.config['DB_POOL_RECYCLE'] = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+# Applied to every SQLite connection, see database.py
+app.config['SQLITE_JOURNAL_MODE'] = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+app.config['SQLITE_SYNCHRONOUS'] = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 10000))
+app.config['SQLITE_MMAP_SIZE'] = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+app.config['SQLITE_CACHE_SIZE_KB'] = int(os.environ.get('SQLITE_CACHE_SIZE_KB', 64 * 1024))
+# Write-behind group commit: mark_attendance inserts are committed in batches of up to
+# ATTENDANCE_BATCH_SIZE rows, at most ATTENDANCE_BATCH_MS after the first one arrives
+app.config['ATTENDANCE_WRITE_BEHIND'] = os.environ.get('ATTENDANCE_WRITE_BEHIND', '0') == '1'
+app.config['ATTENDANCE_BATCH_SIZE'] = int(os.environ.get('ATTENDANCE_BATCH_SIZE', 50))
+app.config['ATTENDANCE_BATCH_MS'] = int(os.environ.get('ATTENDANCE_BATCH_MS', 20))
+# /readyz reports not ready when a SELECT 1 round trip takes longer than this
+app.config['READINESS_MAX_DB_MS'] = float(os.environ.get('READINESS_MAX_DB_MS', 500))
+
+# Relative upload folders are resolved against the app, not the working directory
+uploads_dir = os.path.join(app.root_path, app.config['UPLOAD_FOLDER'])
+print(f"Uploads directory: {uploads_dir}")
+photo_store = PhotoStore(create_backend(
+    app.config['PHOTO_STORAGE'],
+    uploads_dir,
+    bucket=app.config['PHOTO_S3_BUCKET'],
+    prefix=app.config['PHOTO_S3_PREFIX'],
+    endpoint_url=app.config['PHOTO_S3_ENDPOINT_URL']
+))
+
+db = Database(app)
+migrate = Migrate(app, db, render_as_batch=True)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
+metrics.init_app(app)
+
+photo_pipeline = PhotoPipeline(
+    mode=app.config['PHOTO_PIPELINE_MODE'],
+    workers=app.config['PHOTO_PIPELINE_WORKERS']
+)
+atexit.register(photo_pipeline.shutdown)
+admission_stats = AdmissionStats(listener=metrics.record_admission)
+qr_signer = QRSigner(
+    app.config['SECRET_KEY'],
+    interval=app.config['QR_ROTATION_SECONDS'],
+    max_age=app.config['QR_TOKEN_MAX_AGE_SECONDS']
+)
+qr_images = QRImageCache(maxsize=app.config['QR_CACHE_SIZE'])
+
+# Base64 characters decoded to sniff a data-URL photo header (a multiple of 4, ~48 KB of image)
+SNIFF_BASE64_CHARS = 65536
+# A photo derivative never changes under its URL, so browsers may keep it this long
+PHOTO_CACHE_SECONDS = 365 * 24 * 3600
 
 # Database Models
 class User(UserMixin, db.Model):
@@ -67,15 +171,88 @@ class Course(db.Model):
     max_distance = db.Column(db.Float, default=100.0)  # Maximum distance in meters
     year = db.Column(db.Integer, nullable=False)  # 100, 200, 300, 400, 500, 600
     session = db.Column(db.String(20), nullable=False)  # weekend, regular, evening
+    series_id = db.Column(db.Integer, db.ForeignKey('course_series.id'))  # set on sessions of a recurring course
+    
+    __table_args__ = (
+        db.Index('ix_course_department_start', 'department_id', 'start_time'),  # attend()
+        db.Index('ix_course_instructor_start', 'instructor_id', 'start_time'),  # view_course()
+        db.Index('ix_course_start_end', 'start_time', 'end_time'),  # active courses
+        db.Index('ix_course_series_start', 'series_id', 'start_time', unique=True),  # one session per slot
+    )
     
     def is_active(self):
         """Check if the course is currently active (within 30 minutes of start time)"""
         now = datetime.now()
-        return self.start_time <= now <= (self.start_time + timedelta(minutes=30))
+        return self.start_time <= now <= (self.start_time + ATTENDANCE_WINDOW)
     
     def attendance_count(self):
         """Get the number of students who attended this course"""
+        # Set by preload_attendance_counts() when a whole list of courses is rendered
+        preloaded = getattr(self, '_attendance_count', None)
+        if preloaded is not None:
+            return preloaded
         return Attendance.query.filter_by(course_id=self.id).count()
+    
+    @staticmethod
+    def preload_attendance_counts(courses):
+        """Fill attendance_count() for many courses with a single GROUP BY query"""
+        courses = list(courses)
+        if not courses:
+            return courses
+        rows = db.session.query(Attendance.course_id, db.func.count(Attendance.id))\
+                         .filter(Attendance.course_id.in_([c.id for c in courses]))\
+                         .group_by(Attendance.course_id).all()
+        counts = dict(rows)
+        for course in courses:
+            course._attendance_count = counts.get(course.id, 0)
+        return courses
+
+class CourseSeries(db.Model):
+    """A course meeting every week; SessionScheduler materializes its sessions as Course rows"""
+    id = db.Column(db.Integer, primary_key=True)
+    course_name = db.Column(db.String(100), nullable=False)
+    course_code = db.Column(db.String(10), nullable=False)
+    class_location = db.Column(db.String(100), nullable=False)
+    instructor_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    department_id = db.Column(db.Integer, db.ForeignKey('department.id'), nullable=False)
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    max_distance = db.Column(db.Float, default=100.0)
+    year = db.Column(db.Integer, nullable=False)
+    session = db.Column(db.String(20), nullable=False)
+    weekdays = db.Column(db.String(20), nullable=False)  # e.g. '0,2' for Mondays and Wednesdays
+    start_clock = db.Column(db.Time, nullable=False)
+    duration_minutes = db.Column(db.Integer, nullable=False)
+    first_date = db.Column(db.Date, nullable=False)
+    last_date = db.Column(db.Date, nullable=False)
+    generated_until = db.Column(db.Date, nullable=False)  # sessions exist up to this date
+    sessions = db.relationship('Course', backref='series', lazy=True)
+
+    def weekday_numbers(self):
+        return parse_weekdays(self.weekdays)
+
+    def weekday_names(self):
+        return ', '.join(WEEKDAY_NAMES[day] for day in self.weekday_numbers())
+
+    def first_session_times(self):
+        start = datetime.combine(self.first_date, self.start_clock)
+        return start, start + timedelta(minutes=self.duration_minutes)
+
+class SeriesException(db.Model):
+    """A date on which a recurring course does not meet"""
+    id = db.Column(db.Integer, primary_key=True)
+    series_id = db.Column(db.Integer, db.ForeignKey('course_series.id', ondelete='CASCADE'), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('series_id', 'date', name='uq_series_exception_date'),
+    )
+
+class Holiday(db.Model):
+    """A date on which no recurring course meets"""
+    id = db.Column(db.Integer, primary_key=True)
+    date = db.Column(db.Date, nullable=False, unique=True)
+    name = db.Column(db.String(100), nullable=False)
 
 class Student(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -96,8 +273,26 @@ class Attendance(db.Model):
     longitude = db.Column(db.Float, nullable=False)
     distance_from_class = db.Column(db.Float)  # Distance from class location in meters
     location_verified = db.Column(db.Boolean, default=False)  # NEW: GPS verification status
+    photo_status = db.Column(db.String(20), default='ready')  # pending until the photo pipeline finishes
+    idempotency_key = db.Column(db.String(64), unique=True, index=True)  # client-supplied, replays return the original result
     course = db.relationship('Course', backref='attendances')
 
+    __table_args__ = (
+        # One check-in per student per course; also closes the duplicate-check race
+        db.Index('uq_attendance_student_course', 'student_id', 'course_id', unique=True),
+        db.Index('ix_attendance_course_timestamp', 'course_id', 'timestamp'),  # reports
+        db.Index('ix_attendance_timestamp', 'timestamp', 'id'),  # admin list keyset
+        db.Index('ix_attendance_location_verified', 'location_verified'),
+        db.Index('ix_attendance_photo_path', 'photo_path'),  # reference check before deleting a stored photo
+    )
+
+    def photo_url(self, size='small'):
+        """URL of this photo at 'small', 'medium' or 'full' size"""
+        # Derivatives are only final once the pipeline is done; until then show the original
+        if size == 'full' or self.photo_status in ('pending', 'failed'):
+            return url_for('uploaded_file', filename=self.photo_path)
+        return url_for('photo', size=size, key=self.photo_path)
+
     def is_within_class_location(self):
         """
         True if student's coordinates are within the course's max_distance.
@@ -113,24 +308,188 @@ class Attendance(db.Model):
             return d <= (self.course.max_distance or 100.0)
         return False
 
-def haversine_distance(lat1, lon1, lat2, lon2):
-    """
-    Returns the distance in meters between two lat/lon points.
+class StatCounter(db.Model):
+    """Materialized dashboard counter, maintained by the StatCounters event hooks"""
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+    reconciled_at = db.Column(db.DateTime)
+    drift = db.Column(db.Integer, default=0)  # value minus real count at the last reconciliation
+
+class CourseDailyAttendance(db.Model):
+    """Check-ins per course code and session day, maintained by DailyRollups"""
+    department_id = db.Column(db.Integer, primary_key=True)
+    course_code = db.Column(db.String(10), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    checkins = db.Column(db.Integer, nullable=False, default=0)
+    verified = db.Column(db.Integer, nullable=False, default=0)
+    on_time = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('ix_course_daily_attendance_day', 'day'),  # rebuild
+    )
+
+class DepartmentDailyAttendance(db.Model):
+    """Check-ins per department and session day, maintained by DailyRollups"""
+    department_id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    checkins = db.Column(db.Integer, nullable=False, default=0)
+    verified = db.Column(db.Integer, nullable=False, default=0)
+    on_time = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('ix_department_daily_attendance_day', 'day'),  # dashboard charts across departments
+    )
+
+def _load_course_snapshot(course_id):
+    course = Course.query.get(course_id)
+    return CourseSnapshot.from_course(course) if course else None
+
+course_cache = CourseCache(_load_course_snapshot, ttl=app.config['COURSE_CACHE_TTL_SECONDS'])
+
+def _load_located_courses(since, until):
+    courses = Course.query.filter(Course.start_time >= since, Course.start_time < until,
+                                  Course.latitude.isnot(None), Course.longitude.isnot(None)).all()
+    return [CourseSnapshot.from_course(course) for course in courses]
+
+course_locator = CourseLocator(_load_located_courses, ttl=app.config['COURSE_CACHE_TTL_SECONDS'])
+
+page_cache = PageCache(ttl=app.config['PAGE_CACHE_TTL_SECONDS'])
+
+def cached_page(page, key, render):
+    """Response for a page from page_cache, or 304 when the browser's copy is current"""
+    entry = page_cache.get(page, key, render)
+    response = Response(entry.body, mimetype='text/html')
+    response.set_etag(entry.etag)
+    response.last_modified = entry.last_modified
+    # Browsers revalidate every time, so an edit shows up as soon as the cache is invalidated
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+dashboard_stats = StatCounters(db, StatCounter, ttl=app.config['STATS_TTL_SECONDS'])
+dashboard_stats.register('total_users', User, lambda: User.query.count())
+dashboard_stats.register('total_instructors', User, lambda: User.query.filter_by(role='instructor').count(),
+                         attr='role', value='instructor')
+dashboard_stats.register('total_departments', Department, lambda: Department.query.count())
+dashboard_stats.register('total_courses', Course, lambda: Course.query.count())
+dashboard_stats.register('total_students', Student, lambda: Student.query.count())
+dashboard_stats.register('total_attendance', Attendance, lambda: Attendance.query.count())
+dashboard_stats.register('verified_attendance', Attendance,
+                         lambda: Attendance.query.filter_by(location_verified=True).count(),
+                         attr='location_verified', value=True)
+
+session_scheduler = SessionScheduler(
+    lambda: db.get_engine(app),
+    CourseSeries.__table__, Course.__table__, SeriesException.__table__, Holiday.__table__,
+    horizon_days=app.config['SESSION_HORIZON_DAYS'],
+    on_insert=lambda conn, rows: record_core_inserts(conn, Course, rows),
+    lock_path=os.path.join(tempfile.gettempdir(), 'qr-attendance-sessions.lock')
+)
+
+daily_rollups = DailyRollups(
+    lambda: db.get_engine(app),
+    CourseDailyAttendance.__table__, DepartmentDailyAttendance.__table__, Course.__table__, Attendance.__table__
+)
+daily_rollups.listen(Attendance, Course)
+
+def record_core_inserts(connection, model, rows):
+    """Bookkeeping for rows of ``model`` inserted with Core statements on ``connection``.
+
+    Bulk writers (the attendance group committer, the roster import and the
+    session scheduler) insert with Core, which skips the mapper events that
+    keep the dashboard counters and the daily rollups; they call this inside
+    each transaction instead.
     """
-    R = 6371000  # radius of Earth in meters
-    phi1 = math.radians(lat1)
-    phi2 = math.radians(lat2)
-    dphi = math.radians(lat2 - lat1)
-    dlambda = math.radians(lon2 - lon1)
+    dashboard_stats.record_inserts(connection, model, rows)
+    if model is Attendance:
+        daily_rollups.record_inserts(connection, rows)
+
+attendance_analytics = AttendanceAnalytics(
+    lambda: db.get_engine(app),
+    Course.__table__, Student.__table__, Attendance.__table__, Department.__table__,
+    ttl=app.config['ANALYTICS_CACHE_TTL_SECONDS']
+)
+
+def materialize_sessions(series_ids=None, horizon_days=None):
+    """Create the sessions of recurring courses up to the horizon, see SessionScheduler.materialize"""
+    result = session_scheduler.materialize(series_ids, horizon_days=horizon_days)
+    if result['sessions']:
+        course_locator.invalidate()
+        page_cache.invalidate('attend')
+    return result
+
+def reconcile_series(series_ids):
+    """Apply series, exception or holiday changes to sessions that haven't started, see SessionScheduler.reconcile"""
+    totals = {'updated': 0, 'deleted': 0, 'inserted': 0}
+    for series_id in series_ids:
+        result = session_scheduler.reconcile(series_id)
+        for course_id in result['course_ids']:
+            course_cache.invalidate(course_id)
+        for key in totals:
+            totals[key] += result[key]
+    if totals['deleted']:
+        # Core deletes bypass the total_courses counter's mapper events
+        dashboard_stats.mark_stale()
+    course_locator.invalidate()
+    page_cache.invalidate('attend')
+    return totals
+
+def _extend_session_horizon():
+    with app.app_context():
+        try:
+            materialize_sessions()
+        except Exception:
+            app.logger.exception('Could not materialize recurring course sessions')
+
+@app.before_request
+def extend_session_horizon():
+    # Once a day per worker, in the background, so the rolling horizon moves without a scheduled job
+    session_scheduler.ensure_horizon(_extend_session_horizon)
+
+attendance_writer = None
+if app.config['ATTENDANCE_WRITE_BEHIND']:
+    attendance_writer = GroupCommitter(
+        lambda: db.get_engine(app),
+        Attendance.__table__,
+        max_batch=app.config['ATTENDANCE_BATCH_SIZE'],
+        max_delay=app.config['ATTENDANCE_BATCH_MS'] / 1000,
+        on_flush=lambda conn, rows: record_core_inserts(conn, Attendance, rows)
+    )
+    atexit.register(attendance_writer.shutdown)
+
+# How far ahead of its first session a course may repeat weekly
+MAX_SERIES_SPAN = timedelta(days=366)
 
-    a = math.sin(dphi / 2) ** 2 + \
-        math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    return R * c
+# Upper bound on how long a request waits for its batch to commit
+ATTENDANCE_WRITE_TIMEOUT = 30
+
+def save_attendance(values, course):
+    """Insert an Attendance row from column ``values`` and return its id once committed.
+
+    ``course`` is the CourseSnapshot checked into. Goes through the
+    write-behind buffer when it is enabled. Raises IntegrityError if the row
+    violates a unique index.
+    """
+    if attendance_writer is not None:
+        # The session fields ride along for record_core_inserts; the insert ignores them
+        future = attendance_writer.submit(dict(values, department_id=course.department_id,
+                                               course_code=course.course_code, start_time=course.start_time))
+        # Hand the request's connection back while waiting, so the writer can always get one
+        db.session.close()
+        return future.result(timeout=ATTENDANCE_WRITE_TIMEOUT)
+    attendance = Attendance(**values)
+    db.session.add(attendance)
+    db.session.commit()
+    return attendance.id
+
+def _load_user_snapshot(user_id):
+    user = User.query.get(user_id)
+    return UserSnapshot.from_user(user) if user else None
+
+user_cache = UserCache(_load_user_snapshot, ttl=app.config['USER_CACHE_TTL_SECONDS'])
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return user_cache.get(int(user_id))
 
 def admin_required(f):
     @wraps(f)
@@ -141,20 +500,124 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-def calculate_distance(lat1, lon1, lat2, lon2):
-    """Calculate distance between two points using Haversine formula"""
-    from math import radians, cos, sin, asin, sqrt
-    
-    # Convert decimal degrees to radians
-    lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
-    
-    # Haversine formula
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-    c = 2 * asin(sqrt(a))
-    r = 6371000  # Radius of earth in meters
-    return c * r
+def rebuild_rollups(course_ids=None):
+    """Rebuild the daily rollups of the days ``course_ids`` (all courses when None) were held on"""
+    query = db.session.query(db.func.min(Course.start_time), db.func.max(Course.start_time))
+    if course_ids is not None:
+        query = query.filter(Course.id.in_(course_ids))
+    first, last = query.one()
+    if first is None:
+        return None
+    return daily_rollups.backfill(first.date(), last.date())
+
+def reverify_attendance(course_ids=None, since=None, until=None):
+    """Recompute the stored geofence results of attendance, see geofence.reverify"""
+    result = geofence.reverify(db.get_engine(app), Attendance.__table__, Course.__table__,
+                               course_ids=course_ids, since=since, until=until)
+    if result['newly_verified'] or result['newly_unverified']:
+        # The bulk UPDATEs bypass the verified_attendance counter's and the rollups' mapper events
+        dashboard_stats.mark_stale()
+        rebuild_rollups(course_ids)
+    return result
+
+def paginate(query, columns, descending=False):
+    """Keyset-paginate ``query`` using the after/before/per_page request arguments"""
+    return keyset_paginate(
+        query, columns,
+        after=request.args.get('after'),
+        before=request.args.get('before'),
+        per_page=request.args.get('per_page', type=int),
+        descending=descending
+    )
+
+def attendance_filters(args):
+    """Parse the admin attendance filters; raises ValueError on a malformed date"""
+    filters = {
+        'course_id': args.get('course_id', type=int),
+        'department_id': args.get('department_id', type=int),
+        'date_from': args.get('date_from') or None,
+        'date_to': args.get('date_to') or None,
+        'verified': args.get('verified') if args.get('verified') in ('0', '1') else None,
+        'student': (args.get('student') or '').strip() or None,
+    }
+    for key in ('date_from', 'date_to'):
+        if filters[key]:
+            datetime.strptime(filters[key], '%Y-%m-%d')
+    return filters
+
+def apply_attendance_filters(query, filters):
+    """Apply attendance_filters() to a query that already joins Attendance to Course"""
+    if filters['course_id']:
+        query = query.filter(Attendance.course_id == filters['course_id'])
+    if filters['department_id']:
+        query = query.filter(Course.department_id == filters['department_id'])
+    if filters['date_from']:
+        query = query.filter(Attendance.timestamp >= datetime.strptime(filters['date_from'], '%Y-%m-%d'))
+    if filters['date_to']:
+        day_after = datetime.strptime(filters['date_to'], '%Y-%m-%d') + timedelta(days=1)
+        query = query.filter(Attendance.timestamp < day_after)
+    if filters['verified'] is not None:
+        query = query.filter(Attendance.location_verified == (filters['verified'] == '1'))
+    if filters['student']:
+        query = query.filter(or_(
+            Attendance.student_id.like(f"{filters['student']}%"),
+            Attendance.student_name.ilike(f"%{filters['student']}%")
+        ))
+    return query
+
+def filtered_attendance_query(filters):
+    """Attendance joined to Course with the server-side filters from attendance_filters()"""
+    query = Attendance.query.join(Course).options(contains_eager(Attendance.course))
+    return apply_attendance_filters(query, filters)
+
+ATTENDANCE_EXPORT_HEADER = ['Student ID', 'Student Name', 'Course Code', 'Course Name', 'Department',
+                            'Timestamp', 'Latitude', 'Longitude', 'Distance (m)', 'GPS Verified']
+EXPORT_CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+EXPORT_YIELD_PER = 2000
+
+def export_attendance(filters, fmt, filename):
+    """Stream the filtered attendance as CSV or XLSX.
+
+    Rows are plain column tuples fetched with yield_per and written out as
+    they arrive, so memory stays flat however many rows match. CSV is
+    gzipped when the client accepts it, or served as a .csv.gz file with
+    ?gzip=1. XLSX is already deflated.
+    """
+    if fmt not in EXPORT_CONTENT_TYPES:
+        abort(404)
+
+    query = db.session.query(
+        Attendance.student_id, Attendance.student_name, Course.course_code, Course.course_name,
+        Department.code, Attendance.timestamp, Attendance.latitude, Attendance.longitude,
+        Attendance.distance_from_class, Attendance.location_verified
+    ).join(Course, Attendance.course_id == Course.id).outerjoin(Department, Course.department_id == Department.id)
+    query = apply_attendance_filters(query, filters)
+    query = query.order_by(Attendance.timestamp, Attendance.id).yield_per(EXPORT_YIELD_PER)
+
+    rows = ((r[0], r[1], r[2], r[3], r[4], r[5], r[6], r[7],
+             round(r[8], 1) if r[8] is not None else None,
+             'Yes' if r[9] else 'No') for r in query)
+
+    filename = secure_filename(filename) or 'attendance'
+    content_type = EXPORT_CONTENT_TYPES[fmt]
+    headers = {}
+    if fmt == 'xlsx':
+        chunks = iter_xlsx(ATTENDANCE_EXPORT_HEADER, rows, sheet_name='Attendance')
+    else:
+        chunks = iter_csv(ATTENDANCE_EXPORT_HEADER, rows)
+        headers['Vary'] = 'Accept-Encoding'
+        if request.args.get('gzip') == '1':
+            chunks = gzip_chunks(chunks)
+            content_type = 'application/gzip'
+            fmt = 'csv.gz'
+        elif 'gzip' in request.accept_encodings:
+            chunks = gzip_chunks(chunks)
+            headers['Content-Encoding'] = 'gzip'
+    headers['Content-Disposition'] = f'attachment; filename="{filename}.{fmt}"'
+    return Response(stream_with_context(chunks), content_type=content_type, headers=headers)
 
 # Routes
 @app.route('/')
@@ -167,34 +630,50 @@ def home():
 @admin_required
 def admin_dashboard():
     """Admin dashboard showing overview statistics"""
-    stats = {
-        'total_users': User.query.count(),
-        'total_instructors': User.query.filter_by(role='instructor').count(),
-        'total_departments': Department.query.count(),
-        'total_courses': Course.query.count(),
-        'total_students': Student.query.count(),
-        'total_attendance': Attendance.query.count(),
-        'active_courses': Course.query.filter(
-            Course.start_time <= datetime.now(),
-            Course.end_time >= datetime.now()
-        ).count(),
-        'verified_attendance': Attendance.query.filter_by(location_verified=True).count()
-    }
+    stats = dashboard_stats.values()
+    # Depends on the clock rather than on writes, so it is not materialized
+    now = datetime.now()
+    stats['active_courses'] = Course.query.filter(
+        Course.start_time <= now,
+        Course.end_time >= now
+    ).count()
     
     # Recent activities
     recent_attendance = Attendance.query.order_by(Attendance.timestamp.desc()).limit(5).all()
     recent_courses = Course.query.order_by(Course.id.desc()).limit(5).all()
-    
-    return render_template('admin/dashboard.html', stats=stats, 
-                         recent_attendance=recent_attendance, recent_courses=recent_courses)
+
+    # The charts read the daily rollups: two years are at most a few hundred rows per department
+    department_id = request.args.get('department_id', type=int)
+    today = date.today()
+    days = {row['day']: row for row in daily_rollups.department_days(
+        db.session.connection(), date(today.year - 1, 1, 1), today, department_id)}
+    recent_days = []
+    for offset in range(29, -1, -1):
+        day = today - timedelta(days=offset)
+        row = days.get(day, {'checkins': 0, 'verified': 0, 'on_time': 0})
+        recent_days.append({'day': day.strftime('%b %d'), 'checkins': row['checkins'],
+                            'verified': row['verified'], 'on_time': row['on_time']})
+    months = {today.year - 1: [0] * 12, today.year: [0] * 12}
+    for day, row in days.items():
+        months[day.year][day.month - 1] += row['checkins']
+
+    return render_template('admin/dashboard.html', stats=stats,
+                         recent_attendance=recent_attendance, recent_courses=recent_courses,
+                         departments=Department.query.order_by(Department.name).all(),
+                         department_id=department_id, recent_days=recent_days,
+                         months=[{'year': year, 'checkins': counts} for year, counts in sorted(months.items())])
 
 # USER MANAGEMENT
 @app.route('/admin/users')
 @login_required
 @admin_required
 def admin_users():
-    users = User.query.all()
-    return render_template('admin/users.html', users=users)
+    try:
+        page = paginate(User.query, [User.id])
+    except ValueError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('admin_users'))
+    return render_template('admin/users.html', users=page.items, page=page)
 
 @app.route('/admin/users/create', methods=['POST'])
 @login_required
@@ -244,6 +723,9 @@ def admin_update_user(user_id):
             user.set_password(request.form['password'])
         
         db.session.commit()
+        user_cache.invalidate(user.id)
+        # Instructor names appear on the attend pages
+        page_cache.invalidate('attend')
         flash('User updated successfully!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -263,6 +745,7 @@ def admin_delete_user(user_id):
         
         db.session.delete(user)
         db.session.commit()
+        user_cache.invalidate(user_id)
         flash('User deleted successfully!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -298,6 +781,7 @@ def admin_create_department():
         department = Department(name=name, code=code, description=description)
         db.session.add(department)
         db.session.commit()
+        page_cache.invalidate()
         flash('Department created successfully!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -323,6 +807,7 @@ def admin_update_department(dept_id):
         department.description = request.form.get('description', '')
         
         db.session.commit()
+        page_cache.invalidate()
         flash('Department updated successfully!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -338,6 +823,7 @@ def admin_delete_department(dept_id):
         department = Department.query.get_or_404(dept_id)
         db.session.delete(department)
         db.session.commit()
+        page_cache.invalidate()
         flash('Department deleted successfully!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -350,10 +836,18 @@ def admin_delete_department(dept_id):
 @login_required
 @admin_required
 def admin_courses():
-    courses = Course.query.all()
+    try:
+        page = paginate(
+            Course.query.options(joinedload(Course.department), joinedload(Course.instructor)),
+            [Course.id]
+        )
+    except ValueError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('admin_courses'))
+    courses = Course.preload_attendance_counts(page.items)
     departments = Department.query.all()
     users = User.query.filter_by(role='instructor').all()
-    return render_template('admin/courses.html', courses=courses, departments=departments, users=users)
+    return render_template('admin/courses.html', courses=courses, departments=departments, users=users, page=page)
 
 @app.route('/admin/courses/create', methods=['POST'])
 @login_required
@@ -397,6 +891,9 @@ def admin_create_course():
         
         db.session.add(course)
         db.session.commit()
+        course_cache.invalidate(course.id)
+        course_locator.update(CourseSnapshot.from_course(course))
+        page_cache.invalidate('attend')
         flash('Course created successfully!', 'success')
     except ValueError as e:
         flash(f'Invalid date/time format or number value: {str(e)}', 'danger')
@@ -437,12 +934,20 @@ def admin_update_course(course_id):
         longitude = request.form.get('longitude')
         max_distance = request.form.get('max_distance', 100.0)
         
+        geofence_before = (course.latitude, course.longitude, course.max_distance)
         course.latitude = float(latitude) if latitude else None
         course.longitude = float(longitude) if longitude else None
         course.max_distance = float(max_distance)
         
         db.session.commit()
+        course_cache.invalidate(course_id)
+        course_locator.update(CourseSnapshot.from_course(course))
+        page_cache.invalidate('attend')
         flash('Course updated successfully!', 'success')
+        if (course.latitude, course.longitude, course.max_distance) != geofence_before:
+            result = reverify_attendance(course_ids=[course_id])
+            flash(f"Location changed: re-verified {result['rows']} attendance records "
+                  f"({result['newly_verified']} now verified, {result['newly_unverified']} no longer verified).", 'info')
     except ValueError as e:
         flash(f'Invalid date/time format or number value: {str(e)}', 'danger')
     except Exception as e:
@@ -457,8 +962,15 @@ def admin_update_course(course_id):
 def admin_delete_course(course_id):
     try:
         course = Course.query.get_or_404(course_id)
+        if course.series_id and not SeriesException.query.filter_by(series_id=course.series_id,
+                                                                    date=course.start_time.date()).first():
+            # Otherwise the weekly course would schedule this session again
+            db.session.add(SeriesException(series_id=course.series_id, date=course.start_time.date()))
         db.session.delete(course)
         db.session.commit()
+        course_cache.invalidate(course_id)
+        course_locator.remove(course_id)
+        page_cache.invalidate('attend')
         flash('Course deleted successfully!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -471,9 +983,13 @@ def admin_delete_course(course_id):
 @login_required
 @admin_required
 def admin_students():
-    students = Student.query.all()
+    try:
+        page = paginate(Student.query, [Student.id])
+    except ValueError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('admin_students'))
     departments = Department.query.all()
-    return render_template('admin/students.html', students=students, departments=departments)
+    return render_template('admin/students.html', students=page.items, departments=departments, page=page)
 
 @app.route('/admin/students/create', methods=['POST'])
 @login_required
@@ -511,6 +1027,38 @@ def admin_create_student():
     
     return redirect(url_for('admin_students'))
 
+def student_import(upsert=False, batch_rows=BATCH_ROWS):
+    """A RosterImport into the student table, see roster.py"""
+    return RosterImport(db.get_engine(app), Student.__table__, Department.__table__, upsert=upsert,
+                        batch_rows=batch_rows,
+                        on_insert=lambda conn, rows: record_core_inserts(conn, Student, rows))
+
+@app.route('/admin/students/import', methods=['POST'])
+@login_required
+@admin_required
+def admin_import_students():
+    """Import a CSV or XLSX roster, streaming progress as JSON lines with the full report last"""
+    upload = request.files.get('roster')
+    if not upload or not upload.filename:
+        return jsonify({'success': False, 'message': 'Choose a CSV or XLSX roster file.'}), 400
+    try:
+        records = parse_roster(read_roster(upload.stream, upload.filename))
+    except (ValueError, zipfile.BadZipFile) as e:
+        return jsonify({'success': False, 'message': f'Could not read the roster: {e}'}), 400
+    roster_import = student_import(upsert=request.form.get('mode') == 'upsert')
+
+    def lines():
+        try:
+            for progress in roster_import.run(records):
+                yield json.dumps(progress) + '\n'
+        except Exception as e:
+            app.logger.exception('Roster import failed')
+            yield json.dumps(dict(roster_import.report(), success=False, message=f'Import stopped: {e}')) + '\n'
+            return
+        yield json.dumps(dict(roster_import.report(), success=True)) + '\n'
+
+    return Response(stream_with_context(lines()), mimetype='application/x-ndjson')
+
 @app.route('/admin/students/update/<int:student_id>', methods=['POST'])
 @login_required
 @admin_required
@@ -561,9 +1109,187 @@ def admin_delete_student(student_id):
 @login_required
 @admin_required
 def admin_attendance():
-    attendances = Attendance.query.join(Course).order_by(Attendance.timestamp.desc()).all()
-    courses = Course.query.all()
-    return render_template('admin/attendance.html', attendances=attendances, courses=courses)
+    try:
+        filters = attendance_filters(request.args)
+        page = paginate(filtered_attendance_query(filters), [Attendance.timestamp, Attendance.id], descending=True)
+    except ValueError as e:
+        flash(f'Invalid filter: {str(e)}', 'danger')
+        return redirect(url_for('admin_attendance'))
+    courses = Course.query.order_by(Course.start_time.desc()).all()
+    departments = Department.query.order_by(Department.name).all()
+    return render_template('admin/attendance.html', attendances=page.items, courses=courses,
+                           departments=departments, page=page, filters=filters)
+
+@app.route('/admin/attendance/export.<fmt>')
+@login_required
+@admin_required
+def admin_export_attendance(fmt):
+    """Export attendance across courses with the admin_attendance filters"""
+    try:
+        filters = attendance_filters(request.args)
+    except ValueError as e:
+        flash(f'Invalid filter: {str(e)}', 'danger')
+        return redirect(url_for('admin_attendance'))
+    parts = ['attendance']
+    if filters['department_id']:
+        department = Department.query.get_or_404(filters['department_id'])
+        parts.append(department.code)
+    if filters['date_from'] or filters['date_to']:
+        parts.append(f"{filters['date_from'] or 'start'}_to_{filters['date_to'] or 'now'}")
+    return export_attendance(filters, fmt, '_'.join(parts))
+
+@app.route('/admin/api/attendance')
+@login_required
+@admin_required
+def admin_api_attendance():
+    """JSON variant of admin_attendance with the same filters and cursors"""
+    try:
+        filters = attendance_filters(request.args)
+        page = paginate(filtered_attendance_query(filters), [Attendance.timestamp, Attendance.id], descending=True)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': f'Invalid filter: {str(e)}'}), 400
+    return jsonify({
+        'success': True,
+        'items': [{
+            'id': a.id,
+            'student_id': a.student_id,
+            'student_name': a.student_name,
+            'course_id': a.course_id,
+            'course_code': a.course.course_code,
+            'timestamp': a.timestamp.isoformat(),
+            'photo_url': a.photo_url('full') if a.photo_path else None,
+            'thumbnail_url': a.photo_url('small') if a.photo_path else None,
+            'latitude': a.latitude,
+            'longitude': a.longitude,
+            'distance_from_class': a.distance_from_class,
+            'location_verified': a.location_verified,
+        } for a in page.items],
+        'next_cursor': page.next_cursor,
+        'prev_cursor': page.prev_cursor,
+        'per_page': page.per_page,
+    })
+
+# Analytics cover the last ANALYTICS_DEFAULT_DAYS when no range is given, about a semester
+ANALYTICS_DEFAULT_DAYS = 120
+ANALYTICS_ROLLUPS = ('departments', 'courses', 'students', 'lateness')
+
+def analytics_filters(args):
+    """Parse the analytics date range, department and threshold; raises ValueError on malformed input"""
+    date_to = datetime.strptime(args['date_to'], '%Y-%m-%d').date() if args.get('date_to') else date.today()
+    if args.get('date_from'):
+        date_from = datetime.strptime(args['date_from'], '%Y-%m-%d').date()
+    else:
+        date_from = date_to - timedelta(days=ANALYTICS_DEFAULT_DAYS)
+    if date_from > date_to:
+        raise ValueError('the start date is after the end date')
+    below = args.get('below', type=float)
+    if below is not None and not 0 <= below <= 100:
+        raise ValueError('below must be a percentage')
+    return {
+        'date_from': date_from,
+        'date_to': date_to,
+        'department_id': args.get('department_id', type=int),
+        'below': below,
+        'course_code': (args.get('course_code') or '').strip() or None,
+    }
+
+@app.route('/admin/analytics')
+@login_required
+@admin_required
+def admin_analytics():
+    """Attendance rates per department and course, lateness, and the students below a threshold"""
+    try:
+        filters = analytics_filters(request.args)
+    except ValueError as e:
+        flash(f'Invalid filter: {str(e)}', 'danger')
+        return redirect(url_for('admin_analytics'))
+    if filters['below'] is None:
+        filters['below'] = 75.0
+    start, end, department_id = filters['date_from'], filters['date_to'], filters['department_id']
+    departments = attendance_analytics.departments(start, end)
+    return render_template(
+        'admin/analytics.html',
+        filters=filters,
+        departments=departments,
+        department_names={d['department_id']: d['name'] for d in departments},
+        courses=attendance_analytics.courses(start, end, department_id),
+        # The full list is in the students API
+        students=attendance_analytics.students(start, end, department_id, filters['below'], limit=200),
+        lateness=attendance_analytics.lateness(start, end, department_id, filters['course_code'])
+    )
+
+@app.route('/admin/api/analytics/<rollup>')
+@login_required
+@admin_required
+def admin_api_analytics(rollup):
+    """JSON rollups behind admin_analytics: departments, courses, students or lateness"""
+    if rollup not in ANALYTICS_ROLLUPS:
+        abort(404)
+    try:
+        filters = analytics_filters(request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': f'Invalid filter: {str(e)}'}), 400
+    start, end, department_id = filters['date_from'], filters['date_to'], filters['department_id']
+    if rollup == 'departments':
+        result = attendance_analytics.departments(start, end)
+    elif rollup == 'courses':
+        result = attendance_analytics.courses(start, end, department_id)
+    elif rollup == 'students':
+        result = attendance_analytics.students(start, end, department_id, filters['below'],
+                                               limit=request.args.get('limit', type=int))
+    else:
+        result = attendance_analytics.lateness(start, end, department_id, filters['course_code'])
+    return jsonify({'success': True, 'date_from': start.isoformat(), 'date_to': end.isoformat(), rollup: result})
+
+@app.route('/admin/api/analytics/courses/<int:course_id>/absentees')
+@login_required
+@admin_required
+def admin_api_absentees(course_id):
+    """Registered students taking the course (checked in to one of its recent sessions) who did not check in to it"""
+    course = Course.query.get_or_404(course_id)
+    since = course.start_time - timedelta(days=ANALYTICS_DEFAULT_DAYS)
+    return jsonify({'success': True, 'course_id': course.id,
+                    'absentees': attendance_analytics.absentees(course.id, since=since)})
+
+@app.route('/admin/api/analytics/students/<student_id>/missed')
+@login_required
+@admin_required
+def admin_api_missed_sessions(student_id):
+    """Sessions of the courses a student takes in the analytics date range that they did not check in to"""
+    student = Student.query.filter_by(student_id=student_id).first_or_404()
+    try:
+        filters = analytics_filters(request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': f'Invalid filter: {str(e)}'}), 400
+    return jsonify({
+        'success': True,
+        'student_id': student.student_id,
+        'full_name': student.full_name,
+        'missed': attendance_analytics.missed_sessions(student.student_id, filters['date_from'], filters['date_to']),
+    })
+
+@app.route('/admin/api/rollups')
+@login_required
+@admin_required
+def admin_api_rollups():
+    """Daily check-in counts from the rollups: a course code (with department_id), a department, or all"""
+    try:
+        filters = analytics_filters(request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': f'Invalid filter: {str(e)}'}), 400
+    start, end, department_id = filters['date_from'], filters['date_to'], filters['department_id']
+    if filters['course_code']:
+        if department_id is None:
+            return jsonify({'success': False, 'message': 'A course_code needs its department_id.'}), 400
+        days = daily_rollups.course_days(db.session.connection(), department_id, filters['course_code'], start, end)
+    else:
+        days = daily_rollups.department_days(db.session.connection(), start, end, department_id)
+    return jsonify({
+        'success': True,
+        'date_from': start.isoformat(),
+        'date_to': end.isoformat(),
+        'days': [dict(row, day=row['day'].isoformat()) for row in days],
+    })
 
 @app.route('/admin/attendance/create', methods=['POST'])
 @login_required
@@ -583,10 +1309,9 @@ def admin_create_attendance():
             return redirect(url_for('admin_attendance'))
 
         # Save photo
-        photo_filename = None
         if photo_file and photo_file.filename:
-            photo_filename = secure_filename(photo_file.filename)
-            photo_file.save(os.path.join(app.config['UPLOAD_FOLDER'], photo_filename))
+            photo_data = photo_file.read()
+            photo_key = _store_photo(photo_data)
         else:
             flash('Photo is required.', 'danger')
             return redirect(url_for('admin_attendance'))
@@ -595,7 +1320,7 @@ def admin_create_attendance():
         course = Course.query.get(course_id)
         location_verified = False
         if course and course.latitude and course.longitude and latitude and longitude:
-            calculated_distance = calculate_distance(latitude, longitude, course.latitude, course.longitude)
+            calculated_distance = haversine_distance(latitude, longitude, course.latitude, course.longitude)
             distance_from_class = calculated_distance
             location_verified = calculated_distance <= course.max_distance
 
@@ -606,11 +1331,13 @@ def admin_create_attendance():
             latitude=latitude,
             longitude=longitude,
             distance_from_class=distance_from_class,
-            photo_path=photo_filename,
-            location_verified=location_verified
+            photo_path=photo_key,
+            location_verified=location_verified,
+            photo_status='pending'
         )
         db.session.add(attendance)
         db.session.commit()
+        photo_pipeline.submit(photo_data, on_done=partial(_photo_processed, attendance.id, photo_key))
         flash('Attendance record created successfully!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -641,7 +1368,7 @@ def admin_update_attendance(attendance_id):
         # Recalculate location verification
         course = Course.query.get(course_id)
         if course and course.latitude and course.longitude and attendance.latitude and attendance.longitude:
-            calculated_distance = calculate_distance(
+            calculated_distance = haversine_distance(
                 attendance.latitude, attendance.longitude, 
                 course.latitude, course.longitude
             )
@@ -650,18 +1377,18 @@ def admin_update_attendance(attendance_id):
 
         # Optional photo update
         photo_file = request.files.get('photo')
+        old_photo = photo_data = None
         if photo_file and photo_file.filename:
-            # delete old photo
-            if attendance.photo_path:
-                old_photo = os.path.join(app.config['UPLOAD_FOLDER'], attendance.photo_path)
-                if os.path.exists(old_photo):
-                    os.remove(old_photo)
-            # save new photo
-            photo_filename = secure_filename(photo_file.filename)
-            photo_file.save(os.path.join(app.config['UPLOAD_FOLDER'], photo_filename))
-            attendance.photo_path = photo_filename
+            photo_data = photo_file.read()
+            old_photo = attendance.photo_path
+            attendance.photo_path = _store_photo(photo_data)
+            attendance.photo_status = 'pending'
 
         db.session.commit()
+        if photo_data is not None:
+            # The old photo goes once nothing refers to it any more
+            _discard_photo(old_photo)
+            photo_pipeline.submit(photo_data, on_done=partial(_photo_processed, attendance.id, attendance.photo_path))
         flash('Attendance record updated successfully!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -674,15 +1401,12 @@ def admin_update_attendance(attendance_id):
 def admin_delete_attendance(attendance_id):
     try:
         attendance = Attendance.query.get_or_404(attendance_id)
-
-        # Delete photo file if it exists
-        if attendance.photo_path:
-            photo_path = os.path.join(app.config['UPLOAD_FOLDER'], attendance.photo_path)
-            if os.path.exists(photo_path):
-                os.remove(photo_path)
+        photo_key = attendance.photo_path
 
         db.session.delete(attendance)
         db.session.commit()
+        # Delete the stored photo unless another record shares it
+        _discard_photo(photo_key)
         flash('Attendance record deleted successfully!', 'success')
 
     except Exception as e:
@@ -695,8 +1419,9 @@ def admin_delete_attendance(attendance_id):
 @app.route('/departments', methods=['GET', 'POST'])
 def departments():
     """Show all departments for students to choose from"""
-    departments = Department.query.all()
-    return render_template('departments.html', departments=departments)
+    def render():
+        return render_template('departments.html', departments=Department.query.all()), None
+    return cached_page('departments', None, render)
 
 @app.route('/register', methods=['GET', 'POST'])
 def register():
@@ -833,6 +1558,46 @@ def add_course():
             flash('End time must be after start time.', 'danger')
             return render_template('add_course.html', departments=departments)
 
+        if request.form.get('repeat'):
+            try:
+                weekdays = {int(day) for day in request.form.getlist('repeat_days')} or {start_time.weekday()}
+                repeat_until = datetime.strptime(request.form.get('repeat_until', ''), '%Y-%m-%d').date()
+            except ValueError:
+                flash('Choose the weekdays and the date of the last week to repeat the course.', 'danger')
+                return render_template('add_course.html', departments=departments)
+            if not weekdays <= set(range(7)) or not start_time.date() <= repeat_until <= start_time.date() + MAX_SERIES_SPAN:
+                flash('A course can repeat weekly for up to a year from its first session.', 'danger')
+                return render_template('add_course.html', departments=departments)
+            try:
+                series = CourseSeries(
+                    course_name=course_name,
+                    course_code=course_code,
+                    class_location=class_location,
+                    department_id=department_id,
+                    instructor_id=current_user.id,
+                    latitude=float(latitude) if latitude else None,
+                    longitude=float(longitude) if longitude else None,
+                    max_distance=float(max_distance) if max_distance else 100.0,
+                    year=year_int,
+                    session=session.lower(),
+                    weekdays=format_weekdays(weekdays),
+                    start_clock=start_time.time(),
+                    duration_minutes=int((end_time - start_time).total_seconds() // 60),
+                    first_date=start_time.date(),
+                    last_date=repeat_until,
+                    generated_until=start_time.date() - timedelta(days=1)
+                )
+                db.session.add(series)
+                db.session.commit()
+                result = materialize_sessions([series.id])
+                flash(f"Weekly course added: {result['sessions']} sessions scheduled so far, the rest are added "
+                      f"as their week approaches.", 'success')
+                return redirect(url_for('view_course'))
+            except Exception as e:
+                db.session.rollback()
+                flash(f'Error adding course: {str(e)}', 'danger')
+                return render_template('add_course.html', departments=departments)
+
         try:
             # Create a new Course instance  
             new_course = Course(  
@@ -852,6 +1617,9 @@ def add_course():
 
             db.session.add(new_course)  
             db.session.commit()    
+            course_cache.invalidate(new_course.id)
+            course_locator.update(CourseSnapshot.from_course(new_course))
+            page_cache.invalidate('attend')
 
             flash('Course added successfully!', 'success')  
             return redirect(url_for('view_course'))
@@ -862,11 +1630,126 @@ def add_course():
 
     return render_template('add_course.html', departments=departments)
 
+def _can_manage_series(series):
+    return series.instructor_id == current_user.id or current_user.role == 'admin'
+
+@app.route('/series/<int:series_id>/edit', methods=['GET', 'POST'])
+@login_required
+def edit_series(series_id):
+    """Change a weekly course; sessions that haven't started follow, past ones are kept as they were"""
+    series = CourseSeries.query.get_or_404(series_id)
+    if not _can_manage_series(series):
+        flash('You are not authorized to edit this course.', 'danger')
+        return redirect(url_for('view_course'))
+    departments = Department.query.all()
+    if request.method == 'GET':
+        return render_template('add_course.html', departments=departments, series=series)
+
+    form = request.form
+    required = ['course_name', 'course_code', 'class_location', 'department_id', 'year', 'session',
+                'start_time', 'end_time', 'repeat_until']
+    if not all(form.get(field) for field in required):
+        flash('All required fields must be filled.', 'danger')
+        return render_template('add_course.html', departments=departments, series=series)
+    try:
+        start_time = datetime.strptime(form['start_time'], '%Y-%m-%dT%H:%M')
+        end_time = datetime.strptime(form['end_time'], '%Y-%m-%dT%H:%M')
+        repeat_until = datetime.strptime(form['repeat_until'], '%Y-%m-%d').date()
+        weekdays = {int(day) for day in form.getlist('repeat_days')} or {start_time.weekday()}
+        year = int(form['year'])
+        max_distance = float(form.get('max_distance') or series.max_distance or 100.0)
+    except ValueError as e:
+        flash(f'Invalid date/time format or number value: {str(e)}', 'danger')
+        return render_template('add_course.html', departments=departments, series=series)
+    if start_time >= end_time:
+        flash('End time must be after start time.', 'danger')
+        return render_template('add_course.html', departments=departments, series=series)
+    if not weekdays <= set(range(7)) or not start_time.date() <= repeat_until <= start_time.date() + MAX_SERIES_SPAN:
+        flash('A course can repeat weekly for up to a year from its first session.', 'danger')
+        return render_template('add_course.html', departments=departments, series=series)
+
+    try:
+        series.course_name = form['course_name']
+        series.course_code = form['course_code']
+        series.class_location = form['class_location']
+        series.department_id = int(form['department_id'])
+        series.year = year
+        series.session = form['session'].lower()
+        if form.get('latitude') and form.get('longitude'):
+            series.latitude = float(form['latitude'])
+            series.longitude = float(form['longitude'])
+        series.max_distance = max_distance
+        series.weekdays = format_weekdays(weekdays)
+        series.start_clock = start_time.time()
+        series.duration_minutes = int((end_time - start_time).total_seconds() // 60)
+        series.first_date = start_time.date()
+        series.last_date = repeat_until
+        db.session.commit()
+        changed = reconcile_series([series.id])
+        added = materialize_sessions([series.id])
+        flash(f"Weekly course updated: {changed['updated']} upcoming sessions changed, "
+              f"{changed['inserted'] + added['sessions']} added and {changed['deleted']} removed.", 'success')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Error updating course: {str(e)}', 'danger')
+        return render_template('add_course.html', departments=departments, series=series)
+    return redirect(url_for('view_course'))
+
+@app.route('/series/<int:series_id>/delete', methods=['POST'])
+@login_required
+def delete_series(series_id):
+    """Stop a weekly course: its upcoming sessions are deleted, past sessions and their attendance are kept"""
+    series = CourseSeries.query.get_or_404(series_id)
+    if not _can_manage_series(series):
+        flash('You are not authorized to delete this course.', 'danger')
+        return redirect(url_for('view_course'))
+    try:
+        upcoming = Course.query.filter(Course.series_id == series_id, Course.start_time > datetime.now())
+        removed = upcoming.delete(synchronize_session=False)
+        Course.query.filter_by(series_id=series_id).update({'series_id': None}, synchronize_session=False)
+        SeriesException.query.filter_by(series_id=series_id).delete(synchronize_session=False)
+        db.session.delete(series)
+        db.session.commit()
+        # The bulk delete bypasses the total_courses counter's mapper events
+        dashboard_stats.mark_stale()
+        course_cache.invalidate()
+        course_locator.invalidate()
+        page_cache.invalidate('attend')
+        flash(f'Weekly course deleted with its {removed} upcoming sessions.', 'success')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Error deleting course: {str(e)}', 'danger')
+    return redirect(url_for('view_course'))
+
+@app.route('/course/<int:course_id>/cancel', methods=['POST'])
+@login_required
+def cancel_session(course_id):
+    """Skip one upcoming session of a weekly course"""
+    course = Course.query.get_or_404(course_id)
+    if course.series is None or not _can_manage_series(course.series):
+        flash('Only upcoming sessions of your weekly courses can be cancelled.', 'danger')
+        return redirect(url_for('view_course'))
+    if course.start_time <= datetime.now():
+        flash('This session has already started.', 'danger')
+        return redirect(url_for('view_course'))
+    try:
+        day = course.start_time.date()
+        if not SeriesException.query.filter_by(series_id=course.series_id, date=day).first():
+            db.session.add(SeriesException(series_id=course.series_id, date=day))
+            db.session.commit()
+        reconcile_series([course.series_id])
+        flash(f"Cancelled the {day.strftime('%B %d, %Y')} session.", 'success')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Error cancelling session: {str(e)}', 'danger')
+    return redirect(url_for('view_course'))
+
 @app.route("/view_course", methods=["GET"])
 @login_required
 def view_course():
-    courses = (
+    courses = Course.preload_attendance_counts(
         Course.query.filter_by(instructor_id=current_user.id)
+        .options(joinedload(Course.department), joinedload(Course.series))
         .order_by(Course.start_time)
         .all()
     )
@@ -874,7 +1757,8 @@ def view_course():
     now = datetime.utcnow()
     course_views = []
     for course in courses:
-        if course.is_active():
+        active = course.is_active()
+        if active:
             status = "Active"
             badge_class = "status-active"
         elif course.start_time > now:
@@ -897,7 +1781,9 @@ def view_course():
             "badge_class": badge_class,
             "latitude": course.latitude,
             "longitude": course.longitude,
-            "is_active": course.is_active(),
+            "is_active": active,
+            "series_id": course.series_id,
+            "series_days": course.series.weekday_names() if course.series else None,
         })
 
     return render_template('view_course.html', courses=course_views)
@@ -905,66 +1791,334 @@ def view_course():
 @app.route('/attend/<int:department_id>')
 def attend(department_id):
     """Show courses for a specific department that are available today"""
-    department = Department.query.get_or_404(department_id)
-    today = date.today()
-    
-    # Get courses for today in this department
-    courses = Course.query.filter(
-        Course.department_id == department_id,
-        db.func.date(Course.start_time) == today
-    ).order_by(Course.start_time).all()
+    def render():
+        department = Department.query.get_or_404(department_id)
+        today = datetime.combine(date.today(), datetime.min.time())
+
+        # Get courses for today in this department (a start_time range, so it can use ix_course_department_start)
+        courses = Course.preload_attendance_counts(
+            Course.query.filter(
+                Course.department_id == department_id,
+                Course.start_time >= today,
+                Course.start_time < today + timedelta(days=1)
+            ).options(joinedload(Course.instructor)).order_by(Course.start_time).all()
+        )
+
+        # The page is out of date once a course opens or closes for attendance
+        now = datetime.now()
+        changes = [moment for course in courses
+                   for moment in (course.start_time, course.start_time + ATTENDANCE_WINDOW + timedelta(seconds=1))
+                   if moment > now]
+        return render_template('attend.html', courses=courses, department=department), min(changes, default=None)
+    return cached_page('attend', department_id, render)
+
+@app.route('/courses/nearby')
+def nearby_courses():
+    """Active courses whose geofence contains the student's GPS fix, nearest first"""
+    latitude = request.args.get('lat', type=float)
+    longitude = request.args.get('lng', type=float)
+    if latitude is None or longitude is None or not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return jsonify({'success': False, 'message': 'A valid lat and lng are required.'}), 400
+
+    matches = course_locator.locate(latitude, longitude)
+    courses = {course.id: course for course in Course.query.options(joinedload(Course.department))
+               .filter(Course.id.in_([snapshot.id for _, snapshot in matches]))} if matches else {}
+    results = []
+    for distance, snapshot in matches:
+        course = courses.get(snapshot.id)
+        if course is None:  # deleted through another worker since the index was loaded
+            continue
+        results.append({
+            'id': course.id,
+            'course_name': course.course_name,
+            'course_code': course.course_code,
+            'class_location': course.class_location,
+            'department': course.department.name,
+            'distance': round(distance, 1),
+            'max_distance': snapshot.max_distance,
+            'url': url_for('attend', department_id=course.department_id, course=course.id),
+        })
+    return jsonify({'success': True, 'courses': results})
+
+@app.route('/q/<token>')
+def qr_attend(token):
+    """Landing page encoded in a course QR code: the attendance form for that one course"""
+    try:
+        course_id = qr_signer.course_id(token)
+        qr_signer.verify(token, course_id)
+    except ValueError as e:
+        abort(403, description=str(e))
+
+    course = Course.query.options(joinedload(Course.instructor), joinedload(Course.department))\
+                         .filter_by(id=course_id).first_or_404()
+    Course.preload_attendance_counts([course])
+    return render_template('attend.html', courses=[course], department=course.department, qr_token=token)
 
-    return render_template('attend.html', courses=courses, department=department)
+@app.route('/course/<int:course_id>/qr.<fmt>')
+@login_required
+def course_qr(course_id, fmt):
+    """Current QR image for a course; rendered once per rotation and cached"""
+    if fmt not in QR_FORMATS:
+        abort(404)
+    course = course_cache.get(course_id)
+    if course is None:
+        abort(404)
+    if course.instructor_id != current_user.id and current_user.role != 'admin':
+        abort(403)
+
+    now = time.time()
+    url = url_for('qr_attend', token=qr_signer.token(course_id, now), _external=True)
+    image, etag = qr_images.get(url, fmt)
+    response = Response(image, mimetype=QR_FORMATS[fmt])
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.max_age = max(1, int(qr_signer.seconds_left(now)))
+    return response.make_conditional(request)
+
+@app.route('/course/<int:course_id>/qr/display')
+@login_required
+def course_qr_display(course_id):
+    """Full-screen, auto-rotating QR code for the classroom projector"""
+    course = Course.query.get_or_404(course_id)
+
+    if course.instructor_id != current_user.id and current_user.role != 'admin':
+        flash('You are not authorized to display this course.', 'danger')
+        return redirect(url_for('view_course'))
+
+    return render_template(
+        'qr_display.html',
+        course=course,
+        rotation_seconds=qr_signer.interval,
+        server_time=time.time()
+    )
+
+def _send_photo(key):
+    """Serve a stored photo or derivative; content-addressed ones never change, so they are cached for good"""
+    original = key.split('/', 2)[-1] if key.startswith('derived/') else key
+    immutable = PhotoStore.is_content_key(original)
+    # The key of an immutable photo identifies its bytes, so it can stand in for a content hash
+    etag = hashlib.sha256(key.encode()).hexdigest()[:32] if immutable else None
+    mimetype = mimetypes.guess_type(key)[0] or 'application/octet-stream'
+    if etag is not None and request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+    else:
+        try:
+            path = photo_store.path(key)
+        except ValueError:
+            abort(404)
+        if path is not None:
+            if not os.path.isfile(path):
+                abort(404)
+            # Streamed from the file; send_file answers conditional and Range requests itself
+            response = send_file(path, mimetype=mimetype, conditional=True, etag=etag or True,
+                                 max_age=PHOTO_CACHE_SECONDS if immutable else None)
+        else:
+            try:
+                data = photo_store.get(key)
+            except (KeyError, ValueError):
+                abort(404)
+            response = Response(data, mimetype=mimetype)
+            response.set_etag(etag or hashlib.sha256(data).hexdigest()[:32])
+            response = response.make_conditional(request)
+
+    response.cache_control.public = False
+    response.cache_control.private = True
+    if immutable:
+        response.cache_control.no_cache = None
+        response.cache_control.max_age = PHOTO_CACHE_SECONDS
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
 
 @app.route('/uploads/<path:filename>')
 def uploaded_file(filename):
-    return send_from_directory('uploads', filename)
+    return _send_photo(filename)
+
+@app.route('/photos/<any(small, medium):size>/<path:key>')
+def photo(size, key):
+    """A resized copy of a stored photo, generated on first request if the pipeline has not made it"""
+    if key.startswith('derived/'):
+        abort(404)
+    try:
+        if not photo_store.exists(photo_store.derivative_key(key, size)):
+            photo_store.put_derivative(key, size, make_derivative(photo_store.get(key), size))
+    except (KeyError, ValueError):
+        abort(404)
+    except Exception:
+        app.logger.exception('Could not create the %s derivative of %s', size, key)
+        abort(404)
+    return _send_photo(photo_store.derivative_key(key, size))
+
+def _store_photo(data):
+    """Check uploaded photo bytes from their header and store them; returns the storage key"""
+    photo_format = sniff_photo(io.BytesIO(data))[0]
+    key, _ = photo_store.put(data, PHOTO_EXTENSIONS[photo_format])
+    return key
+
+def _discard_photo(key):
+    """Delete a stored photo and its derivatives once no attendance record refers to it"""
+    if not key:
+        return
+    attendance_table = Attendance.__table__
+    try:
+        # Identical uploads share one stored file, so check for other references first
+        with db.get_engine(app).connect() as conn:
+            referenced = conn.execute(
+                select(attendance_table.c.id).where(attendance_table.c.photo_path == key).limit(1)
+            ).first()
+        if referenced is None:
+            photo_store.delete(key, sizes=PHOTO_SIZES)
+    except Exception:
+        app.logger.exception('Could not discard photo %s', key)
+
+def _photo_processed(attendance_id, raw_key, result, error):
+    """Photo pipeline callback: store the processed photo and point the record at it"""
+    metrics.record_photo(result, error)
+    values = {'photo_status': 'failed'}
+    if error is not None:
+        app.logger.error('Could not process the photo of attendance %s', attendance_id, exc_info=error)
+    else:
+        try:
+            key, _ = photo_store.put(result.photo, 'jpg')
+            for size, data in result.derivatives.items():
+                photo_store.put_derivative(key, size, data)
+            values = {'photo_status': 'ready', 'photo_path': key}
+        except Exception:
+            app.logger.exception('Could not store the processed photo of attendance %s', attendance_id)
+
+    attendance_table = Attendance.__table__
+    try:
+        # Runs on pool callback threads, so use a plain connection instead of the scoped session
+        with db.get_engine(app).begin() as conn:
+            updated = conn.execute(
+                attendance_table.update()
+                .where(attendance_table.c.id == attendance_id)
+                .where(attendance_table.c.photo_path == raw_key)
+                .values(**values)
+            ).rowcount
+    except Exception:
+        app.logger.exception('Could not update the photo status of attendance %s', attendance_id)
+        return
+
+    processed_key = values.get('photo_path')
+    if not updated:
+        # The record was deleted or given another photo while this one was processed
+        _discard_photo(processed_key)
+    elif processed_key and processed_key != raw_key:
+        _discard_photo(raw_key)
+
+# (course_id, student_id) pairs with a submission in progress in this process
+_inflight_submissions = set()
+_inflight_lock = threading.Lock()
+
+def _claim_submission(key):
+    """Mark a submission as in progress; False if the same one is already running"""
+    with _inflight_lock:
+        if key in _inflight_submissions:
+            return False
+        _inflight_submissions.add(key)
+        return True
+
+def _release_submission(key):
+    with _inflight_lock:
+        _inflight_submissions.discard(key)
+
+def _attendance_marked_response(attendance, replayed=False):
+    distance_from_class = attendance.distance_from_class
+    response = {
+        'success': True,
+        'message': 'Attendance marked successfully! Your location has been verified.',
+        'distance': f'{distance_from_class:.0f}m' if distance_from_class else 'N/A',
+        'verified': attendance.location_verified
+    }
+    if replayed:
+        response['replayed'] = True
+    return jsonify(response)
 
 @app.route('/mark_attendance/<int:course_id>', methods=['POST'])
 def mark_attendance(course_id):
-    course = Course.query.get_or_404(course_id)
+    """Admit an attendance submission, running the cheapest checks first.
+
+    Stages (see admission.py): replay, content_length, qr_token, course_window,
+    fields, geofence, duplicate, photo_header, persist. Nothing touches the photo
+    until every other check has passed.
+    """
+    admission = admission_stats.start()
+    
+    def reject(message, status=400, **extra):
+        admission.reject()
+        return jsonify({'success': False, 'message': message, **extra}), status
+    
+    # A retried submission carries the same Idempotency-Key header; answer it from the
+    # stored record before the course window check or any parsing of the request body
+    admission.stage('replay')
+    idempotency_key = (request.headers.get('Idempotency-Key') or '').strip() or None
+    if idempotency_key:
+        # Truncating would let two long keys sharing a prefix replay each other's result
+        max_length = Attendance.__table__.c.idempotency_key.type.length
+        if len(idempotency_key) > max_length:
+            return reject(f'The Idempotency-Key header must be at most {max_length} characters.')
+        previous = Attendance.query.filter_by(idempotency_key=idempotency_key).first()
+        if previous:
+            if previous.course_id != course_id:
+                return reject('This submission key was already used for another course.', 409)
+            admission.reject()
+            return _attendance_marked_response(previous, replayed=True)
+    
+    # Refuse oversized bodies from the Content-Length header, before the body is read
+    admission.stage('content_length')
+    if request.content_length and request.content_length > app.config['MAX_CONTENT_LENGTH']:
+        return reject('Image file is too large. Please try taking another photo.', 413)
+    
+    # Forms opened from a QR code post its signed token; checking it needs only the secret
+    admission.stage('qr_token')
+    qr_token = request.args.get('token')
+    if qr_token:
+        try:
+            qr_signer.verify(qr_token, course_id)
+        except ValueError as e:
+            return reject(str(e), 403)
+    elif app.config['QR_TOKEN_REQUIRED']:
+        return reject('Please scan the QR code shown in class to mark attendance.', 403)
+    
+    admission.stage('course_window')
+    course = course_cache.get(course_id)
+    if course is None:
+        admission.reject()
+        abort(404)
     
     # Check if course is still active (within 30 minutes of start time)
     if not course.is_active():
-        return jsonify({
-            'success': False,
-            'message': 'Attendance period has ended. You cannot mark attendance after 30 minutes from start time.'
-        }), 400
+        return reject('Attendance period has ended. You cannot mark attendance after 30 minutes from start time.')
     
+    claimed = None
     try:
+        admission.stage('fields')
         student_id = request.form.get('student_id')
         student_name = request.form.get('student_name')
         latitude = request.form.get('latitude')
         longitude = request.form.get('longitude')
+        # New clients upload a multipart Blob as 'photo'; older ones send a data URL as 'photo_path'
+        photo_file = request.files.get('photo')
         photo_data = request.form.get('photo_path')
         
-        if not all([student_id, student_name, latitude, longitude, photo_data]):
-            return jsonify({
-                'success': False,
-                'message': 'All fields are required (student ID, name, location, and photo).'
-            }), 400
+        if not all([student_id, student_name, latitude, longitude]) or not (photo_file or photo_data):
+            return reject('All fields are required (student ID, name, location, and photo).')
+        if not photo_file and not photo_data.startswith('data:image'):
+            return reject('No valid photo data received.')
         
         latitude = float(latitude)
         longitude = float(longitude)
         
-        # Check if student already marked attendance for this course
-        existing_attendance = Attendance.query.filter_by(
-            student_id=student_id,
-            course_id=course_id
-        ).first()
-        
-        if existing_attendance:
-            return jsonify({
-                'success': False,
-                'message': 'You have already marked attendance for this course.'
-            }), 400
-        
         # Calculate distance from class location and verify GPS
+        admission.stage('geofence')
         distance_from_class = None
         location_verified = False
         
         if course.latitude and course.longitude:
-            distance_from_class = calculate_distance(
+            distance_from_class = haversine_distance(
                 latitude, longitude, course.latitude, course.longitude
             )
             
@@ -972,86 +2126,124 @@ def mark_attendance(course_id):
             location_verified = distance_from_class <= course.max_distance
             
             if not location_verified:
-                return jsonify({
-                    'success': False,
-                    'message': f'You are too far from the class location. Distance: {distance_from_class:.0f}m (Max allowed: {course.max_distance:.0f}m). Please move closer to mark attendance.',
-                    'distance': f'{distance_from_class:.0f}m',
-                    'verified': False
-                }), 400
+                return reject(
+                    f'You are too far from the class location. Distance: {distance_from_class:.0f}m (Max allowed: {course.max_distance:.0f}m). Please move closer to mark attendance.',
+                    distance=f'{distance_from_class:.0f}m',
+                    verified=False
+                )
         
-        # Handle photo processing
-        photo_filename = None
-        if photo_data and photo_data.startswith('data:image'):
-            try:
-                # Create uploads directory if it doesn't exist
-                uploads_dir = os.path.join(app.root_path, 'uploads')
-                os.makedirs(uploads_dir, exist_ok=True)
-                
-                # Generate unique filename
-                timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
-                photo_filename = f"{student_id}_{course_id}_{timestamp}.png"
-                photo_path = os.path.join(uploads_dir, photo_filename)
-                
-                # Decode base64 image
-                image_data = photo_data.split(',')[1]
-                image_binary = base64.b64decode(image_data)
-                
-                # Save and resize image using PIL
-                with Image.open(io.BytesIO(image_binary)) as img:
-                    if img.mode in ('RGBA', 'LA'):
-                        background = Image.new('RGB', img.size, (255, 255, 255))
-                        background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-                        img = background
-                    
-                    img.thumbnail((800, 800), Image.Resampling.LANCZOS)
-                    img.save(photo_path, 'JPEG', quality=85)
-                    
-            except Exception as e:
-                print(f"Error processing photo: {str(e)}")
-                return jsonify({
-                    'success': False,
-                    'message': f'Error processing photo: {str(e)}'
-                }), 500
-        else:
-            return jsonify({
-                'success': False,
-                'message': 'No valid photo data received.'
-            }), 400
+        # A double tap from the same phone is rejected here, before any photo work
+        admission.stage('duplicate')
+        submission = (course_id, student_id)
+        if not _claim_submission(submission):
+            return reject('Your attendance for this course is already being submitted.', 409)
+        claimed = submission
+        
+        # Check if student already marked attendance for this course
+        existing_attendance = Attendance.query.filter_by(
+            student_id=student_id,
+            course_id=course_id
+        ).first()
+        
+        if existing_attendance:
+            if idempotency_key and existing_attendance.idempotency_key == idempotency_key:
+                admission.reject()
+                return _attendance_marked_response(existing_attendance, replayed=True)
+            return reject('You have already marked attendance for this course.')
+        
+        # Check format and dimensions from the image header; pixels are never decoded here
+        admission.stage('photo_header')
+        image_binary = None
+        try:
+            if photo_file:
+                photo_format = sniff_photo(photo_file.stream)[0]
+                photo_file.stream.seek(0)
+            else:
+                image_data = photo_data.split(',', 1)[1]
+                try:
+                    # The header is at the front, so only decode the first few KB of base64
+                    photo_format = sniff_photo(io.BytesIO(base64.b64decode(image_data[:SNIFF_BASE64_CHARS])))[0]
+                except ValueError:
+                    # Rare headers (e.g. a large EXIF block) need the whole image
+                    image_binary = base64.b64decode(image_data)
+                    photo_format = sniff_photo(io.BytesIO(image_binary))[0]
+        except ValueError as e:
+            return reject(f'Invalid photo: {str(e)}')
+        
+        # Persist the raw photo; resizing and re-encoding run in the photo pipeline
+        admission.stage('persist')
+        try:
+            # Named by content hash, so a retried or concurrent duplicate upload shares one stored file
+            if photo_file:
+                # Hashed and copied from Werkzeug's spooled upload in chunks, never read into memory whole
+                photo_key, _ = photo_store.put(photo_file.stream, PHOTO_EXTENSIONS[photo_format])
+                photo_file.stream.seek(0, os.SEEK_END)
+                photo_bytes = photo_file.stream.tell()
+                # The pipeline reads a locally stored photo from its file; other stores need the bytes
+                photo_source = photo_store.path(photo_key)
+                if photo_source is None:
+                    photo_file.stream.seek(0)
+                    photo_source = photo_file.stream.read()
+                upload_kind = 'multipart'
+            else:
+                if image_binary is None:
+                    image_binary = base64.b64decode(photo_data.split(',', 1)[1])
+                photo_key, _ = photo_store.put(image_binary, PHOTO_EXTENSIONS[photo_format])
+                photo_bytes = len(image_binary)
+                photo_source = image_binary
+                upload_kind = 'data_url'
+            
+            photo_pipeline.record_upload(upload_kind, photo_bytes, buffered=isinstance(photo_source, bytes))
+            metrics.record_upload(upload_kind, photo_bytes)
+        except Exception as e:
+            print(f"Error processing photo: {str(e)}")
+            return reject(f'Error processing photo: {str(e)}', 500)
         
         # Create new attendance record
-        new_attendance = Attendance(
+        values = dict(
             student_id=student_id,
             student_name=student_name,
             course_id=course_id,
-            photo_path=photo_filename,
+            timestamp=datetime.utcnow(),
+            photo_path=photo_key,
             latitude=latitude,
             longitude=longitude,
             distance_from_class=distance_from_class,
-            location_verified=location_verified
+            location_verified=location_verified,
+            photo_status='pending',
+            idempotency_key=idempotency_key
         )
         
-        db.session.add(new_attendance)
-        db.session.commit()
+        try:
+            attendance_id = save_attendance(values, course)
+        except IntegrityError:
+            # A concurrent submission (another worker, or a retry with the same key) won the unique index
+            db.session.rollback()
+            _discard_photo(photo_key)
+            if idempotency_key:
+                previous = Attendance.query.filter_by(idempotency_key=idempotency_key).first()
+                if previous:
+                    admission.reject()
+                    return _attendance_marked_response(previous, replayed=True)
+            return reject('You have already marked attendance for this course.')
         
-        return jsonify({
-            'success': True,
-            'message': 'Attendance marked successfully! Your location has been verified.',
-            'distance': f'{distance_from_class:.0f}m' if distance_from_class else 'N/A',
-            'verified': location_verified
-        })
+        admission.accept()
+        photo_pipeline.submit(photo_source, on_done=partial(_photo_processed, attendance_id, photo_key))
         
+        return _attendance_marked_response(Attendance(id=attendance_id, **values))
+        
+    except RequestEntityTooLarge:
+        # Bodies without a Content-Length are only caught while the form is parsed
+        return reject('Image file is too large. Please try taking another photo.', 413)
     except ValueError as e:
-        return jsonify({
-            'success': False,
-            'message': f'Invalid data format: {str(e)}'
-        }), 400
+        return reject(f'Invalid data format: {str(e)}')
     except Exception as e:
         db.session.rollback()
         print(f"Error in mark_attendance: {str(e)}")
-        return jsonify({
-            'success': False,
-            'message': f'An error occurred while processing your attendance: {str(e)}'
-        }), 500
+        return reject(f'An error occurred while processing your attendance: {str(e)}', 500)
+    finally:
+        if claimed:
+            _release_submission(claimed)
 
 @app.route('/attendance_report/<int:course_id>')
 @login_required
@@ -1066,14 +2258,38 @@ def attendance_report(course_id):
 
     attendances = Attendance.query.filter_by(course_id=course_id)\
                                   .order_by(Attendance.timestamp).all()
+    # Every session of this course code, from the daily rollups rather than their attendance rows
+    session_days = daily_rollups.course_days(db.session.connection(), course.department_id, course.course_code)
 
     return render_template(
         'attendance_report.html',
         course=course,
         attendances=attendances,
+        session_days=[dict(row, day=row['day'].isoformat()) for row in session_days],
         timedelta=timedelta
     )
 
+@app.route('/attendance_report/<int:course_id>/export.<fmt>')
+@login_required
+def attendance_report_export(course_id, fmt):
+    """Download a course's attendance as CSV or XLSX"""
+    course = Course.query.get_or_404(course_id)
+
+    # Same access rule as attendance_report
+    if course.instructor_id != current_user.id and current_user.role != 'admin':
+        flash('You are not authorized to view this report.', 'danger')
+        return redirect(url_for('view_course'))
+
+    try:
+        filters = attendance_filters(request.args)
+    except ValueError as e:
+        flash(f'Invalid filter: {str(e)}', 'danger')
+        return redirect(url_for('attendance_report', course_id=course_id))
+    filters['course_id'] = course.id
+    filters['department_id'] = None
+    filename = f"{course.course_code}_attendance_report_{course.start_time.strftime('%Y%m%d')}"
+    return export_attendance(filters, fmt, filename)
+
 @app.route('/view_attendee/<int:course_id>')
 @login_required
 def view_attendee(course_id):
@@ -1092,12 +2308,12 @@ def view_attendee(course_id):
     total_attendees = len(attendances)
     verified_count = sum(1 for a in attendances if a.location_verified)
     
-    # Count on-time attendance (within 15 minutes of start)
+    # Count on-time attendance (within ON_TIME_MINUTES of start, as in the analytics)
     on_time_count = 0
     for a in attendances:
         if a.timestamp and course.start_time:
             time_diff = (a.timestamp - course.start_time).total_seconds() / 60
-            if 0 <= time_diff <= 15:
+            if 0 <= time_diff <= ON_TIME_MINUTES:
                 on_time_count += 1
     
     # Calculate course status
@@ -1124,6 +2340,108 @@ def logout():
     flash('You have been logged out successfully.', 'info')
     return redirect(url_for('home'))
 
+@app.route('/admin/stats')
+@login_required
+@admin_required
+def admin_stats():
+    """Dashboard counters with their age and drift; ?reconcile=1 recomputes them now"""
+    if request.args.get('reconcile'):
+        dashboard_stats.reconcile()
+    return jsonify(dashboard_stats.staleness())
+
+@app.route('/admin/admission_stats')
+@login_required
+@admin_required
+def admin_admission_stats():
+    """Passes, rejections and time spent per mark_attendance admission stage"""
+    return jsonify(admission_stats.stats())
+
+@app.route('/admin/photo_pipeline')
+@login_required
+@admin_required
+def admin_photo_pipeline():
+    """Queue depth and latency metrics for the background photo pipeline"""
+    return jsonify(photo_pipeline.stats())
+
+@app.route('/admin/qr_cache')
+@login_required
+@admin_required
+def admin_qr_cache():
+    """Render counters of this worker's QR image cache"""
+    return jsonify(qr_images.stats())
+
+@app.route('/admin/course_cache')
+@login_required
+@admin_required
+def admin_course_cache():
+    """Hit/miss counters of this worker's active-course cache"""
+    return jsonify(course_cache.stats())
+
+@app.route('/admin/user_cache')
+@login_required
+@admin_required
+def admin_user_cache():
+    """Hit/miss counters of this worker's logged-in user cache"""
+    return jsonify(user_cache.stats())
+
+@app.route('/admin/page_cache')
+@login_required
+@admin_required
+def admin_page_cache():
+    """Hit/miss counters of this worker's departments and attend page cache"""
+    return jsonify(page_cache.stats())
+
+@app.route('/admin/analytics_cache')
+@login_required
+@admin_required
+def admin_analytics_cache():
+    """Hit/miss counters and query time of this worker's analytics cache"""
+    return jsonify(attendance_analytics.stats())
+
+@app.route('/admin/session_scheduler')
+@login_required
+@admin_required
+def admin_session_scheduler():
+    """Materialization counters of this worker's recurring session scheduler"""
+    return jsonify(session_scheduler.stats())
+
+@app.route('/admin/course_locator')
+@login_required
+@admin_required
+def admin_course_locator():
+    """Size and lookup counters of this worker's course geofence index"""
+    return jsonify(course_locator.stats())
+
+@app.route('/admin/attendance_writer')
+@login_required
+@admin_required
+def admin_attendance_writer():
+    """Batch counters of this worker's write-behind attendance buffer"""
+    return jsonify(attendance_writer.stats() if attendance_writer is not None else {'enabled': False})
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Request, database, photo and admission metrics of every worker for Prometheus"""
+    body, content_type = metrics.exposition()
+    return Response(body, content_type=content_type)
+
+@app.route('/readyz')
+def readiness():
+    """Ready when a database round trip succeeds within READINESS_MAX_DB_MS"""
+    started = time.perf_counter()
+    try:
+        with db.get_engine(app).connect() as conn:
+            conn.execute(text('SELECT 1'))
+    except Exception as e:
+        return jsonify({'status': 'unavailable', 'error': str(e)}), 503
+    seconds = time.perf_counter() - started
+    metrics.DB_ROUNDTRIP_SECONDS.observe(seconds)
+    ready = seconds * 1000 <= app.config['READINESS_MAX_DB_MS']
+    return jsonify({
+        'status': 'ready' if ready else 'degraded',
+        'db_roundtrip_ms': round(seconds * 1000, 3),
+    }), 200 if ready else 503
+
 # Initialize database with sample departments and admin user
 def init_db():
     with app.app_context():
@@ -1138,6 +2456,38 @@ def init_db():
                 db.session.commit()
         except Exception as e:
             print(f"Could not ensure email column on user table: {e}")
+
+        # Ensure 'photo_status' column exists on attendance table (SQLite)
+        try:
+            result = db.session.execute(text("PRAGMA table_info(attendance)"))
+            columns = [row[1] for row in result]
+            if 'photo_status' not in columns:
+                db.session.execute(text("ALTER TABLE attendance ADD COLUMN photo_status VARCHAR(20) DEFAULT 'ready'"))
+                db.session.commit()
+        except Exception as e:
+            print(f"Could not ensure photo_status column on attendance table: {e}")
+        
+        # Ensure 'idempotency_key' column exists on attendance table (SQLite)
+        try:
+            result = db.session.execute(text("PRAGMA table_info(attendance)"))
+            columns = [row[1] for row in result]
+            if 'idempotency_key' not in columns:
+                db.session.execute(text("ALTER TABLE attendance ADD COLUMN idempotency_key VARCHAR(64)"))
+                db.session.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ix_attendance_idempotency_key ON attendance (idempotency_key)"))
+                db.session.commit()
+        except Exception as e:
+            print(f"Could not ensure idempotency_key column on attendance table: {e}")
+        
+        # Ensure 'series_id' column exists on course table (SQLite)
+        try:
+            result = db.session.execute(text("PRAGMA table_info(course)"))
+            columns = [row[1] for row in result]
+            if 'series_id' not in columns:
+                db.session.execute(text("ALTER TABLE course ADD COLUMN series_id INTEGER REFERENCES course_series (id)"))
+                db.session.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ix_course_series_start ON course (series_id, start_time)"))
+                db.session.commit()
+        except Exception as e:
+            print(f"Could not ensure series_id column on course table: {e}")
         
         # Create admin user if it doesn't exist
         admin_user = User.query.filter_by(username='admin').first()
@@ -1167,6 +2517,111 @@ def init_db():
             db.session.commit()
             print("Sample departments added!")
 
+@app.cli.command('store-legacy-photos')
+def store_legacy_photos():
+    """Move photos saved under the old flat file names into the content-addressed store."""
+    legacy_keys = [key for (key,) in db.session.query(Attendance.photo_path).distinct()
+                   if key and not PhotoStore.is_content_key(key)]
+    moved = unreadable = 0
+    for old_key in legacy_keys:
+        try:
+            data = photo_store.get(old_key)
+            with Image.open(io.BytesIO(data)) as img:
+                ext = PHOTO_EXTENSIONS.get(img.format, 'jpg')
+        except Exception as e:
+            print(f"Skipping {old_key}: {e}")
+            unreadable += 1
+            continue
+        new_key, _ = photo_store.put(data, ext)
+        Attendance.query.filter_by(photo_path=old_key).update({'photo_path': new_key}, synchronize_session=False)
+        db.session.commit()
+        photo_store.delete(old_key, sizes=PHOTO_SIZES)
+        moved += 1
+    print(f"Moved {moved} photos into the content-addressed store, skipped {unreadable}")
+
+@app.cli.command('reverify-geofences')
+@click.option('--course', 'course_ids', type=int, multiple=True, help='Course id; repeat for several. Default: all.')
+@click.option('--since', type=click.DateTime(formats=['%Y-%m-%d']), help='Only attendance on or after this date.')
+@click.option('--until', type=click.DateTime(formats=['%Y-%m-%d']), help='Only attendance before this date.')
+def reverify_geofences(course_ids, since, until):
+    """Recompute distance_from_class and location_verified against the current course locations."""
+    result = reverify_attendance(course_ids=course_ids or None, since=since, until=until)
+    print(f"Checked {result['rows']} attendance records in {result['seconds']}s: {result['updated']} updated, "
+          f"{result['newly_verified']} newly verified, {result['newly_unverified']} no longer verified")
+
+@app.cli.command('import-students')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--upsert', is_flag=True, help='Update students that are already registered instead of rejecting them.')
+@click.option('--errors', 'errors_path', type=click.Path(dir_okay=False), help='Write the rejected rows to this CSV file.')
+def import_students(path, upsert, errors_path):
+    """Import students from a CSV or XLSX roster."""
+    roster_import = student_import(upsert)
+    with open(path, 'rb') as f:
+        for progress in roster_import.run(parse_roster(read_roster(f, path))):
+            print(f"\r{progress['rows']} rows read, {progress['inserted']} inserted, {progress['updated']} updated, "
+                  f"{progress['failed']} rejected", end='', flush=True)
+    print()
+    report = roster_import.report()
+    print(f"Imported {report['rows']} rows in {report['seconds']}s ({report['rows_per_second']} rows/s)")
+    errors = [(e['row'], e['student_id'], e['error']) for e in report['errors']]
+    if errors_path:
+        with open(errors_path, 'wb') as f:
+            for chunk in iter_csv(['row', 'student_id', 'error'], errors):
+                f.write(chunk)
+        print(f"Wrote {len(errors)} rejected rows to {errors_path}")
+    else:
+        for row, student_id, error in errors[:20]:
+            print(f"Row {row} ({student_id}): {error}")
+        if len(errors) > 20:
+            print(f"... and {len(errors) - 20} more; use --errors to save them all")
+
+@app.cli.command('generate-sessions')
+@click.option('--days', type=int, help='Materialize this many days ahead instead of SESSION_HORIZON_DAYS.')
+def generate_sessions(days):
+    """Create the upcoming sessions of every weekly course."""
+    result = materialize_sessions(horizon_days=days)
+    print(f"Scheduled {result['sessions']} sessions for {result['series']} weekly courses in {result['batches']} "
+          f"batches ({result['seconds']}s)")
+
+def _series_on(day):
+    return [series_id for (series_id,) in db.session.query(CourseSeries.id)
+            .filter(CourseSeries.first_date <= day, CourseSeries.last_date >= day)]
+
+@app.cli.command('add-holiday')
+@click.argument('day', type=click.DateTime(formats=['%Y-%m-%d']))
+@click.argument('name')
+def add_holiday(day, name):
+    """Cancel every weekly course session on DAY."""
+    day = day.date()
+    if Holiday.query.filter_by(date=day).first():
+        print(f'{day} is already a holiday')
+        return
+    db.session.add(Holiday(date=day, name=name))
+    db.session.commit()
+    result = reconcile_series(_series_on(day))
+    print(f"Added {name} on {day}: removed {result['deleted']} upcoming sessions")
+
+@app.cli.command('remove-holiday')
+@click.argument('day', type=click.DateTime(formats=['%Y-%m-%d']))
+def remove_holiday(day):
+    """Schedule weekly course sessions on DAY again."""
+    day = day.date()
+    if not Holiday.query.filter_by(date=day).delete():
+        print(f'{day} is not a holiday')
+        return
+    db.session.commit()
+    result = reconcile_series(_series_on(day))
+    print(f"Removed the holiday on {day}: restored {result['inserted']} upcoming sessions")
+
+@app.cli.command('rollup-attendance')
+@click.option('--since', type=click.DateTime(formats=['%Y-%m-%d']), help='First day to rebuild. Default: the first course.')
+@click.option('--until', type=click.DateTime(formats=['%Y-%m-%d']), help='Last day to rebuild. Default: today.')
+def rollup_attendance(since, until):
+    """Rebuild the daily attendance rollups from the attendance records."""
+    result = daily_rollups.backfill(since.date() if since else None, until.date() if until else None)
+    print(f"Rebuilt {result['days']} days from {result['start']} to {result['end']}: "
+          f"{result['course_rows']} course-day rows ({result['seconds']}s)")
+
 if __name__ == '__main__':
     init_db()
     app.run(debug=True, host='0.0.0.0')
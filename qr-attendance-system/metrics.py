@@ -0,0 +1,160 @@
+"""Prometheus metrics.
+
+Request counts and latencies per endpoint, SQL statements and time per
+request (counted with SQLAlchemy cursor events), photo processing and
+upload sizes, and mark_attendance outcomes by rejection reason.
+
+Under gunicorn every worker is its own process, so a scrape served by one
+worker must still report all of them. When PROMETHEUS_MULTIPROC_DIR is set
+(gunicorn.conf.py does), prometheus_client keeps each worker's values in
+memory-mapped files there and ``exposition`` adds them up; without it the
+default in-process registry is used, which is what ``flask run`` needs.
+The variable has to be set before this module is first imported.
+"""
+import os
+import threading
+import time
+
+from flask import g, request
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, \
+    generate_latest, multiprocess
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from admission import ADMISSION_STAGES
+
+MULTIPROCESS = bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR'))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+PHOTO_BYTES_BUCKETS = (25e3, 50e3, 100e3, 250e3, 500e3, 1e6, 2e6, 5e6, 10e6)
+
+# mark_attendance outcome label for a rejection at each admission stage (see admission.py)
+REJECTION_REASONS = {
+    'replay': 'replayed',
+    'content_length': 'too_large',
+    'qr_token': 'invalid_qr_token',
+    'course_window': 'inactive_course',
+    'fields': 'invalid_fields',
+    'geofence': 'out_of_range',
+    'duplicate': 'duplicate',
+    'photo_header': 'invalid_photo',
+    'persist': 'persist_failed',
+}
+
+REQUESTS = Counter('http_requests_total', 'HTTP requests by endpoint and status',
+                   ['method', 'endpoint', 'status'])
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'HTTP request latency by endpoint',
+                            ['method', 'endpoint'], buckets=LATENCY_BUCKETS)
+REQUEST_DB_QUERIES = Histogram('http_request_db_queries', 'SQL statements executed per request',
+                               ['endpoint'], buckets=QUERY_COUNT_BUCKETS)
+REQUEST_DB_SECONDS = Histogram('http_request_db_seconds', 'Time spent executing SQL per request',
+                               ['endpoint'], buckets=LATENCY_BUCKETS)
+DB_QUERIES = Counter('db_queries_total', 'SQL statements executed, inside requests or not')
+DB_SECONDS = Counter('db_query_seconds_total', 'Time spent executing SQL statements')
+DB_ROUNDTRIP_SECONDS = Histogram('db_roundtrip_seconds', 'Readiness check SELECT 1 round trips',
+                                 buckets=LATENCY_BUCKETS)
+PHOTO_PROCESSING_SECONDS = Histogram('photo_processing_seconds', 'Resize and re-encode time per photo',
+                                     buckets=LATENCY_BUCKETS)
+PHOTOS_PROCESSED = Counter('photos_processed_total', 'Photos through the pipeline by result', ['result'])
+PHOTO_UPLOAD_BYTES = Histogram('photo_upload_bytes', 'Size of uploaded photos by upload kind',
+                               ['kind'], buckets=PHOTO_BYTES_BUCKETS)
+PHOTO_OUTPUT_BYTES = Counter('photo_output_bytes_total', 'Bytes of processed photos and derivatives written',
+                             ['size'])
+ADMISSION_STAGE_SECONDS = Histogram('attendance_admission_stage_seconds', 'Time spent in each admission stage',
+                                    ['stage'], buckets=LATENCY_BUCKETS)
+ATTENDANCE_SUBMISSIONS = Counter('attendance_submissions_total',
+                                 'mark_attendance outcomes: accepted, or the rejection reason', ['outcome'])
+
+# SQL accounting for the request being handled on this thread
+_request_db = threading.local()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['metrics_query_started'].pop()
+    seconds = time.perf_counter() - started
+    DB_QUERIES.inc()
+    DB_SECONDS.inc(seconds)
+    if getattr(_request_db, 'active', False):
+        _request_db.queries += 1
+        _request_db.seconds += seconds
+
+
+def _endpoint():
+    # Route names rather than paths, so label values stay bounded
+    return request.endpoint or 'unmatched'
+
+
+def _start_request():
+    g.metrics_started = time.perf_counter()
+    _request_db.active = True
+    _request_db.queries = 0
+    _request_db.seconds = 0.0
+
+
+def _finish_request(response):
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return response
+    endpoint = _endpoint()
+    REQUESTS.labels(request.method, endpoint, str(response.status_code)).inc()
+    REQUEST_SECONDS.labels(request.method, endpoint).observe(time.perf_counter() - started)
+    REQUEST_DB_QUERIES.labels(endpoint).observe(_request_db.queries)
+    REQUEST_DB_SECONDS.labels(endpoint).observe(_request_db.seconds)
+    return response
+
+
+def _end_request(error=None):
+    # Teardown runs even when a handler raised and after_request was skipped, so
+    # statements this thread runs outside a request are never charged to one
+    _request_db.active = False
+
+
+def init_app(app):
+    """Time every request of ``app`` and count SQL statements on every engine."""
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_end_request)
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def record_admission(stage, seconds, passed):
+    """AdmissionStats listener: stage timings and the request's outcome."""
+    ADMISSION_STAGE_SECONDS.labels(stage).observe(seconds)
+    if not passed:
+        ATTENDANCE_SUBMISSIONS.labels(REJECTION_REASONS.get(stage, stage)).inc()
+    elif stage == ADMISSION_STAGES[-1]:
+        # Passing the last stage is what accepting a submission means
+        ATTENDANCE_SUBMISSIONS.labels('accepted').inc()
+
+
+def record_upload(kind, photo_bytes):
+    PHOTO_UPLOAD_BYTES.labels(kind).observe(photo_bytes)
+
+
+def record_photo(result, error):
+    """Account one photo finished by the pipeline, a ProcessedPhoto or the error that stopped it."""
+    if error is not None:
+        PHOTOS_PROCESSED.labels('failed').inc()
+        return
+    PHOTOS_PROCESSED.labels('ok').inc()
+    PHOTO_PROCESSING_SECONDS.observe(result.seconds)
+    PHOTO_OUTPUT_BYTES.labels('full').inc(len(result.photo))
+    for size, data in result.derivatives.items():
+        PHOTO_OUTPUT_BYTES.labels(size).inc(len(data))
+
+
+def exposition():
+    """``(body, content_type)`` of every worker's metrics in the text exposition format."""
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
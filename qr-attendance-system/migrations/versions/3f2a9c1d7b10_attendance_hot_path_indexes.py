@@ -0,0 +1,45 @@
+"""attendance hot path indexes
+
+Revision ID: 3f2a9c1d7b10
+Revises: 
+Create Date: 2026-10-18 09:30:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '3f2a9c1d7b10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+# (name, table, columns, unique); mirrors the __table_args__ in main.py
+INDEXES = [
+    ('uq_attendance_student_course', 'attendance', ['student_id', 'course_id'], True),
+    ('ix_attendance_course_timestamp', 'attendance', ['course_id', 'timestamp'], False),
+    ('ix_attendance_timestamp', 'attendance', ['timestamp', 'id'], False),
+    ('ix_attendance_location_verified', 'attendance', ['location_verified'], False),
+    ('ix_course_department_start', 'course', ['department_id', 'start_time'], False),
+    ('ix_course_instructor_start', 'course', ['instructor_id', 'start_time'], False),
+    ('ix_course_start_end', 'course', ['start_time', 'end_time'], False),
+]
+
+
+def upgrade():
+    # init_db()'s create_all() already builds these on fresh databases,
+    # so every statement has to be a no-op when the index exists.
+
+    # Keep the earliest check-in per (student, course) so the unique index can be built
+    op.execute(
+        'DELETE FROM attendance WHERE id NOT IN '
+        '(SELECT MIN(id) FROM attendance GROUP BY student_id, course_id)'
+    )
+    for name, table, columns, unique in INDEXES:
+        op.execute('CREATE {}INDEX IF NOT EXISTS {} ON {} ({})'.format(
+            'UNIQUE ' if unique else '', name, table, ', '.join(columns)))
+
+
+def downgrade():
+    for name, table, columns, unique in reversed(INDEXES):
+        op.execute('DROP INDEX IF EXISTS {}'.format(name))
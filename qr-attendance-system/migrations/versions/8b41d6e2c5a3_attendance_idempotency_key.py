@@ -0,0 +1,31 @@
+"""attendance idempotency key
+
+Revision ID: 8b41d6e2c5a3
+Revises: 3f2a9c1d7b10
+Create Date: 2026-10-18 11:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b41d6e2c5a3'
+down_revision = '3f2a9c1d7b10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # create_all() already adds the column on fresh databases
+    columns = [c['name'] for c in sa.inspect(op.get_bind()).get_columns('attendance')]
+    if 'idempotency_key' not in columns:
+        with op.batch_alter_table('attendance') as batch_op:
+            batch_op.add_column(sa.Column('idempotency_key', sa.String(length=64), nullable=True))
+    op.execute('CREATE UNIQUE INDEX IF NOT EXISTS ix_attendance_idempotency_key ON attendance (idempotency_key)')
+
+
+def downgrade():
+    op.execute('DROP INDEX IF EXISTS ix_attendance_idempotency_key')
+    with op.batch_alter_table('attendance') as batch_op:
+        batch_op.drop_column('idempotency_key')
@@ -0,0 +1,24 @@
+"""attendance photo_path index
+
+Revision ID: c7e19a4f2d06
+Revises: 8b41d6e2c5a3
+Create Date: 2026-10-18 14:20:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7e19a4f2d06'
+down_revision = '8b41d6e2c5a3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Content-addressed photos can be shared, so deleting one first looks for other references
+    op.execute('CREATE INDEX IF NOT EXISTS ix_attendance_photo_path ON attendance (photo_path)')
+
+
+def downgrade():
+    op.execute('DROP INDEX IF EXISTS ix_attendance_photo_path')
@@ -0,0 +1,74 @@
+"""recurring course series
+
+Revision ID: d4a8b2f61c37
+Revises: c7e19a4f2d06
+Create Date: 2026-10-18 18:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4a8b2f61c37'
+down_revision = 'c7e19a4f2d06'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # create_all() already adds the tables and column on fresh databases
+    inspector = sa.inspect(op.get_bind())
+    tables = inspector.get_table_names()
+    if 'course_series' not in tables:
+        op.create_table(
+            'course_series',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('course_name', sa.String(length=100), nullable=False),
+            sa.Column('course_code', sa.String(length=10), nullable=False),
+            sa.Column('class_location', sa.String(length=100), nullable=False),
+            sa.Column('instructor_id', sa.Integer(), sa.ForeignKey('user.id'), nullable=False),
+            sa.Column('department_id', sa.Integer(), sa.ForeignKey('department.id'), nullable=False),
+            sa.Column('latitude', sa.Float(), nullable=True),
+            sa.Column('longitude', sa.Float(), nullable=True),
+            sa.Column('max_distance', sa.Float(), nullable=True),
+            sa.Column('year', sa.Integer(), nullable=False),
+            sa.Column('session', sa.String(length=20), nullable=False),
+            sa.Column('weekdays', sa.String(length=20), nullable=False),
+            sa.Column('start_clock', sa.Time(), nullable=False),
+            sa.Column('duration_minutes', sa.Integer(), nullable=False),
+            sa.Column('first_date', sa.Date(), nullable=False),
+            sa.Column('last_date', sa.Date(), nullable=False),
+            sa.Column('generated_until', sa.Date(), nullable=False),
+        )
+    if 'series_exception' not in tables:
+        op.create_table(
+            'series_exception',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('series_id', sa.Integer(), sa.ForeignKey('course_series.id', ondelete='CASCADE'),
+                      nullable=False),
+            sa.Column('date', sa.Date(), nullable=False),
+            sa.UniqueConstraint('series_id', 'date', name='uq_series_exception_date'),
+        )
+    if 'holiday' not in tables:
+        op.create_table(
+            'holiday',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('date', sa.Date(), nullable=False, unique=True),
+            sa.Column('name', sa.String(length=100), nullable=False),
+        )
+    columns = [c['name'] for c in inspector.get_columns('course')]
+    if 'series_id' not in columns:
+        with op.batch_alter_table('course') as batch_op:
+            batch_op.add_column(sa.Column('series_id', sa.Integer(), nullable=True))
+            batch_op.create_foreign_key('fk_course_series_id', 'course_series', ['series_id'], ['id'])
+    op.execute('CREATE UNIQUE INDEX IF NOT EXISTS ix_course_series_start ON course (series_id, start_time)')
+
+
+def downgrade():
+    op.execute('DROP INDEX IF EXISTS ix_course_series_start')
+    with op.batch_alter_table('course') as batch_op:
+        batch_op.drop_column('series_id')
+    op.drop_table('holiday')
+    op.drop_table('series_exception')
+    op.drop_table('course_series')
@@ -0,0 +1,49 @@
+"""daily attendance rollups
+
+Revision ID: e5c3f81a9d27
+Revises: d4a8b2f61c37
+Create Date: 2026-10-18 21:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5c3f81a9d27'
+down_revision = 'd4a8b2f61c37'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # create_all() already adds the tables on fresh databases; fill them with flask rollup-attendance
+    tables = sa.inspect(op.get_bind()).get_table_names()
+    if 'course_daily_attendance' not in tables:
+        op.create_table(
+            'course_daily_attendance',
+            sa.Column('department_id', sa.Integer(), primary_key=True),
+            sa.Column('course_code', sa.String(length=10), primary_key=True),
+            sa.Column('day', sa.Date(), primary_key=True),
+            sa.Column('checkins', sa.Integer(), nullable=False),
+            sa.Column('verified', sa.Integer(), nullable=False),
+            sa.Column('on_time', sa.Integer(), nullable=False),
+        )
+    if 'department_daily_attendance' not in tables:
+        op.create_table(
+            'department_daily_attendance',
+            sa.Column('department_id', sa.Integer(), primary_key=True),
+            sa.Column('day', sa.Date(), primary_key=True),
+            sa.Column('checkins', sa.Integer(), nullable=False),
+            sa.Column('verified', sa.Integer(), nullable=False),
+            sa.Column('on_time', sa.Integer(), nullable=False),
+        )
+    op.execute('CREATE INDEX IF NOT EXISTS ix_course_daily_attendance_day ON course_daily_attendance (day)')
+    op.execute('CREATE INDEX IF NOT EXISTS ix_department_daily_attendance_day ON department_daily_attendance (day)')
+
+
+def downgrade():
+    op.execute('DROP INDEX IF EXISTS ix_department_daily_attendance_day')
+    op.execute('DROP INDEX IF EXISTS ix_course_daily_attendance_day')
+    op.drop_table('department_daily_attendance')
+    op.drop_table('course_daily_attendance')
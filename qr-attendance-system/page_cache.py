@@ -0,0 +1,117 @@
+"""Per-process cache of the rendered student landing pages.
+
+Every student arriving for a lecture opens the departments list and then
+their department's attend page, and both only change when an admin or
+instructor edits a department or course. Rendering them once per worker and
+answering the rest from here, with an ETag and Last-Modified so returning
+browsers get a 304, keeps a lecture rush off the database and Jinja.
+
+Entries are keyed by page and department and belong to the day they were
+rendered on, so "today's courses" never outlives midnight. A render can
+also say when its page stops being accurate (the next course opening or
+closing for attendance). Routes that change courses or departments
+invalidate explicitly; the TTL bounds how long another gunicorn worker can
+serve a page from before the edit, and how stale the attendance counts on
+the attend page can be.
+"""
+import hashlib
+import threading
+import time
+from collections import namedtuple
+from datetime import date, datetime
+
+
+class CachedPage(namedtuple('CachedPage', ['body', 'etag', 'last_modified', 'day', 'expires'])):
+    """A rendered page with its validators; ``expires`` is on the time.monotonic() clock."""
+
+    __slots__ = ()
+
+
+class PageCache:
+    """Thread-safe ``(page, key) -> CachedPage`` cache with a TTL safety net.
+
+    ``get(page, key, render)`` calls ``render()`` on a miss; it returns the
+    body and the datetime the page stops being accurate, or None. Concurrent
+    misses for the same page wait for a single render.
+    """
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._render_locks = {}
+        self._generation = 0
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+        self._render_seconds = 0.0
+
+    def _fresh(self, page, key, today, now):
+        entry = self._entries.get((page, key))
+        if entry is not None and entry.day == today and entry.expires > now:
+            return entry
+        return None
+
+    def get(self, page, key, render):
+        today = date.today()
+        with self._lock:
+            entry = self._fresh(page, key, today, time.monotonic())
+            if entry is not None:
+                self._hits += 1
+                return entry
+            render_lock = self._render_locks.setdefault((page, key), threading.Lock())
+
+        with render_lock:
+            with self._lock:
+                # Rendered by another thread while this one waited
+                entry = self._fresh(page, key, today, time.monotonic())
+                if entry is not None:
+                    self._hits += 1
+                    return entry
+                self._misses += 1
+                generation = self._generation
+
+            started = time.perf_counter()
+            body, valid_until = render()
+            if isinstance(body, str):
+                body = body.encode('utf-8')
+            etag = hashlib.sha256(body).hexdigest()[:32]
+            now = time.monotonic()
+            expires = now + self.ttl
+            if valid_until is not None:
+                expires = min(expires, now + max(0.0, (valid_until - datetime.now()).total_seconds()))
+            with self._lock:
+                self._render_seconds += time.perf_counter() - started
+                previous = self._entries.get((page, key))
+                # An unchanged page keeps its Last-Modified, so If-Modified-Since still matches
+                if previous is not None and previous.etag == etag:
+                    last_modified = previous.last_modified
+                else:
+                    last_modified = datetime.utcnow().replace(microsecond=0)
+                entry = CachedPage(body, etag, last_modified, today, expires)
+                if generation == self._generation:
+                    self._entries[(page, key)] = entry
+            return entry
+
+    def invalidate(self, page=None, key=None):
+        """Drop one page, every key of ``page``, or everything when ``page`` is None."""
+        with self._lock:
+            self._invalidations += 1
+            # Renders already under way read the data from before the change
+            self._generation += 1
+            if page is None:
+                self._entries.clear()
+            else:
+                for cached in [k for k in self._entries if k[0] == page and (key is None or k[1] == key)]:
+                    del self._entries[cached]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'ttl_seconds': self.ttl,
+                'hits': self._hits,
+                'misses': self._misses,
+                'invalidations': self._invalidations,
+                'avg_render_ms': round(self._render_seconds * 1000 / self._misses, 3) if self._misses else None,
+            }
@@ -0,0 +1,104 @@
+"""Keyset (cursor) pagination for the admin list pages.
+
+Pages are addressed by an opaque cursor holding the sort-key values of the
+last (or first) row shown, so every page is a bounded index range scan
+instead of an OFFSET that re-reads everything before it.
+"""
+import base64
+import json
+from datetime import date, datetime
+
+from sqlalchemy import and_, or_
+
+DEFAULT_PER_PAGE = 50
+MAX_PER_PAGE = 500
+
+
+def encode_cursor(values):
+    payload = [v.isoformat() if isinstance(v, (datetime, date)) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, columns):
+    """Turn a cursor back into typed values for ``columns``; raises ValueError if malformed."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception:
+        raise ValueError('Invalid pagination cursor')
+    if not isinstance(payload, list) or len(payload) != len(columns):
+        raise ValueError('Invalid pagination cursor')
+
+    values = []
+    for column, value in zip(columns, payload):
+        python_type = column.type.python_type
+        if value is not None and python_type is datetime:
+            value = datetime.fromisoformat(value)
+        elif value is not None and python_type is date:
+            value = date.fromisoformat(value)
+        values.append(value)
+    return values
+
+
+def _after(columns, values, descending):
+    """WHERE clause selecting rows strictly after ``values`` in the sort order."""
+    clauses = []
+    for i, column in enumerate(columns):
+        equal_prefix = [columns[j] == values[j] for j in range(i)]
+        beyond = column < values[i] if descending else column > values[i]
+        clauses.append(and_(*equal_prefix, beyond))
+    return or_(*clauses)
+
+
+class KeysetPage:
+    """One page of results plus the cursors for its neighbours."""
+
+    def __init__(self, items, next_cursor, prev_cursor, per_page):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.per_page = per_page
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def keyset_paginate(query, columns, after=None, before=None, per_page=DEFAULT_PER_PAGE, descending=False):
+    """Return a KeysetPage of ``query`` ordered by ``columns``.
+
+    ``columns`` must end with a unique column (normally the primary key) so
+    the order is total. ``after``/``before`` are cursors taken from a
+    previous page's ``next_cursor``/``prev_cursor``.
+    """
+    per_page = max(1, min(int(per_page or DEFAULT_PER_PAGE), MAX_PER_PAGE))
+    backwards = before is not None and after is None
+    cursor = before if backwards else after
+
+    if cursor:
+        # Going backwards walks the reversed order from the cursor, then flips the rows
+        query = query.filter(_after(columns, decode_cursor(cursor, columns), descending != backwards))
+
+    scan_descending = descending != backwards
+    query = query.order_by(*[c.desc() if scan_descending else c.asc() for c in columns])
+    rows = query.limit(per_page + 1).all()
+
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    def key(row):
+        return encode_cursor([getattr(row, c.key) for c in columns])
+
+    if backwards:
+        next_cursor = key(rows[-1]) if rows else None
+        prev_cursor = key(rows[0]) if rows and more else None
+    else:
+        next_cursor = key(rows[-1]) if rows and more else None
+        prev_cursor = key(rows[0]) if rows and cursor else None
+    return KeysetPage(rows, next_cursor, prev_cursor, per_page)
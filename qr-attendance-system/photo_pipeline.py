@@ -0,0 +1,259 @@
+"""Background photo processing for attendance submissions.
+
+mark_attendance only persists the raw upload and the Attendance row; the
+resize and JPEG re-encode run here, off the gunicorn request threads,
+along with the small and medium derivatives the roster pages display.
+Jobs take bytes, or the path of an upload already stored on the local
+filesystem, and return bytes, so the pool never writes to photo storage.
+"""
+import io
+import multiprocessing
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from PIL import Image
+
+MAX_PHOTO_SIZE = (800, 800)
+JPEG_QUALITY = 85
+# Resized copies stored alongside each photo, sized for 2x displays
+PHOTO_SIZES = {
+    'small': (120, 120),   # roster thumbnails, shown at 50-60px
+    'medium': (480, 480),  # photo preview modals
+}
+DERIVATIVE_QUALITY = 80
+PIPELINE_MODES = ('process', 'thread', 'sync')
+# Uploads are sniffed (header only) against these before anything is written
+ALLOWED_PHOTO_FORMATS = ('JPEG', 'PNG', 'WEBP')
+# File extension stored for each accepted format
+PHOTO_EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp'}
+MAX_SOURCE_DIMENSION = 4096
+MIN_SOURCE_DIMENSION = 32
+# Werkzeug keeps multipart files up to this size in memory before spooling to disk
+MULTIPART_SPOOL_BYTES = 500 * 1024
+
+
+def _flatten(img):
+    """Convert ``img`` to a mode JPEG can store, compositing transparency onto white."""
+    if img.mode in ('RGBA', 'LA'):
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
+        return background
+    if img.mode not in ('RGB', 'L'):
+        return img.convert('RGB')
+    return img
+
+
+def _jpeg_bytes(img, quality):
+    buffer = io.BytesIO()
+    img.save(buffer, 'JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def _resized(img, size):
+    derivative = img.copy()
+    derivative.thumbnail(PHOTO_SIZES[size], Image.Resampling.LANCZOS)
+    return _jpeg_bytes(derivative, DERIVATIVE_QUALITY)
+
+
+ProcessedPhoto = namedtuple('ProcessedPhoto', ['photo', 'derivatives', 'seconds'])
+
+
+def process_photo(data, max_size=MAX_PHOTO_SIZE, quality=JPEG_QUALITY):
+    """Resize and re-encode the photo ``data`` (bytes or a file path) as JPEG and make its derivatives.
+
+    Returns a ProcessedPhoto of the JPEG bytes, ``{size: bytes}`` and the
+    processing time in seconds. This runs inside pool workers, so it has to
+    stay a module-level function with picklable arguments.
+    """
+    started = time.perf_counter()
+    with Image.open(io.BytesIO(data) if isinstance(data, bytes) else data) as img:
+        img = _flatten(img)
+        img.thumbnail(max_size, Image.Resampling.LANCZOS)
+        photo = _jpeg_bytes(img, quality)
+        derivatives = {size: _resized(img, size) for size in PHOTO_SIZES}
+    return ProcessedPhoto(photo, derivatives, time.perf_counter() - started)
+
+
+def make_derivative(data, size):
+    """JPEG bytes of the ``size`` derivative of the photo ``data``.
+
+    Used for photos stored before derivatives existed and for ones saved
+    outside the pipeline (admin uploads).
+    """
+    if size not in PHOTO_SIZES:
+        raise ValueError(f'Unknown photo size: {size}')
+    with Image.open(io.BytesIO(data)) as img:
+        return _resized(_flatten(img), size)
+
+
+def sniff_photo(fp):
+    """Check the format and dimensions of the image in ``fp`` from its header alone.
+
+    Returns ``(format, width, height)`` and raises ValueError for anything the
+    pipeline should not accept. The pixel data is never decoded, and the Image
+    is deliberately not closed because that would close ``fp`` as well.
+    """
+    try:
+        img = Image.open(fp)
+    except Exception:
+        raise ValueError('Unrecognised image data')
+    width, height = img.size
+    if img.format not in ALLOWED_PHOTO_FORMATS:
+        raise ValueError(f'Unsupported image format: {img.format}')
+    if max(width, height) > MAX_SOURCE_DIMENSION:
+        raise ValueError(f'Image is too large ({width}x{height}, max {MAX_SOURCE_DIMENSION}px per side)')
+    if min(width, height) < MIN_SOURCE_DIMENSION:
+        raise ValueError(f'Image is too small ({width}x{height})')
+    return img.format, width, height
+
+
+def data_url_size(photo_bytes, mime_type='image/jpeg'):
+    """Length of the ``data:<mime>;base64,...`` string that encodes ``photo_bytes`` bytes."""
+    return len(f'data:{mime_type};base64,') + 4 * ((photo_bytes + 2) // 3)
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class PhotoPipeline:
+    """Runs process_photo jobs on a worker pool and keeps queue metrics.
+
+    ``mode`` is 'process' (a process pool), 'thread' (a thread pool) or
+    'sync', which processes inline inside submit() so tests stay deterministic.
+    """
+
+    def __init__(self, mode='process', workers=2, latency_window=500):
+        if mode not in PIPELINE_MODES:
+            raise ValueError(f'Unknown photo pipeline mode: {mode}')
+        self.mode = mode
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self._queue_depth = 0
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._latencies = deque(maxlen=latency_window)
+        self._processing_times = deque(maxlen=latency_window)
+        self._uploads = {'multipart': 0, 'data_url': 0}
+        self._upload_bytes = 0
+        self._wire_bytes_saved = 0
+        self._memory_bytes_saved = 0
+
+    def _get_executor(self):
+        # Built lazily so every gunicorn worker gets its own pool after the fork
+        with self._lock:
+            if self._executor is None:
+                if self.mode == 'process':
+                    methods = multiprocessing.get_all_start_methods()
+                    context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+                else:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='photo')
+            return self._executor
+
+    def record_upload(self, kind, photo_bytes, buffered=False):
+        """Account one upload of ``photo_bytes`` bytes received as 'multipart' or 'data_url'.
+
+        Returns ``(wire_saved, memory_saved)`` in bytes for this request. A
+        data URL costs the base64 string on the wire, and in memory the form
+        value, its split() copy and the decoded bytes. A multipart upload holds
+        the spooled file, only up to MULTIPART_SPOOL_BYTES of it in memory, and
+        is stored and processed from that file; ``buffered`` says it was read
+        into memory as well, for a store the pipeline can't read from by path.
+        """
+        wire_saved = memory_saved = 0
+        if kind == 'multipart':
+            encoded = data_url_size(photo_bytes)
+            wire_saved = encoded - photo_bytes
+            memory_saved = 2 * encoded + photo_bytes - min(photo_bytes, MULTIPART_SPOOL_BYTES)
+            if buffered:
+                memory_saved -= photo_bytes
+        with self._lock:
+            self._uploads[kind] += 1
+            self._upload_bytes += photo_bytes
+            self._wire_bytes_saved += wire_saved
+            self._memory_bytes_saved += memory_saved
+        return wire_saved, memory_saved
+
+    def submit(self, data, on_done=None):
+        """Queue the photo ``data``, bytes or the path of a local file.
+
+        ``on_done(result, error)`` is called once it is processed, with a
+        ProcessedPhoto or the exception that stopped it.
+        """
+        enqueued = time.perf_counter()
+        with self._lock:
+            self._queue_depth += 1
+            self._submitted += 1
+
+        if self.mode == 'sync':
+            try:
+                result = process_photo(data)
+            except Exception as e:
+                self._finish(enqueued, None, e, on_done)
+            else:
+                self._finish(enqueued, result, None, on_done)
+            return
+
+        def done(future):
+            error = future.exception()
+            self._finish(enqueued, None if error else future.result(), error, on_done)
+
+        self._get_executor().submit(process_photo, data).add_done_callback(done)
+
+    def _finish(self, enqueued, result, error, on_done):
+        with self._lock:
+            self._queue_depth -= 1
+            if error is None:
+                self._completed += 1
+                self._processing_times.append(result.seconds)
+            else:
+                self._failed += 1
+            self._latencies.append(time.perf_counter() - enqueued)
+        if on_done is not None:
+            on_done(result, error)
+
+    def stats(self):
+        """Snapshot of queue depth, throughput counters and latencies in milliseconds."""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            processing = list(self._processing_times)
+            snapshot = {
+                'mode': self.mode,
+                'workers': self.workers,
+                'queue_depth': self._queue_depth,
+                'submitted': self._submitted,
+                'completed': self._completed,
+                'failed': self._failed,
+                'uploads': dict(self._uploads),
+                'upload_bytes': self._upload_bytes,
+                'wire_bytes_saved': self._wire_bytes_saved,
+                'memory_bytes_saved': self._memory_bytes_saved,
+            }
+            multipart = self._uploads['multipart']
+
+        def ms(value):
+            return round(value * 1000, 2) if value is not None else None
+
+        snapshot.update({
+            'latency_avg_ms': ms(sum(latencies) / len(latencies)) if latencies else None,
+            'latency_p50_ms': ms(_percentile(latencies, 50)),
+            'latency_p95_ms': ms(_percentile(latencies, 95)),
+            'processing_avg_ms': ms(sum(processing) / len(processing)) if processing else None,
+            'wire_bytes_saved_per_multipart': snapshot['wire_bytes_saved'] // multipart if multipart else None,
+            'memory_bytes_saved_per_multipart': snapshot['memory_bytes_saved'] // multipart if multipart else None,
+        })
+        return snapshot
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
@@ -0,0 +1,141 @@
+"""Signed, rotating course QR codes.
+
+A course QR code encodes a link carrying a short token
+``<course_id>.<slot>.<signature>``, where ``slot`` counts rotation
+intervals since the epoch and the signature is an HMAC of both. Any
+worker can verify a token from the secret alone, with no database
+lookup. Rendered images change once per slot, so they are cached in a
+small LRU and served with an ETag.
+"""
+import base64
+import hashlib
+import hmac
+import io
+import math
+import threading
+import time
+from collections import OrderedDict
+
+import qrcode
+import qrcode.image.svg
+
+QR_FORMATS = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+
+
+class QRSigner:
+    """Issues and verifies course tokens that rotate every ``interval`` seconds.
+
+    A token stays valid for ``max_age`` seconds after its slot began, so a
+    student who scanned just before a rotation still has time to submit.
+    """
+
+    def __init__(self, secret, interval=30, max_age=300):
+        if isinstance(secret, str):
+            secret = secret.encode('utf-8')
+        self._key = hashlib.sha256(b'qr-token:' + secret).digest()
+        self.interval = interval
+        self.max_age = max_age
+
+    def slot(self, now=None):
+        return int((time.time() if now is None else now) // self.interval)
+
+    def seconds_left(self, now=None):
+        """Seconds until the current slot rotates."""
+        now = time.time() if now is None else now
+        return self.interval - (now % self.interval)
+
+    def _signature(self, course_id, slot):
+        digest = hmac.new(self._key, f'{course_id}.{slot}'.encode(), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest[:12]).decode()
+
+    def token(self, course_id, now=None):
+        slot = self.slot(now)
+        return f'{course_id}.{slot}.{self._signature(course_id, slot)}'
+
+    def course_id(self, token):
+        """The course a token claims to be for, unverified; raises ValueError if malformed."""
+        try:
+            return int(token.split('.', 1)[0])
+        except (AttributeError, ValueError):
+            raise ValueError('Invalid QR code')
+
+    def verify(self, token, course_id, now=None):
+        """Check ``token`` was issued for ``course_id`` recently; raises ValueError if not."""
+        try:
+            token_course, slot, signature = token.split('.')
+            token_course, slot = int(token_course), int(slot)
+        except (AttributeError, ValueError):
+            raise ValueError('Invalid QR code')
+        if not hmac.compare_digest(signature, self._signature(token_course, slot)):
+            raise ValueError('Invalid QR code')
+        if token_course != course_id:
+            raise ValueError('This QR code is for a different course')
+        current = self.slot(now)
+        if slot > current or current - slot > math.ceil(self.max_age / self.interval):
+            raise ValueError('This QR code has expired. Please scan the code on the screen again')
+
+
+def render_qr(data, fmt):
+    """Encode ``data`` as a QR image; returns the file bytes."""
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M, box_size=10, border=4)
+    qr.add_data(data)
+    qr.make(fit=True)
+    buffer = io.BytesIO()
+    if fmt == 'svg':
+        qr.make_image(image_factory=qrcode.image.svg.SvgPathImage).save(buffer)
+    elif fmt == 'png':
+        qr.make_image().save(buffer)
+    else:
+        raise ValueError(f'Unsupported QR format: {fmt}')
+    return buffer.getvalue()
+
+
+class QRImageCache:
+    """Thread-safe LRU of rendered QR images keyed by ``(data, fmt)``.
+
+    ``get`` returns ``(image_bytes, etag)``. With one token per course per
+    slot, a projector and any number of reloads cost one render per slot.
+    """
+
+    def __init__(self, maxsize=256, renderer=render_qr):
+        self.maxsize = maxsize
+        self.renderer = renderer
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._render_seconds = 0.0
+
+    def get(self, data, fmt):
+        key = (data, fmt)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return entry
+            self._misses += 1
+
+        started = time.perf_counter()
+        image = self.renderer(data, fmt)
+        entry = (image, hashlib.sha256(image).hexdigest()[:32])
+        with self._lock:
+            self._render_seconds += time.perf_counter() - started
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return entry
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self._hits,
+                'misses': self._misses,
+                'avg_render_ms': round(self._render_seconds * 1000 / self._misses, 3) if self._misses else None,
+            }
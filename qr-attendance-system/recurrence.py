@@ -0,0 +1,277 @@
+"""Recurring course sessions.
+
+A course that meets every week is stored once as a series: the course
+details, the weekdays and time it meets, and the dates of its first and
+last week. SessionScheduler turns series into ordinary Course rows, so
+everything that works on a course (attend, QR codes, reports) works on a
+session unchanged.
+
+Sessions are only materialized up to a rolling horizon, ``horizon_days``
+from today, and each series records in ``generated_until`` how far it has
+been materialized. ``materialize`` extends every series that is behind with
+executemany inserts, one transaction per batch of sessions. Keeping the
+course table to the weeks that are near keeps the per-department "today's
+courses" query in attend cheap however long the semester is.
+
+Dates in a series' exceptions and campus-wide holidays get no session.
+``reconcile`` brings the sessions of a series that have not started yet in
+line after the series, its exceptions or the holidays change: sessions on
+dates that still apply are updated in place, keeping their ids and QR
+codes; sessions on dates that no longer apply are deleted; missing dates
+are inserted. Sessions that have started are history and never touched.
+
+``ensure_horizon`` moves the horizon once a day on a background thread, so
+no request waits for it, and a file lock keeps the workers on a host from
+all doing the same run; the ``generated_until`` claims keep runs on
+different hosts from inserting a session twice.
+"""
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import bindparam, select
+
+try:
+    import fcntl
+except ImportError:
+    # No file locks on Windows; the generated_until claims still keep concurrent runs correct
+    fcntl = None
+
+WEEKDAY_NAMES = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+BATCH_ROWS = 500
+# Course columns every session copies from its series
+SESSION_FIELDS = ('course_name', 'course_code', 'class_location', 'instructor_id', 'department_id', 'latitude',
+                  'longitude', 'max_distance', 'year', 'session')
+
+
+def parse_weekdays(text):
+    """Weekday numbers (Monday is 0) from a series' ``weekdays`` column, e.g. '0,2'."""
+    return sorted({int(day) for day in text.split(',') if day.strip()})
+
+
+def format_weekdays(days):
+    return ','.join(str(day) for day in sorted(set(days)))
+
+
+def session_dates(weekdays, start, end, skipped=()):
+    """Dates from ``start`` to ``end`` inclusive that fall on ``weekdays``, minus ``skipped``."""
+    days = set(weekdays)
+    dates = []
+    day = start
+    while day <= end:
+        if day.weekday() in days and day not in skipped:
+            dates.append(day)
+        day += timedelta(days=1)
+    return dates
+
+
+def session_values(series, day):
+    """Course column values for the session of ``series`` (a series table row) on ``day``."""
+    start = datetime.combine(day, series.start_clock)
+    values = {field: getattr(series, field) for field in SESSION_FIELDS}
+    values.update(series_id=series.id, start_time=start, end_time=start + timedelta(minutes=series.duration_minutes))
+    return values
+
+
+class SessionScheduler:
+    """Materializes and reconciles the course sessions of recurring series.
+
+    ``engine`` is a callable returning the engine to write with; ``series``,
+    ``courses``, ``exceptions`` and ``holidays`` are the tables.
+    ``on_insert(connection, rows)``, if given, runs inside each transaction
+    with the inserted session values. ``lock_path`` is the file ensure_horizon
+    locks so one process per host runs it.
+    """
+
+    def __init__(self, engine, series, courses, exceptions, holidays, horizon_days=14, batch_rows=BATCH_ROWS,
+                 on_insert=None, lock_path=None):
+        self.engine = engine
+        self.series = series
+        self.courses = courses
+        self.exceptions = exceptions
+        self.holidays = holidays
+        self.horizon_days = horizon_days
+        self.batch_rows = batch_rows
+        self.on_insert = on_insert
+        self.lock_path = lock_path
+        self._lock = threading.Lock()
+        self._horizon_day = None
+        self._runs = 0
+        self._sessions = 0
+        self._batches = 0
+        self._conflicts = 0
+        self._reconciles = 0
+        self._last_run = None
+
+    def _skipped(self, conn, series_ids, start, end):
+        """``series_id -> set of dates`` that get no session between ``start`` and ``end``."""
+        holidays = {day for (day,) in conn.execute(
+            select(self.holidays.c.date).where(self.holidays.c.date.between(start, end)))}
+        skipped = {series_id: set(holidays) for series_id in series_ids}
+        exceptions = conn.execute(select(self.exceptions.c.series_id, self.exceptions.c.date).where(
+            self.exceptions.c.series_id.in_(series_ids), self.exceptions.c.date.between(start, end)))
+        for series_id, day in exceptions:
+            skipped[series_id].add(day)
+        return skipped
+
+    def _write_batch(self, claims, rows):
+        """Advance ``generated_until`` for each ``(series, until)`` and insert its sessions in one transaction.
+
+        Returns the sessions written and the series another process had
+        already extended, whose sessions are left out.
+        """
+        s = self.series.c
+        with self.engine().begin() as conn:
+            won = set()
+            for series, until in claims:
+                # Matches no row if another worker extended the series since it was read
+                result = conn.execute(self.series.update()
+                                      .where(s.id == series.id, s.generated_until == series.generated_until)
+                                      .values(generated_until=until))
+                if result.rowcount:
+                    won.add(series.id)
+            rows = [row for row in rows if row['series_id'] in won]
+            if rows:
+                conn.execute(self.courses.insert(), rows)
+                if self.on_insert is not None:
+                    self.on_insert(conn, rows)
+        return len(rows), len(claims) - len(won)
+
+    def materialize(self, series_ids=None, today=None, horizon_days=None):
+        """Extend every series, or just ``series_ids``, to the horizon; returns counts and timing."""
+        started = time.perf_counter()
+        today = today or date.today()
+        target = today + timedelta(days=self.horizon_days if horizon_days is None else horizon_days)
+        s = self.series.c
+        query = select(self.series).where(s.generated_until < s.last_date, s.generated_until < target)
+        if series_ids is not None:
+            query = query.where(s.id.in_(series_ids))
+        with self.engine().connect() as conn:
+            pending = conn.execute(query.order_by(s.id)).all()
+            if pending:
+                since = min(series.generated_until for series in pending) + timedelta(days=1)
+                skipped = self._skipped(conn, [series.id for series in pending], since, target)
+
+        sessions = batches = conflicts = 0
+        claims, rows = [], []
+        for i, series in enumerate(pending):
+            until = min(series.last_date, target)
+            start = max(series.first_date, series.generated_until + timedelta(days=1))
+            dates = session_dates(parse_weekdays(series.weekdays), start, until, skipped[series.id])
+            claims.append((series, until))
+            rows.extend(session_values(series, day) for day in dates)
+            if len(rows) >= self.batch_rows or i == len(pending) - 1:
+                written, lost = self._write_batch(claims, rows)
+                sessions += written
+                conflicts += lost
+                batches += 1
+                claims, rows = [], []
+
+        seconds = time.perf_counter() - started
+        with self._lock:
+            self._runs += 1
+            self._sessions += sessions
+            self._batches += batches
+            self._conflicts += conflicts
+            self._last_run = datetime.utcnow()
+        return {'series': len(pending), 'sessions': sessions, 'batches': batches, 'conflicts': conflicts,
+                'seconds': round(seconds, 3)}
+
+    def ensure_horizon(self, run, today=None):
+        """Start ``run()`` on a background thread once a day per process; cheap enough to call on every request.
+
+        ``run`` should extend the horizon with materialize() and handle its
+        errors. It is skipped when another process holds ``lock_path``, since
+        that process is doing the same run. Returns the thread when one was
+        started, otherwise None. A failed run is not retried until the next
+        day, which the horizon allows for.
+        """
+        today = today or date.today()
+        if self._horizon_day == today or not self._lock.acquire(blocking=False):
+            return None
+        try:
+            if self._horizon_day == today:
+                return None
+            self._horizon_day = today
+        finally:
+            self._lock.release()
+        thread = threading.Thread(target=self._run_locked, args=(run,), name='session-horizon', daemon=True)
+        thread.start()
+        return thread
+
+    def _run_locked(self, run):
+        if self.lock_path is None or fcntl is None:
+            run()
+            return
+        with open(self.lock_path, 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            try:
+                run()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def reconcile(self, series_id, now=None):
+        """Bring the sessions of one series that haven't started in line with the series.
+
+        A series that no longer exists loses its future sessions. Returns
+        the counts and the ids of the sessions updated or deleted.
+        """
+        now = now or datetime.now()
+        c = self.courses.c
+        s = self.series.c
+        with self.engine().begin() as conn:
+            series = conn.execute(select(self.series).where(s.id == series_id)).first()
+            existing = conn.execute(select(c.id, c.start_time).where(c.series_id == series_id, c.start_time > now)).all()
+            desired = {}
+            if series is not None:
+                if series.generated_until > series.last_date:
+                    # The series was shortened; don't let materialize think the dropped weeks exist
+                    conn.execute(self.series.update().where(s.id == series_id).values(generated_until=series.last_date))
+                start = max(series.first_date, now.date())
+                until = min(series.generated_until, series.last_date)
+                if start <= until:
+                    skipped = self._skipped(conn, [series_id], start, until)[series_id]
+                    for day in session_dates(parse_weekdays(series.weekdays), start, until, skipped):
+                        values = session_values(series, day)
+                        if values['start_time'] > now:
+                            desired[day] = values
+
+            updates, deleted = [], []
+            for course_id, start_time in existing:
+                values = desired.pop(start_time.date(), None)
+                if values is None:
+                    deleted.append(course_id)
+                else:
+                    # SET parameters can't share the column names
+                    updates.append(dict({f'_{name}': value for name, value in values.items()}, _id=course_id))
+            if updates:
+                columns = {key[1:]: bindparam(key) for key in updates[0] if key != '_id'}
+                conn.execute(self.courses.update().where(c.id == bindparam('_id')).values(columns), updates)
+            if deleted:
+                conn.execute(self.courses.delete().where(c.id.in_(deleted)))
+            inserted = list(desired.values())
+            if inserted:
+                conn.execute(self.courses.insert(), inserted)
+                if self.on_insert is not None:
+                    self.on_insert(conn, inserted)
+
+        with self._lock:
+            self._reconciles += 1
+        return {'updated': len(updates), 'deleted': len(deleted), 'inserted': len(inserted),
+                'course_ids': [update['_id'] for update in updates] + deleted}
+
+    def stats(self):
+        with self._lock:
+            return {
+                'horizon_days': self.horizon_days,
+                'batch_rows': self.batch_rows,
+                'runs': self._runs,
+                'sessions_materialized': self._sessions,
+                'batches': self._batches,
+                'conflicts': self._conflicts,
+                'reconciles': self._reconciles,
+                'last_run': self._last_run.isoformat() if self._last_run else None,
+            }
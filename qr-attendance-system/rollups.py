@@ -0,0 +1,230 @@
+"""Daily attendance rollups for reports and charts.
+
+Two summary tables hold check-in counts per session day, one per course
+(department and course code) and one per department. Each row counts the
+check-ins, the GPS-verified ones and the on-time ones (within
+ON_TIME_MINUTES of the start, as in the analytics); unverified and late are
+the differences. A chart over months or years reads a few hundred rollup
+rows instead of scanning Attendance.
+
+Like the dashboard counters, the rows are kept up to date inside the
+transaction that changes attendance: mapper events cover ORM inserts,
+updates and deletes, ``record_inserts`` covers Core inserts such as the
+group committer's, and a course edit that moves a session to another day,
+department or code rebuilds the days involved. Increments are upserts, so
+concurrent workers creating the same day's row don't conflict.
+
+``rebuild`` recomputes whole days from Attendance with two INSERT ...
+SELECTs. ``backfill`` runs it over a date range a chunk of days per
+transaction (flask rollup-attendance), for existing data and after bulk
+statements that bypass the events.
+"""
+import time
+from datetime import date, datetime, time as clock, timedelta
+
+from sqlalchemy import and_, case, event, func, select
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import object_session
+
+from analytics import ON_TIME_MINUTES, minutes_late
+from stats import track_history, value_before
+
+COUNT_COLUMNS = ('checkins', 'verified', 'on_time')
+# Days rebuilt per transaction by backfill
+CHUNK_DAYS = 31
+
+
+def is_on_time(timestamp, start):
+    minutes = (timestamp - start).total_seconds() / 60
+    return 0 <= minutes <= ON_TIME_MINUTES
+
+
+class DailyRollups:
+    """Keeps the ``course_daily`` and ``department_daily`` tables in step with ``attendance``.
+
+    ``course_daily`` is keyed by ``(department_id, course_code, day)`` and
+    ``department_daily`` by ``(department_id, day)``; both have the
+    COUNT_COLUMNS. ``engine`` is a callable returning the engine backfill
+    writes with. Call ``listen`` with the Attendance and Course models to
+    maintain the rows on ORM writes.
+    """
+
+    def __init__(self, engine, course_daily, department_daily, courses, attendance, chunk_days=CHUNK_DAYS):
+        self.engine = engine
+        self.course_daily = course_daily
+        self.department_daily = department_daily
+        self.courses = courses
+        self.attendance = attendance
+        self.chunk_days = chunk_days
+        self._course_model = None
+
+    def listen(self, attendance_model, course_model):
+        for attr in ('course_id', 'timestamp', 'location_verified'):
+            track_history(getattr(attendance_model, attr))
+        for attr in ('department_id', 'course_code', 'start_time'):
+            track_history(getattr(course_model, attr))
+        self._course_model = course_model
+        event.listen(attendance_model, 'after_insert', self._after_insert)
+        event.listen(attendance_model, 'after_delete', self._after_delete)
+        event.listen(attendance_model, 'after_update', self._after_update)
+        event.listen(course_model, 'after_update', self._after_course_update)
+
+    def _session(self, target, course_id):
+        """The Course checked into: ``target.course``, or the one ``course_id`` names when they differ."""
+        course = target.course
+        if course is not None and course.id == course_id:
+            return course
+        # A check-in moved to another course; its old course is usually in the identity map
+        return object_session(target).get(self._course_model, course_id)
+
+    def _change(self, target, course_id, timestamp, verified, sign):
+        if course_id is None:
+            return None
+        # Form handlers may assign the id as a string
+        course = self._session(target, int(course_id))
+        if course is None:
+            return None
+        return course.department_id, course.course_code, course.start_time, timestamp, verified, sign
+
+    def _after_insert(self, mapper, connection, target):
+        self._record(connection, [self._change(target, target.course_id, target.timestamp,
+                                               target.location_verified, 1)])
+
+    def _after_delete(self, mapper, connection, target):
+        self._record(connection, [self._change(target, target.course_id, target.timestamp,
+                                               target.location_verified, -1)])
+
+    def _after_update(self, mapper, connection, target):
+        old = tuple(value_before(target, attr) for attr in ('course_id', 'timestamp', 'location_verified'))
+        new = (target.course_id, target.timestamp, target.location_verified)
+        if old != new:
+            self._record(connection, [self._change(target, *old, -1), self._change(target, *new, 1)])
+
+    def _after_course_update(self, mapper, connection, target):
+        old_start = value_before(target, 'start_time')
+        if (old_start, value_before(target, 'department_id'), value_before(target, 'course_code')) != \
+                (target.start_time, target.department_id, target.course_code):
+            # The session's check-ins now count under another day, department or code
+            for day in {old_start.date(), target.start_time.date()}:
+                self.rebuild(connection, day, day)
+
+    def record_inserts(self, connection, rows):
+        """Count attendance ``rows`` inserted with Core statements on ``connection``.
+
+        Besides the column values each row carries the ``department_id``,
+        ``course_code`` and ``start_time`` of its session, which the insert
+        ignores.
+        """
+        self._record(connection, [(row['department_id'], row['course_code'], row['start_time'], row.get('timestamp'),
+                                   row.get('location_verified'), 1) for row in rows])
+
+    def _record(self, connection, changes):
+        """Apply ``(department_id, course_code, start_time, timestamp, verified, sign)`` changes to both rollups.
+
+        None entries, check-ins of a course that no longer exists, are skipped.
+        """
+        per_course, per_department = {}, {}
+        for change in changes:
+            if change is None:
+                continue
+            department_id, course_code, start_time, timestamp, verified, sign = change
+            day = start_time.date()
+            counts = (sign, sign if verified else 0,
+                      sign if timestamp is not None and is_on_time(timestamp, start_time) else 0)
+            for totals, key in ((per_course, (department_id, course_code, day)),
+                                (per_department, (department_id, day))):
+                current = totals.setdefault(key, [0, 0, 0])
+                for i, count in enumerate(counts):
+                    current[i] += count
+        self._increment(connection, self.course_daily, ('department_id', 'course_code', 'day'), per_course)
+        self._increment(connection, self.department_daily, ('department_id', 'day'), per_department)
+
+    def _increment(self, connection, table, keys, totals):
+        """Add ``{key tuple: counts}`` to ``table``, creating missing rows."""
+        rows = [dict(zip(keys, key), **dict(zip(COUNT_COLUMNS, counts)))
+                for key, counts in totals.items() if any(counts)]
+        if not rows:
+            return
+        dialect = connection.dialect.name
+        if dialect in ('sqlite', 'postgresql'):
+            insert = (sqlite_insert if dialect == 'sqlite' else postgresql_insert)(table)
+            connection.execute(insert.on_conflict_do_update(
+                index_elements=list(keys),
+                set_={name: table.c[name] + insert.excluded[name] for name in COUNT_COLUMNS}), rows)
+        elif dialect == 'mysql':
+            insert = mysql_insert(table)
+            connection.execute(insert.on_duplicate_key_update(
+                {name: table.c[name] + insert.inserted[name] for name in COUNT_COLUMNS}), rows)
+        else:
+            for row in rows:
+                updated = connection.execute(
+                    table.update().where(and_(*[table.c[key] == row[key] for key in keys]))
+                    .values({name: table.c[name] + row[name] for name in COUNT_COLUMNS})).rowcount
+                if not updated:
+                    connection.execute(table.insert(), row)
+
+    def rebuild(self, connection, start, end):
+        """Recompute the rollups of the days from ``start`` to ``end`` on ``connection``; returns the course rows."""
+        a, c = self.attendance.c, self.courses.c
+        cd, dd = self.course_daily, self.department_daily
+        connection.execute(cd.delete().where(cd.c.day.between(start, end)))
+        connection.execute(dd.delete().where(dd.c.day.between(start, end)))
+
+        late = minutes_late(a.timestamp, c.start_time)
+        day = func.date(c.start_time)
+        per_course = (select(c.department_id, c.course_code, day, func.count(),
+                             func.sum(case((a.location_verified.is_(True), 1), else_=0)),
+                             func.sum(case((and_(late >= 0, late <= ON_TIME_MINUTES), 1), else_=0)))
+                      .select_from(self.attendance.join(self.courses, a.course_id == c.id))
+                      .where(c.start_time >= datetime.combine(start, clock.min),
+                             c.start_time < datetime.combine(end + timedelta(days=1), clock.min))
+                      .group_by(c.department_id, c.course_code, day))
+        rows = connection.execute(
+            cd.insert().from_select(['department_id', 'course_code', 'day'] + list(COUNT_COLUMNS), per_course)
+        ).rowcount
+        per_department = (select(cd.c.department_id, cd.c.day, *[func.sum(cd.c[name]) for name in COUNT_COLUMNS])
+                          .where(cd.c.day.between(start, end)).group_by(cd.c.department_id, cd.c.day))
+        connection.execute(dd.insert().from_select(['department_id', 'day'] + list(COUNT_COLUMNS), per_department))
+        return rows
+
+    def backfill(self, start=None, end=None):
+        """Rebuild every day from ``start`` (the first session) to ``end`` (today), CHUNK_DAYS per transaction."""
+        started = time.perf_counter()
+        if start is None:
+            with self.engine().connect() as conn:
+                first = conn.execute(select(func.min(self.courses.c.start_time))).scalar()
+            start = first.date() if first is not None else date.today()
+        end = end or date.today()
+        days = rows = 0
+        chunk_start = start
+        while chunk_start <= end:
+            chunk_end = min(end, chunk_start + timedelta(days=self.chunk_days - 1))
+            with self.engine().begin() as conn:
+                rows += self.rebuild(conn, chunk_start, chunk_end)
+            days += (chunk_end - chunk_start).days + 1
+            chunk_start = chunk_end + timedelta(days=1)
+        return {'start': start.isoformat(), 'end': end.isoformat(), 'days': days, 'course_rows': rows,
+                'seconds': round(time.perf_counter() - started, 3)}
+
+    def department_days(self, connection, start, end, department_id=None):
+        """Daily counts from ``start`` to ``end``, for one department or summed over all of them."""
+        dd = self.department_daily
+        query = (select(dd.c.day, *[func.sum(dd.c[name]).label(name) for name in COUNT_COLUMNS])
+                 .where(dd.c.day.between(start, end)).group_by(dd.c.day).order_by(dd.c.day))
+        if department_id is not None:
+            query = query.where(dd.c.department_id == department_id)
+        return [dict(row._mapping) for row in connection.execute(query)]
+
+    def course_days(self, connection, department_id, course_code, start=None, end=None):
+        """Daily counts of one course code in a department, optionally limited to a date range."""
+        cd = self.course_daily
+        query = (select(cd.c.day, *[cd.c[name] for name in COUNT_COLUMNS])
+                 .where(cd.c.department_id == department_id, cd.c.course_code == course_code)
+                 .order_by(cd.c.day))
+        if start is not None:
+            query = query.where(cd.c.day >= start)
+        if end is not None:
+            query = query.where(cd.c.day <= end)
+        return [dict(row._mapping) for row in connection.execute(query)]
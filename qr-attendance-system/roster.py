@@ -0,0 +1,233 @@
+"""Bulk student roster import.
+
+Onboarding an intake means tens of thousands of students, so rosters are
+imported from a CSV or XLSX file instead of one form post each. Rows are
+read incrementally and written in batches: each batch prefetches which of
+its student IDs already exist with one query, inserts the new students with
+a single executemany and, when upserting, updates the existing ones the same
+way, all in one transaction. Department codes (or ids) are resolved through
+a lookup loaded once per import.
+
+Rows that can't be imported (missing or over-long fields, unknown
+departments, IDs repeated in the file, or already registered when not
+upserting) are skipped and collected with their line number for the
+report, so one bad row never fails the rest of the file.
+"""
+import os
+import time
+
+from sqlalchemy import bindparam, select
+from sqlalchemy.exc import IntegrityError
+
+from spreadsheets import read_csv, read_xlsx
+
+BATCH_ROWS = 1000
+
+REQUIRED_COLUMNS = ('student_id', 'full_name')
+
+# Header spellings accepted for each column, after lowercasing and replacing spaces with underscores
+HEADER_ALIASES = {
+    'student_id': 'student_id', 'id': 'student_id', 'student_number': 'student_id', 'index_number': 'student_id',
+    'full_name': 'full_name', 'name': 'full_name', 'student_name': 'full_name',
+    'email': 'email', 'email_address': 'email',
+    'phone': 'phone', 'phone_number': 'phone', 'mobile': 'phone',
+    'department': 'department', 'department_code': 'department', 'department_id': 'department',
+}
+
+
+def read_roster(stream, filename):
+    """Rows of a roster file object, read according to the extension of ``filename``."""
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == '.csv':
+        return read_csv(stream)
+    if ext == '.xlsx':
+        return read_xlsx(stream)
+    raise ValueError('Roster files must be .csv or .xlsx')
+
+
+def parse_roster(rows):
+    """Map the header row of ``rows`` to roster columns; returns an iterator of ``(line, record)``.
+
+    The header is read straight away, so a file missing a required column
+    raises ValueError before anything is imported. Records only have the
+    columns present in the file; blank rows are skipped.
+    """
+    rows = iter(rows)
+    line = 0
+    for header in rows:
+        line += 1
+        if any(cell.strip() for cell in header):
+            break
+    else:
+        raise ValueError('The roster file is empty')
+    columns = [HEADER_ALIASES.get(cell.strip().lower().replace(' ', '_')) for cell in header]
+    missing = [name for name in REQUIRED_COLUMNS if name not in columns]
+    if missing:
+        raise ValueError(f"The roster is missing the {', '.join(missing)} column(s)")
+    positions = {}
+    for index, name in enumerate(columns):
+        if name is not None:
+            positions.setdefault(name, index)
+
+    def records(line):
+        for row in rows:
+            line += 1
+            if not any(cell.strip() for cell in row):
+                continue
+            yield line, {name: row[index].strip() if index < len(row) else '' for name, index in positions.items()}
+
+    return records(line)
+
+
+class RosterImport:
+    """Imports roster records into the ``students`` table in batched transactions.
+
+    ``engine`` is the engine to write with. ``on_insert(connection, rows)``,
+    if given, runs inside each transaction with the inserted values. With
+    ``upsert``, students already registered are updated from the file instead
+    of being reported.
+    """
+
+    def __init__(self, engine, students, departments, upsert=False, batch_rows=BATCH_ROWS, on_insert=None):
+        self.engine = engine
+        self.students = students
+        self.departments = departments
+        self.upsert = upsert
+        self.batch_rows = batch_rows
+        self.on_insert = on_insert
+        self._department_ids = None
+        self._seen = {}
+        self._rows = 0
+        self._inserted = 0
+        self._updated = 0
+        self._batches = 0
+        self._errors = []
+        self._seconds = 0.0
+
+    def _load_departments(self):
+        with self.engine.connect() as conn:
+            lookup = {}
+            for department_id, code in conn.execute(select(self.departments.c.id, self.departments.c.code)):
+                lookup[str(department_id)] = department_id
+                lookup[code.strip().upper()] = department_id
+        return lookup
+
+    def _reject(self, line, record, error):
+        self._errors.append({'row': line, 'student_id': record.get('student_id', ''), 'error': error})
+
+    def _validate(self, line, record):
+        """Column values for one record, or None after reporting why it can't be imported."""
+        for name in REQUIRED_COLUMNS:
+            if not record[name]:
+                self._reject(line, record, f'{name} is required')
+                return None
+        values = {}
+        for name, value in record.items():
+            if name == 'department':
+                if not value:
+                    values['department_id'] = None
+                    continue
+                department_id = self._department_ids.get(value.upper())
+                if department_id is None:
+                    self._reject(line, record, f'Unknown department {value}')
+                    return None
+                values['department_id'] = department_id
+                continue
+            length = self.students.c[name].type.length
+            if length and len(value) > length:
+                self._reject(line, record, f'{name} is longer than {length} characters')
+                return None
+            values[name] = value or None
+        first_line = self._seen.setdefault(values['student_id'], line)
+        if first_line != line:
+            self._reject(line, record, f'Duplicate of row {first_line}')
+            return None
+        return values
+
+    def _write(self, conn, batch):
+        """Write one batch on ``conn``; returns the inserted and updated counts and the rejected ``(line, values)``."""
+        ids = [values['student_id'] for _, values in batch]
+        existing = dict(conn.execute(select(self.students.c.student_id, self.students.c.id)
+                                     .where(self.students.c.student_id.in_(ids))).all())
+        new, updates, rejected = [], [], []
+        for line, values in batch:
+            row_id = existing.get(values['student_id'])
+            if row_id is None:
+                new.append(values)
+            elif self.upsert:
+                # SET parameters can't share the column names
+                updates.append(dict({f'_{name}': value for name, value in values.items()}, _id=row_id))
+            else:
+                rejected.append((line, values))
+        if new:
+            conn.execute(self.students.insert(), new)
+            if self.on_insert is not None:
+                self.on_insert(conn, new)
+        if updates:
+            columns = {key[1:]: bindparam(key) for key in updates[0] if key not in ('_id', '_student_id')}
+            conn.execute(self.students.update().where(self.students.c.id == bindparam('_id')).values(columns),
+                         updates)
+        return len(new), len(updates), rejected
+
+    def _flush(self, batch):
+        try:
+            with self.engine.begin() as conn:
+                inserted, updated, rejected = self._write(conn, batch)
+        except IntegrityError:
+            # Someone registered one of these students since the prefetch; find them one row at a time
+            inserted = updated = 0
+            rejected = []
+            for line, values in batch:
+                try:
+                    with self.engine.begin() as conn:
+                        row_inserted, row_updated, row_rejected = self._write(conn, [(line, values)])
+                except IntegrityError:
+                    row_inserted, row_updated, row_rejected = 0, 0, [(line, values)]
+                inserted += row_inserted
+                updated += row_updated
+                rejected.extend(row_rejected)
+        self._inserted += inserted
+        self._updated += updated
+        self._batches += 1
+        for line, values in rejected:
+            self._reject(line, values, 'Student ID already exists')
+
+    def run(self, records):
+        """Import ``(line, record)`` pairs from parse_roster, yielding progress() after every batch."""
+        started = time.perf_counter()
+        if self._department_ids is None:
+            self._department_ids = self._load_departments()
+        batch = []
+        for line, record in records:
+            self._rows += 1
+            values = self._validate(line, record)
+            if values is not None:
+                batch.append((line, values))
+            if len(batch) >= self.batch_rows:
+                self._flush(batch)
+                batch = []
+                self._seconds += time.perf_counter() - started
+                yield self.progress()
+                started = time.perf_counter()
+        if batch:
+            self._flush(batch)
+        self._seconds += time.perf_counter() - started
+        yield self.progress()
+
+    def progress(self):
+        return {
+            'rows': self._rows,
+            'inserted': self._inserted,
+            'updated': self._updated,
+            'failed': len(self._errors),
+        }
+
+    def report(self):
+        """progress() plus timings and every rejected row."""
+        return dict(
+            self.progress(),
+            batches=self._batches,
+            seconds=round(self._seconds, 3),
+            rows_per_second=round(self._rows / self._seconds, 1) if self._seconds else None,
+            errors=self._errors,
+        )
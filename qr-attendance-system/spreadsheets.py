@@ -0,0 +1,269 @@
+"""Streaming CSV and XLSX writers and readers.
+
+Both writers take a header and an iterable of row tuples and yield bytes
+chunks, so a Flask response can stream an export of any size with flat
+memory. The XLSX writer emits a minimal single-sheet workbook through
+zipfile's support for unseekable output, so no spreadsheet library is
+needed.
+
+The readers go the other way for imports: they take a binary file object
+and yield each row as a list of cell texts, parsing incrementally so a
+large upload is never held in memory as rows.
+"""
+import csv
+import io
+import posixpath
+import re
+import zipfile
+import zlib
+from datetime import date, datetime
+from xml.etree.ElementTree import iterparse
+from xml.sax.saxutils import escape
+
+CHUNK_ROWS = 500
+
+# Control characters other than tab/newline/CR are not allowed in XML 1.0
+_XML_INVALID = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def _cell_text(value):
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def iter_csv(header, rows, chunk_rows=CHUNK_ROWS):
+    """Yield UTF-8 CSV (with a BOM so Excel detects the encoding) in chunks of rows."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('﻿')
+    writer.writerow(header)
+    for i, row in enumerate(rows, 1):
+        writer.writerow(['' if v is None else _cell_text(v) for v in row])
+        if i % chunk_rows == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def gzip_chunks(chunks, level=6):
+    """Gzip a stream of byte chunks on the fly."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class _Sink(io.RawIOBase):
+    """Unseekable file object that buffers whatever zipfile writes until drained."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '</Types>'
+)
+_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{name}" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '<Relationship Id="rId2" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+    'Target="styles.xml"/>'
+    '</Relationships>'
+)
+_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="1"><fill><patternFill patternType="none"/></fill></fills>'
+    '<borders count="1"><border/></borders>'
+    '<cellStyleXfs count="1"><xf/></cellStyleXfs>'
+    '<cellXfs count="2"><xf fontId="0"/><xf fontId="1" applyFont="1"/></cellXfs>'
+    '</styleSheet>'
+)
+
+
+def _xlsx_cell(value, style=''):
+    if value is None:
+        return '<c/>'
+    if isinstance(value, bool):
+        return f'<c t="b"{style}><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)):
+        return f'<c{style}><v>{value!r}</v></c>'
+    text = escape(_XML_INVALID.sub('', str(_cell_text(value))))
+    return f'<c t="inlineStr"{style}><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def iter_xlsx(header, rows, sheet_name='Sheet1', chunk_rows=CHUNK_ROWS):
+    """Yield a one-sheet .xlsx workbook with a bold header row."""
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as workbook:
+        workbook.writestr('[Content_Types].xml', _CONTENT_TYPES)
+        workbook.writestr('_rels/.rels', _ROOT_RELS)
+        workbook.writestr('xl/workbook.xml', _WORKBOOK.format(name=escape(sheet_name[:31])))
+        workbook.writestr('xl/_rels/workbook.xml.rels', _WORKBOOK_RELS)
+        workbook.writestr('xl/styles.xml', _STYLES)
+        yield sink.drain()
+
+        with workbook.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            sheet.write(('<row>' + ''.join(_xlsx_cell(h, ' s="1"') for h in header) + '</row>').encode('utf-8'))
+            parts = []
+            for i, row in enumerate(rows, 1):
+                parts.append('<row>' + ''.join(_xlsx_cell(v) for v in row) + '</row>')
+                if i % chunk_rows == 0:
+                    sheet.write(''.join(parts).encode('utf-8'))
+                    parts = []
+                    data = sink.drain()
+                    if data:
+                        yield data
+            sheet.write(''.join(parts).encode('utf-8'))
+            sheet.write(b'</sheetData></worksheet>')
+    yield sink.drain()
+
+
+def read_csv(stream):
+    """Yield the rows of a UTF-8 CSV file object (an Excel BOM is skipped) as lists of strings."""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    try:
+        yield from csv.reader(text)
+    finally:
+        # Leave the underlying stream open for the caller
+        text.detach()
+
+
+_MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_DOC_REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+_PKG_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+_CELL_REF = re.compile(r'([A-Z]+)')
+
+
+def _first_sheet(workbook):
+    """Path inside the archive of the workbook's first worksheet."""
+    with workbook.open('xl/workbook.xml') as f:
+        for _, elem in iterparse(f):
+            if elem.tag == _MAIN_NS + 'sheet':
+                rel_id = elem.get(_DOC_REL_NS + 'id')
+                break
+        else:
+            raise ValueError('The workbook has no sheets')
+    with workbook.open('xl/_rels/workbook.xml.rels') as f:
+        for _, elem in iterparse(f):
+            if elem.tag == _PKG_REL_NS + 'Relationship' and elem.get('Id') == rel_id:
+                target = elem.get('Target')
+                return target.lstrip('/') if target.startswith('/') else posixpath.normpath('xl/' + target)
+    raise ValueError('The workbook does not reference its first sheet')
+
+
+def _shared_strings(workbook):
+    if 'xl/sharedStrings.xml' not in workbook.namelist():
+        return []
+    strings = []
+    with workbook.open('xl/sharedStrings.xml') as f:
+        for _, elem in iterparse(f):
+            if elem.tag == _MAIN_NS + 'si':
+                # Rich text splits one string over several runs
+                strings.append(''.join(t.text or '' for t in elem.iter(_MAIN_NS + 't')))
+                elem.clear()
+    return strings
+
+
+def _column_index(ref):
+    index = 0
+    for letter in _CELL_REF.match(ref).group(1):
+        index = index * 26 + ord(letter) - 64
+    return index - 1
+
+
+def _xlsx_value(cell, strings):
+    kind = cell.get('t')
+    if kind == 'inlineStr':
+        return ''.join(t.text or '' for t in cell.iter(_MAIN_NS + 't'))
+    value = cell.find(_MAIN_NS + 'v')
+    if value is None or value.text is None:
+        return ''
+    if kind == 's':
+        return strings[int(value.text)]
+    if kind == 'b':
+        return 'TRUE' if value.text == '1' else 'FALSE'
+    if kind is None or kind == 'n':
+        # Whole numbers (typed IDs, phone numbers) come back without Excel's ".0"
+        try:
+            number = float(value.text)
+        except ValueError:
+            return value.text
+        return str(int(number)) if number.is_integer() else value.text
+    return value.text
+
+
+def read_xlsx(stream):
+    """Yield the rows of an .xlsx file object's first sheet as lists of strings.
+
+    The file object must be seekable. Empty cells are returned as ''; cells
+    are positioned by their reference, so gaps are kept.
+    """
+    with zipfile.ZipFile(stream) as workbook:
+        sheet = _first_sheet(workbook)
+        strings = _shared_strings(workbook)
+        with workbook.open(sheet) as f:
+            for _, elem in iterparse(f):
+                if elem.tag != _MAIN_NS + 'row':
+                    continue
+                row = []
+                for cell in elem.iter(_MAIN_NS + 'c'):
+                    ref = cell.get('r')
+                    if ref:
+                        row.extend([''] * (_column_index(ref) - len(row)))
+                    row.append(_xlsx_value(cell, strings))
+                elem.clear()
+                yield row
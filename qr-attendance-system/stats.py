@@ -0,0 +1,172 @@
+"""Materialized counters for the admin dashboard.
+
+Each counter is a row in a small summary table that is bumped inside the
+same transaction as the insert, delete or update that changes it, via
+SQLAlchemy mapper events. Because the rows live in the database every
+gunicorn worker sees the same numbers. A TTL-based reconciliation
+recomputes the real COUNT(*)s to repair drift from bulk statements or
+raw SQL, which bypass the mapper events.
+"""
+from datetime import datetime
+
+from sqlalchemy import event, inspect
+
+
+def _noop(*args):
+    pass
+
+
+def track_history(attribute):
+    """Load the previous value of ``attribute`` when it is assigned while expired.
+
+    Otherwise the update history has nothing to compare against in
+    after_update, and value_before() returns the new value.
+    """
+    if not event.contains(attribute, 'set', _noop):
+        event.listen(attribute, 'set', _noop, active_history=True)
+
+
+def value_before(target, attr):
+    """Value of ``attr`` of ``target`` before the pending UPDATE."""
+    history = inspect(target).attrs[attr].history
+    return history.deleted[0] if history.deleted else getattr(target, attr)
+
+
+class _Counter:
+    def __init__(self, name, model, count_query, attr=None, value=None):
+        self.name = name
+        self.model = model
+        self.count_query = count_query
+        self.attr = attr
+        self.value = value
+
+    def matches(self, target):
+        return self.attr is None or getattr(target, self.attr) == self.value
+
+    def matched_before(self, target):
+        return value_before(target, self.attr) == self.value
+
+
+class StatCounters:
+    """Registry of dashboard counters backed by ``summary_model``.
+
+    ``summary_model`` needs ``name`` (primary key), ``value``,
+    ``reconciled_at`` and ``drift`` columns. Counters with ``attr``/``value``
+    only count rows where that column equals the value and follow updates
+    of the column as well as inserts and deletes.
+    """
+
+    def __init__(self, db, summary_model, ttl=300):
+        self.db = db
+        self.summary_model = summary_model
+        self.ttl = ttl
+        self._counters = {}
+        self._listening = set()
+
+    def register(self, name, model, count_query, attr=None, value=None):
+        """Track ``name``; ``count_query()`` returns the true count for reconciliation."""
+        self._counters[name] = _Counter(name, model, count_query, attr, value)
+        if attr is not None:
+            track_history(getattr(model, attr))
+        if model not in self._listening:
+            event.listen(model, 'after_insert', self._after_insert)
+            event.listen(model, 'after_delete', self._after_delete)
+            event.listen(model, 'after_update', self._after_update)
+            self._listening.add(model)
+
+    def _counters_for(self, target):
+        return [c for c in self._counters.values() if isinstance(target, c.model)]
+
+    def _bump(self, connection, name, delta):
+        table = self.summary_model.__table__
+        connection.execute(
+            table.update()
+            .where(table.c.name == name)
+            .values(value=table.c.value + delta)
+        )
+
+    def _after_insert(self, mapper, connection, target):
+        for counter in self._counters_for(target):
+            if counter.matches(target):
+                self._bump(connection, counter.name, 1)
+
+    def _after_delete(self, mapper, connection, target):
+        for counter in self._counters_for(target):
+            if counter.matches(target):
+                self._bump(connection, counter.name, -1)
+
+    def _after_update(self, mapper, connection, target):
+        for counter in self._counters_for(target):
+            if counter.attr is None:
+                continue
+            delta = int(counter.matches(target)) - int(counter.matched_before(target))
+            if delta:
+                self._bump(connection, counter.name, delta)
+
+    def record_inserts(self, connection, model, rows):
+        """Count ``rows`` (dicts of column values) of ``model`` inserted with Core statements on ``connection``."""
+        for counter in self._counters.values():
+            if counter.model is not model:
+                continue
+            delta = sum(1 for row in rows if counter.attr is None or row.get(counter.attr) == counter.value)
+            if delta:
+                self._bump(connection, counter.name, delta)
+
+    def reconcile(self):
+        """Replace every counter with its real count and record how far it had drifted."""
+        now = datetime.utcnow()
+        session = self.db.session
+        existing = {row.name: row for row in self.summary_model.query.all()}
+        for name, counter in self._counters.items():
+            actual = counter.count_query()
+            row = existing.get(name)
+            if row is None:
+                session.add(self.summary_model(name=name, value=actual, reconciled_at=now, drift=0))
+            else:
+                row.drift = row.value - actual
+                row.value = actual
+                row.reconciled_at = now
+        session.commit()
+
+    def mark_stale(self):
+        """Force reconciliation on the next read, e.g. after a bulk UPDATE."""
+        table = self.summary_model.__table__
+        self.db.session.execute(table.update().values(reconciled_at=None))
+        self.db.session.commit()
+
+    def _rows(self):
+        rows = {row.name: row for row in self.summary_model.query.all()}
+        oldest = None
+        for name in self._counters:
+            row = rows.get(name)
+            if row is None or row.reconciled_at is None:
+                return None
+            if oldest is None or row.reconciled_at < oldest:
+                oldest = row.reconciled_at
+        if (datetime.utcnow() - oldest).total_seconds() > self.ttl:
+            return None
+        return rows
+
+    def values(self):
+        """Current counters as ``{name: value}``, reconciling first if older than the TTL."""
+        rows = self._rows()
+        if rows is None:
+            self.reconcile()
+            rows = {row.name: row for row in self.summary_model.query.all()}
+        return {name: rows[name].value for name in self._counters}
+
+    def staleness(self):
+        """Per-counter value, last reconciliation time, age and drift found at that time."""
+        now = datetime.utcnow()
+        rows = {row.name: row for row in self.summary_model.query.all()}
+        report = {}
+        for name in self._counters:
+            row = rows.get(name)
+            reconciled_at = row.reconciled_at if row is not None else None
+            report[name] = {
+                'value': row.value if row is not None else None,
+                'reconciled_at': reconciled_at.isoformat() if reconciled_at else None,
+                'age_seconds': round((now - reconciled_at).total_seconds(), 1) if reconciled_at else None,
+                'drift_at_last_reconcile': row.drift if row is not None else None,
+            }
+        return {'ttl_seconds': self.ttl, 'counters': report}
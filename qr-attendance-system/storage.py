@@ -0,0 +1,264 @@
+"""Content-addressed photo storage with pluggable backends.
+
+Photos are stored under the SHA-256 of their bytes, fanned out over two
+directory levels (``ab/cd/abcd....jpg``), so identical uploads are stored
+once and no directory grows past a few hundred entries. Resized
+derivatives live under ``derived/<size>/<key>``. A key never changes
+content, which is what lets photo responses be cached as immutable.
+
+Backends only map keys to bytes:
+
+* LocalBackend writes files below a root directory, atomically.
+* ObjectStoreBackend talks to an S3-compatible bucket through the small
+  subset of the boto3 client API listed on the class. LocalObjectClient
+  implements that subset over a directory, so the object-store code path
+  can be exercised without boto3 or a network.
+
+Writes take bytes or a binary file object, which is copied in chunks;
+PhotoStore.put hashes a file object the same way, so a spooled upload is
+stored without ever being read into memory whole.
+"""
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+
+_CONTENT_KEY = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.[a-z0-9]+$')
+# Read size when hashing or copying a file object
+CHUNK_BYTES = 64 * 1024
+
+
+def _write(f, data):
+    if isinstance(data, bytes):
+        f.write(data)
+    else:
+        shutil.copyfileobj(data, f, CHUNK_BYTES)
+
+
+def _safe_key(key):
+    parts = key.split('/')
+    if not key or key.startswith('/') or '\\' in key or any(p in ('', '.', '..') for p in parts):
+        raise ValueError(f'Invalid storage key: {key!r}')
+    return key
+
+
+class LocalBackend:
+    """Stores each key as a file below ``root``; writes go to a temporary file and are renamed into place."""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, key):
+        """Filesystem path of ``key``, for serving it with send_file."""
+        return os.path.join(self.root, *_safe_key(key).split('/'))
+
+    def put(self, key, data):
+        path = self.path(key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                _write(f, data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def get(self, key):
+        try:
+            with open(self.path(key), 'rb') as f:
+                return f.read()
+        except (FileNotFoundError, IsADirectoryError):
+            raise KeyError(key)
+
+    def exists(self, key):
+        return os.path.isfile(self.path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+
+def _is_missing(error):
+    # botocore's ClientError carries the S3 error code in .response
+    code = getattr(error, 'response', {}).get('Error', {}).get('Code')
+    return code in ('404', 'NoSuchKey', 'NotFound')
+
+
+class ObjectStoreBackend:
+    """Stores keys as objects in an S3-compatible bucket.
+
+    ``client`` needs put_object, get_object, head_object and delete_object
+    with boto3's signatures. PUTs are atomic on the store's side.
+    """
+
+    def __init__(self, client, bucket, prefix=''):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+
+    def path(self, key):
+        return None
+
+    def _object(self, key):
+        return self.prefix + _safe_key(key)
+
+    def put(self, key, data):
+        self.client.put_object(Bucket=self.bucket, Key=self._object(key), Body=data)
+
+    def get(self, key):
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self._object(key))['Body'].read()
+        except Exception as e:
+            if _is_missing(e):
+                raise KeyError(key)
+            raise
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._object(key))
+            return True
+        except Exception as e:
+            if _is_missing(e):
+                return False
+            raise
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._object(key))
+
+
+class ObjectNotFound(Exception):
+    """Raised by LocalObjectClient the way botocore raises a 404 ClientError."""
+
+    def __init__(self, key):
+        super().__init__(f'No such key: {key}')
+        self.response = {'Error': {'Code': 'NoSuchKey'}}
+
+
+class _Body:
+    def __init__(self, data):
+        self._data = data
+
+    def read(self):
+        return self._data
+
+
+class LocalObjectClient:
+    """Stand-in for a boto3 S3 client, keeping each bucket in a directory under ``root``."""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def _path(self, bucket, key):
+        # Object keys are flat names, so slashes are stored escaped
+        return os.path.join(self.root, bucket, key.replace('%', '%25').replace('/', '%2F'))
+
+    def put_object(self, Bucket, Key, Body):
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as f:
+            _write(f, Body)
+        os.replace(tmp_path, path)
+        return {}
+
+    def get_object(self, Bucket, Key):
+        try:
+            with open(self._path(Bucket, Key), 'rb') as f:
+                return {'Body': _Body(f.read())}
+        except FileNotFoundError:
+            raise ObjectNotFound(Key)
+
+    def head_object(self, Bucket, Key):
+        try:
+            return {'ContentLength': os.path.getsize(self._path(Bucket, Key))}
+        except FileNotFoundError:
+            raise ObjectNotFound(Key)
+
+    def delete_object(self, Bucket, Key):
+        try:
+            os.remove(self._path(Bucket, Key))
+        except FileNotFoundError:
+            pass
+        return {}
+
+
+def create_backend(kind, root, bucket=None, prefix='', endpoint_url=None):
+    """Build the backend named by PHOTO_STORAGE."""
+    if kind == 'local':
+        return LocalBackend(root)
+    if kind == 's3-local':
+        return ObjectStoreBackend(LocalObjectClient(root), bucket or 'photos', prefix)
+    if kind == 's3':
+        if not bucket:
+            raise ValueError('PHOTO_S3_BUCKET is required for the s3 photo storage backend')
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError('The s3 photo storage backend requires boto3 (pip install boto3)')
+        return ObjectStoreBackend(boto3.client('s3', endpoint_url=endpoint_url), bucket, prefix)
+    raise ValueError(f'Unknown photo storage backend: {kind}')
+
+
+class PhotoStore:
+    """Content-addressed photos and their derivatives on top of a backend."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    @staticmethod
+    def content_key(data, ext):
+        """Key of ``data``, bytes or a seekable binary file that is hashed from its current position."""
+        if isinstance(data, bytes):
+            digest = hashlib.sha256(data).hexdigest()
+        else:
+            start = data.tell()
+            hasher = hashlib.sha256()
+            for chunk in iter(lambda: data.read(CHUNK_BYTES), b''):
+                hasher.update(chunk)
+            data.seek(start)
+            digest = hasher.hexdigest()
+        return f'{digest[:2]}/{digest[2:4]}/{digest}.{ext}'
+
+    @staticmethod
+    def is_content_key(key):
+        """True for keys named by their content; those never change and can be cached forever."""
+        return bool(_CONTENT_KEY.match(key))
+
+    @staticmethod
+    def derivative_key(key, size):
+        return f'derived/{size}/{key}'
+
+    def put(self, data, ext):
+        """Store ``data`` (bytes or a seekable binary file); returns ``(key, created)``, where created is False for a duplicate."""
+        key = self.content_key(data, ext)
+        if self.backend.exists(key):
+            return key, False
+        self.backend.put(key, data)
+        return key, True
+
+    def put_derivative(self, key, size, data):
+        self.backend.put(self.derivative_key(key, size), data)
+
+    def get(self, key):
+        """Bytes stored under ``key``; raises KeyError if there are none."""
+        return self.backend.get(key)
+
+    def exists(self, key):
+        return self.backend.exists(key)
+
+    def path(self, key):
+        """Local file path of ``key``, or None when the backend is not a filesystem."""
+        return self.backend.path(key)
+
+    def delete(self, key, sizes=()):
+        """Remove ``key`` and its derivatives in ``sizes``."""
+        for size in sizes:
+            self.backend.delete(self.derivative_key(key, size))
+        self.backend.delete(key)
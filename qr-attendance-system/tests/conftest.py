@@ -0,0 +1,48 @@
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+# main reads its configuration at import time, so point it at a scratch database first
+_tmp = tempfile.mkdtemp(prefix='attendance-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_tmp, 'test.db')}"
+os.environ['UPLOAD_FOLDER'] = os.path.join(_tmp, 'uploads')
+os.environ['PHOTO_PIPELINE_MODE'] = 'sync'
+
+
+@pytest.fixture(scope='session')
+def main():
+    import main
+
+    main.app.config['TESTING'] = True
+    main.init_db()
+    return main
+
+
+@pytest.fixture
+def admin_client(main):
+    client = main.app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+    return client
+
+
+@pytest.fixture
+def make_course(main):
+    """Factory adding a course taking attendance now (unless ``start`` says otherwise); returns its id."""
+    def make(start=None, department_id=1, course_code='T100', latitude=5.0, longitude=-0.2, **fields):
+        start = start or datetime.now() - timedelta(minutes=5)
+        with main.app.app_context():
+            admin = main.User.query.filter_by(username='admin').first()
+            course = main.Course(course_name=fields.pop('course_name', 'Testing'), course_code=course_code,
+                                 class_location='Hall', start_time=start, end_time=start + timedelta(hours=1),
+                                 instructor_id=admin.id, department_id=department_id, latitude=latitude,
+                                 longitude=longitude, max_distance=100.0, year=100, session='regular', **fields)
+            main.db.session.add(course)
+            main.db.session.commit()
+            return course.id
+    return make
@@ -0,0 +1,66 @@
+"""Per-stage admission counters of mark_attendance."""
+import io
+
+import pytest
+from PIL import Image
+
+from admission import AdmissionStats
+
+
+def counts(stats):
+    return {row['stage']: (row['passed'], row['rejected']) for row in stats.stats()['stages']}
+
+
+def delta(before, after):
+    return {stage: (after[stage][0] - before[stage][0], after[stage][1] - before[stage][1]) for stage in after}
+
+
+def test_a_request_passes_each_stage_until_it_is_rejected():
+    stats = AdmissionStats(stages=('a', 'b', 'c'))
+    admission = stats.start()
+    admission.stage('a')
+    admission.stage('b')
+    admission.reject()
+    admission = stats.start()
+    for stage in ('a', 'b', 'c'):
+        admission.stage(stage)
+    admission.accept()
+
+    assert counts(stats) == {'a': (2, 0), 'b': (1, 1), 'c': (1, 0)}
+    assert stats.stats()['accepted'] == 1
+
+
+def test_unknown_stages_are_refused():
+    with pytest.raises(ValueError):
+        AdmissionStats(stages=('a',)).start().stage('b')
+
+
+def submit(main, course_id, student_id, latitude):
+    photo = io.BytesIO()
+    Image.new('RGB', (400, 300)).save(photo, 'JPEG')
+    photo.seek(0)
+    return main.app.test_client().post(
+        f'/mark_attendance/{course_id}', content_type='multipart/form-data',
+        data={'student_id': student_id, 'student_name': 'Esi Owusu', 'latitude': str(latitude),
+              'longitude': '-0.2', 'photo': (photo, 'photo.jpg')})
+
+
+def test_mark_attendance_counts_where_submissions_stop(main, make_course):
+    course_id = make_course()
+    stats = main.admission_stats
+
+    before = counts(stats)
+    assert submit(main, course_id, 'A-FAR', latitude=5.5).status_code == 400
+    rejected = delta(before, counts(stats))
+    assert rejected['geofence'] == (0, 1)
+    assert all(rejected[stage] == (1, 0) for stage in ('replay', 'content_length', 'qr_token', 'course_window', 'fields'))
+    assert all(rejected[stage] == (0, 0) for stage in ('duplicate', 'photo_header', 'persist'))
+
+    before, accepted = counts(stats), stats.stats()['accepted']
+    assert submit(main, course_id, 'A-NEAR', latitude=5.0).status_code == 200
+    assert all(change == (1, 0) for change in delta(before, counts(stats)).values())
+    assert stats.stats()['accepted'] == accepted + 1
+
+    before = counts(stats)
+    assert submit(main, course_id, 'A-NEAR', latitude=5.0).status_code == 400
+    assert delta(before, counts(stats))['duplicate'] == (0, 1)
@@ -0,0 +1,45 @@
+"""Attendance rates count students only against the courses they take."""
+from datetime import date, datetime, timedelta
+
+
+def test_students_are_rated_on_the_courses_they_take(main):
+    with main.app.app_context():
+        admin = main.User.query.filter_by(username='admin').first()
+        department = main.Department(name='Rates', code='RTS')
+        main.db.session.add(department)
+        main.db.session.flush()
+        for student_id in ('R1', 'R2', 'R3'):
+            main.db.session.add(main.Student(student_id=student_id, full_name=student_id,
+                                             department_id=department.id))
+        first = datetime.now() - timedelta(days=10)
+        sessions = {}
+        # Two courses of different years in one department, four sessions each
+        for code in ('RT100', 'RT400'):
+            for week in range(4):
+                start = first + timedelta(days=week, hours=int(code[2]))
+                course = main.Course(course_name=code, course_code=code, class_location='Hall', start_time=start,
+                                     end_time=start + timedelta(hours=1), instructor_id=admin.id,
+                                     department_id=department.id, max_distance=100.0, year=int(code[2:]),
+                                     session='regular')
+                main.db.session.add(course)
+                sessions.setdefault(code, []).append(course)
+        main.db.session.flush()
+        # R1 attends every RT100 session, R2 half of the RT400 ones, R3 nothing
+        checkins = [('R1', course) for course in sessions['RT100']] + [('R2', course) for course in sessions['RT400'][:2]]
+        for student_id, course in checkins:
+            main.db.session.add(main.Attendance(student_id=student_id, student_name=student_id, course_id=course.id,
+                                                timestamp=course.start_time + timedelta(minutes=5),
+                                                photo_path='seed.jpg', latitude=0.0, longitude=0.0))
+        main.db.session.commit()
+        department_id = department.id
+
+    start, end = date.today() - timedelta(days=30), date.today()
+    analytics = main.attendance_analytics
+    rates = {row['student_id']: row for row in analytics.students(start, end, department_id)}
+    assert set(rates) == {'R1', 'R2'}
+    assert (rates['R1']['sessions'], rates['R1']['rate']) == (4, 100.0)
+    assert (rates['R2']['sessions'], rates['R2']['rate']) == (4, 50.0)
+    assert [row['student_id'] for row in analytics.students(start, end, department_id, below=75)] == ['R2']
+
+    row = next(d for d in analytics.departments(start, end) if d['department_id'] == department_id)
+    assert (row['students'], row['no_checkins'], row['expected'], row['rate']) == (3, 1, 8, 75.0)
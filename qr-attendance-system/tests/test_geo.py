@@ -0,0 +1,54 @@
+"""Finding the class a GPS fix is in."""
+from datetime import datetime, timedelta
+
+from course_cache import CourseSnapshot
+from geo import CourseLocator, haversine_distance
+
+
+def snapshot(course_id, start, latitude=5.0, longitude=-0.2):
+    return CourseSnapshot(course_id, 1, 'G100', 1, latitude, longitude, 100.0, start, start + timedelta(hours=1))
+
+
+def locator_for(*snapshots):
+    def loader(since, until):
+        return [s for s in snapshots if since <= s.start_time < until]
+    return CourseLocator(loader)
+
+
+def test_haversine_distance():
+    # A thousandth of a degree of latitude is about 111 m anywhere
+    assert abs(haversine_distance(5.0, -0.2, 5.001, -0.2) - 111.2) < 0.5
+    assert haversine_distance(5.0, -0.2, 5.0, -0.2) == 0
+
+
+def test_finds_the_nearest_active_course_containing_the_fix():
+    now = datetime(2026, 3, 2, 9, 10)
+    near, far = snapshot(1, datetime(2026, 3, 2, 9, 0)), snapshot(2, datetime(2026, 3, 2, 9, 0), latitude=5.0005)
+    matches = locator_for(near, far).locate(5.0, -0.2, now=now)
+    assert [s.id for _, s in matches] == [1, 2]
+    assert locator_for(near).locate(5.01, -0.2, now=now) == []
+
+
+def test_ignores_courses_outside_their_attendance_window():
+    course = snapshot(1, datetime(2026, 3, 2, 9, 0))
+    assert locator_for(course).locate(5.0, -0.2, now=datetime(2026, 3, 2, 8, 55)) == []
+    assert locator_for(course).locate(5.0, -0.2, now=datetime(2026, 3, 2, 9, 45)) == []
+
+
+def test_a_session_starting_before_midnight_is_found_after_it():
+    late = snapshot(1, datetime(2026, 3, 2, 23, 40))
+    locator = locator_for(late)
+    assert [s.id for _, s in locator.locate(5.0, -0.2, now=datetime(2026, 3, 2, 23, 50))] == [1]
+    # The day rolled over and the index reloaded; the session's window is still open
+    assert [s.id for _, s in locator.locate(5.0, -0.2, now=datetime(2026, 3, 3, 0, 5))] == [1]
+
+
+def test_updates_move_courses_in_the_index():
+    now = datetime(2026, 3, 2, 9, 10)
+    locator = locator_for(snapshot(1, datetime(2026, 3, 2, 9, 0)))
+    assert locator.locate(5.0, -0.2, now=now)
+    locator.update(snapshot(1, datetime(2026, 3, 2, 9, 0), latitude=6.0))
+    assert locator.locate(5.0, -0.2, now=now) == []
+    assert locator.locate(6.0, -0.2, now=now)
+    locator.remove(1)
+    assert locator.locate(6.0, -0.2, now=now) == []
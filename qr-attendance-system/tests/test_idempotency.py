@@ -0,0 +1,106 @@
+"""Parallel duplicate attendance submissions create exactly one record."""
+import io
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+
+import pytest
+from PIL import Image
+
+PARALLEL = 12
+LATITUDE, LONGITUDE = 5.0, -0.2
+
+
+def open_course(main):
+    """A course taking attendance now, returning its id."""
+    with main.app.app_context():
+        admin = main.User.query.filter_by(username='admin').first()
+        course = main.Course(course_name='Stress', course_code='ST1', class_location='Hall',
+                             start_time=datetime.now() - timedelta(minutes=5),
+                             end_time=datetime.now() + timedelta(hours=1), instructor_id=admin.id,
+                             department_id=1, latitude=LATITUDE, longitude=LONGITUDE, max_distance=100.0,
+                             year=100, session='regular')
+        main.db.session.add(course)
+        main.db.session.commit()
+        return course.id
+
+
+def photo():
+    buffer = io.BytesIO()
+    Image.new('RGB', (600, 400), (40, 120, 200)).save(buffer, 'JPEG')
+    buffer.seek(0)
+    return buffer
+
+
+def submit(main, course_id, student_id, key=None):
+    headers = {'Idempotency-Key': key} if key else {}
+    response = main.app.test_client().post(
+        f'/mark_attendance/{course_id}', headers=headers, content_type='multipart/form-data',
+        data={'student_id': student_id, 'student_name': 'Ama Mensah', 'latitude': str(LATITUDE),
+              'longitude': str(LONGITUDE), 'photo': (photo(), 'photo.jpg')})
+    return response.status_code, response.get_json()
+
+
+def burst(main, course_id, student_id, key=None):
+    """Fire PARALLEL identical submissions at once; returns their (status, json) results."""
+    barrier = threading.Barrier(PARALLEL)
+    results = []
+
+    def run():
+        barrier.wait()
+        results.append(submit(main, course_id, student_id, key))
+
+    threads = [threading.Thread(target=run) for _ in range(PARALLEL)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def records(main, course_id, student_id):
+    with main.app.app_context():
+        return main.Attendance.query.filter_by(course_id=course_id, student_id=student_id).count()
+
+
+@pytest.fixture(params=['one_worker', 'many_workers'])
+def workers(request, main, monkeypatch):
+    if request.param == 'many_workers':
+        # Each submission as if on its own gunicorn worker: only the unique indexes stop duplicates
+        monkeypatch.setattr(main, '_claim_submission', lambda submission: True)
+        monkeypatch.setattr(main, '_release_submission', lambda submission: None)
+    return request.param
+
+
+def test_parallel_submissions_with_a_key_create_one_record_and_replay(main, workers):
+    course_id = open_course(main)
+    key = f'stress-{workers}'
+    results = burst(main, course_id, 'S-KEYED', key)
+
+    assert records(main, course_id, 'S-KEYED') == 1
+    accepted = [body for status, body in results if status == 200]
+    assert len([body for body in accepted if not body.get('replayed')]) == 1
+    # The rest were answered from the stored record, or turned away while the first was in flight
+    assert all(status == 409 for status, body in results if status != 200)
+
+    status, body = submit(main, course_id, 'S-KEYED', key)
+    assert status == 200 and body['replayed'] is True
+    assert records(main, course_id, 'S-KEYED') == 1
+
+
+def test_parallel_submissions_without_a_key_create_one_record(main, workers):
+    course_id = open_course(main)
+    results = burst(main, course_id, 'S-PLAIN')
+
+    assert records(main, course_id, 'S-PLAIN') == 1
+    statuses = Counter(status for status, _ in results)
+    assert statuses[200] == 1
+    assert set(statuses) <= {200, 400, 409}
+    assert not any(body.get('replayed') for _, body in results)
+
+
+def test_overlong_keys_are_rejected(main):
+    course_id = open_course(main)
+    status, body = submit(main, course_id, 'S-LONG', 'k' * 65)
+    assert status == 400 and not body['success']
+    assert records(main, course_id, 'S-LONG') == 0
@@ -0,0 +1,20 @@
+"""Per-request SQL accounting in metrics.py."""
+import pytest
+from flask import Flask
+
+import metrics
+
+
+def test_sql_accounting_stops_when_a_handler_raises():
+    app = Flask(__name__)
+    app.testing = True
+    metrics.init_app(app)
+
+    @app.route('/boom')
+    def boom():
+        raise RuntimeError('boom')
+
+    # The error propagates, so no after_request handler runs
+    with pytest.raises(RuntimeError):
+        app.test_client().get('/boom')
+    assert not metrics._request_db.active
@@ -0,0 +1,69 @@
+"""Keyset pagination and filters of the admin attendance list."""
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def checkins(main, make_course):
+    """A past course with seven check-ins a minute apart; returns its id and their ids, newest first."""
+    start = datetime(2026, 3, 2, 9, 0)
+    course_id = make_course(start=start)
+    ids = []
+    with main.app.app_context():
+        for i in range(7):
+            attendance = main.Attendance(student_id=f'P{i}', student_name='Kofi Boateng' if i == 3 else f'Student {i}',
+                                         course_id=course_id, timestamp=start + timedelta(minutes=i),
+                                         photo_path='seed.jpg', latitude=5.0, longitude=-0.2,
+                                         location_verified=i % 2 == 0)
+            main.db.session.add(attendance)
+            main.db.session.flush()
+            ids.append(attendance.id)
+        main.db.session.commit()
+    return course_id, ids[::-1]
+
+
+def page(client, **args):
+    response = client.get('/admin/api/attendance', query_string=args)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_pages_walk_every_row_once_in_order(admin_client, checkins):
+    course_id, expected = checkins
+    seen, cursors, cursor = [], [], None
+    while True:
+        body = page(admin_client, course_id=course_id, per_page=3, **({'after': cursor} if cursor else {}))
+        seen += [item['id'] for item in body['items']]
+        cursors.append(body)
+        cursor = body['next_cursor']
+        if cursor is None:
+            break
+    assert seen == expected
+    assert [len(body['items']) for body in cursors] == [3, 3, 1]
+    assert cursors[0]['prev_cursor'] is None
+
+
+def test_prev_cursor_returns_the_previous_page(admin_client, checkins):
+    course_id, expected = checkins
+    first = page(admin_client, course_id=course_id, per_page=3)
+    second = page(admin_client, course_id=course_id, per_page=3, after=first['next_cursor'])
+    back = page(admin_client, course_id=course_id, per_page=3, before=second['prev_cursor'])
+    assert [item['id'] for item in back['items']] == expected[:3]
+    assert back['prev_cursor'] is None
+
+
+def test_filters_narrow_the_rows(admin_client, checkins):
+    course_id, expected = checkins
+    verified = page(admin_client, course_id=course_id, verified='1')['items']
+    assert len(verified) == 4 and all(item['location_verified'] for item in verified)
+    assert [item['student_id'] for item in page(admin_client, course_id=course_id, student='boateng')['items']] == ['P3']
+    assert page(admin_client, course_id=course_id, date_from='2026-03-03')['items'] == []
+    assert len(page(admin_client, course_id=course_id, date_from='2026-03-02', date_to='2026-03-02')['items']) == 7
+
+
+@pytest.mark.parametrize('args', [{'after': 'not-a-cursor'}, {'date_from': '02/03/2026'}])
+def test_malformed_input_is_rejected(admin_client, checkins, args):
+    course_id, _ = checkins
+    response = admin_client.get('/admin/api/attendance', query_string={'course_id': course_id, **args})
+    assert response.status_code == 400
@@ -0,0 +1,64 @@
+"""Serving stored photos from the local and object-store backends."""
+import io
+
+import pytest
+from PIL import Image
+
+from storage import LocalObjectClient, ObjectStoreBackend, PhotoStore
+
+
+def jpeg(color):
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), color).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+@pytest.fixture(params=['local', 's3-local'])
+def store(request, main, monkeypatch, tmp_path):
+    if request.param == 's3-local':
+        monkeypatch.setattr(main, 'photo_store', PhotoStore(ObjectStoreBackend(LocalObjectClient(str(tmp_path)), 'photos')))
+    return main.photo_store
+
+
+def test_content_addressed_photos_are_cached_for_good(main, store):
+    data = jpeg((200, 10, 10))
+    key, _ = store.put(data, 'jpg')
+    client = main.app.test_client()
+
+    response = client.get(f'/uploads/{key}')
+    assert response.status_code == 200 and response.data == data
+    assert response.mimetype == 'image/jpeg'
+    assert response.cache_control.immutable and response.cache_control.private
+    assert not response.cache_control.public
+    assert response.cache_control.max_age == main.PHOTO_CACHE_SECONDS
+
+    etag = response.headers['ETag']
+    revalidated = client.get(f'/uploads/{key}', headers={'If-None-Match': etag})
+    assert revalidated.status_code == 304 and revalidated.headers['ETag'] == etag
+
+
+def test_local_photos_are_streamed_from_their_file(main):
+    data = jpeg((10, 200, 10))
+    key, _ = main.photo_store.put(data, 'jpg')
+    response = main.app.test_client().get(f'/uploads/{key}', headers={'Range': 'bytes=0-9'})
+    assert response.status_code == 206 and response.data == data[:10]
+
+
+def test_photos_under_other_names_are_revalidated(main, store):
+    data = jpeg((10, 10, 200))
+    store.backend.put('legacy_photo.jpg', data)
+    response = main.app.test_client().get('/uploads/legacy_photo.jpg')
+    assert response.status_code == 200 and response.data == data
+    assert response.cache_control.no_cache and not response.cache_control.immutable
+
+
+@pytest.mark.parametrize('key', ['00/00/' + '0' * 64 + '.jpg', '../secret.jpg'])
+def test_missing_or_unsafe_keys_are_not_found(main, store, key):
+    assert main.app.test_client().get(f'/uploads/{key}').status_code == 404
+
+
+def test_derivatives_are_made_on_first_request(main, store):
+    key, _ = store.put(jpeg((120, 120, 0)), 'jpg')
+    response = main.app.test_client().get(f'/photos/small/{key}')
+    assert response.status_code == 200 and response.cache_control.immutable
+    assert store.exists(store.derivative_key(key, 'small'))
@@ -0,0 +1,74 @@
+"""Signed, rotating course QR tokens."""
+import io
+
+import pytest
+from PIL import Image
+
+from qr_codes import QRSigner
+
+NOW = 1_800_000_000.0
+
+
+@pytest.fixture
+def signer():
+    return QRSigner('secret', interval=30, max_age=300)
+
+
+def test_a_fresh_token_verifies_for_its_course(signer):
+    signer.verify(signer.token(7, now=NOW), 7, now=NOW + 5)
+
+
+def test_a_token_for_one_course_is_rejected_for_another(signer):
+    with pytest.raises(ValueError, match='different course'):
+        signer.verify(signer.token(7, now=NOW), 8, now=NOW)
+
+
+def test_tokens_expire_after_max_age(signer):
+    token = signer.token(7, now=NOW)
+    signer.verify(token, 7, now=NOW + 290)
+    with pytest.raises(ValueError, match='expired'):
+        signer.verify(token, 7, now=NOW + 360)
+    # Nor can a token be minted ahead of time
+    with pytest.raises(ValueError, match='expired'):
+        signer.verify(signer.token(7, now=NOW + 60), 7, now=NOW)
+
+
+def test_tokens_rotate_every_interval(signer):
+    start = NOW - NOW % 30
+    assert signer.token(7, now=start) == signer.token(7, now=start + 29)
+    assert signer.token(7, now=start) != signer.token(7, now=start + 30)
+    assert signer.seconds_left(now=start + 10) == 20
+
+
+@pytest.mark.parametrize('token', ['', 'garbage', '7.123', '7.abc.sig'])
+def test_malformed_tokens_are_rejected(signer, token):
+    with pytest.raises(ValueError, match='Invalid'):
+        signer.verify(token, 7, now=NOW)
+
+
+def test_tampered_or_foreign_tokens_are_rejected(signer):
+    course, slot, signature = signer.token(7, now=NOW).split('.')
+    with pytest.raises(ValueError, match='Invalid'):
+        signer.verify(f'8.{slot}.{signature}', 8, now=NOW)
+    with pytest.raises(ValueError, match='Invalid'):
+        signer.verify(QRSigner('other secret').token(7, now=NOW), 7, now=NOW)
+
+
+def submit(main, course_id, token=None):
+    photo = io.BytesIO()
+    Image.new('RGB', (400, 300)).save(photo, 'JPEG')
+    photo.seek(0)
+    return main.app.test_client().post(
+        f'/mark_attendance/{course_id}', query_string={'token': token} if token else {},
+        content_type='multipart/form-data',
+        data={'student_id': 'Q1', 'student_name': 'Yaw Darko', 'latitude': '5.0', 'longitude': '-0.2',
+              'photo': (photo, 'photo.jpg')})
+
+
+def test_mark_attendance_requires_a_token_for_the_course(main, make_course, monkeypatch):
+    monkeypatch.setitem(main.app.config, 'QR_TOKEN_REQUIRED', True)
+    course_id, other_id = make_course(), make_course()
+
+    assert submit(main, course_id).status_code == 403
+    assert submit(main, course_id, main.qr_signer.token(other_id)).status_code == 403
+    assert submit(main, course_id, main.qr_signer.token(course_id)).status_code == 200
@@ -0,0 +1,63 @@
+"""The course and attendance list pages run a fixed number of queries however many rows they show."""
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+CHECKINS_PER_SESSION = 3
+
+
+def seed_sessions(main, count):
+    """Add ``count`` past sessions of the admin's, each with a few check-ins."""
+    with main.app.app_context():
+        admin = main.User.query.filter_by(username='admin').first()
+        departments = [d.id for d in main.Department.query]
+        engine = main.db.get_engine(main.app)
+        first = datetime.now() - timedelta(days=count + 1)
+        with engine.begin() as conn:
+            for i in range(count):
+                start = first + timedelta(days=i)
+                course_id = conn.execute(main.Course.__table__.insert(), {
+                    'course_name': f'Module {i}', 'course_code': f'M{i % 100:03d}', 'class_location': 'Hall',
+                    'start_time': start, 'end_time': start + timedelta(hours=2), 'instructor_id': admin.id,
+                    'department_id': departments[i % len(departments)], 'max_distance': 100.0,
+                    'year': 100, 'session': 'regular'}).inserted_primary_key[0]
+                conn.execute(main.Attendance.__table__.insert(), [
+                    {'student_id': f'{course_id}-{k}', 'student_name': f'Student {k}', 'course_id': course_id,
+                     'timestamp': start + timedelta(minutes=5), 'photo_path': 'seed.jpg',
+                     'latitude': 0.0, 'longitude': 0.0, 'location_verified': True}
+                    for k in range(CHECKINS_PER_SESSION)])
+
+
+@contextmanager
+def count_queries(main):
+    counter = {'queries': 0}
+
+    def count(*args):
+        counter['queries'] += 1
+
+    with main.app.app_context():
+        engine = main.db.get_engine(main.app)
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+
+
+def queries_for(main, client, url):
+    # The first request warms the per-process caches (logged-in user, counters)
+    assert client.get(url).status_code == 200
+    with count_queries(main) as counter:
+        assert client.get(url).status_code == 200
+    return counter['queries']
+
+
+@pytest.mark.parametrize('url', ['/view_course', '/admin/courses', '/admin/attendance'])
+def test_list_pages_run_a_bounded_number_of_queries(main, admin_client, url):
+    seed_sessions(main, 5)
+    few = queries_for(main, admin_client, url)
+    seed_sessions(main, 45)
+    many = queries_for(main, admin_client, url)
+    assert many == few
@@ -0,0 +1,72 @@
+"""Weekly course sessions: the daily horizon run and holidays."""
+import fcntl
+import threading
+from datetime import date, time, timedelta
+
+from recurrence import SessionScheduler
+
+
+def scheduler(tmp_path):
+    return SessionScheduler(None, None, None, None, None, lock_path=str(tmp_path / 'sessions.lock'))
+
+
+def test_the_horizon_run_starts_once_a_day_without_blocking(tmp_path):
+    sessions = scheduler(tmp_path)
+    release, runs = threading.Event(), []
+
+    def run():
+        release.wait(5)
+        runs.append(1)
+
+    today = date(2026, 3, 2)
+    thread = sessions.ensure_horizon(run, today=today)
+    assert thread is not None and thread.is_alive()
+    assert sessions.ensure_horizon(run, today=today) is None
+    release.set()
+    thread.join(5)
+    assert runs == [1]
+    sessions.ensure_horizon(run, today=today + timedelta(days=1)).join(5)
+    assert runs == [1, 1]
+
+
+def test_the_horizon_run_is_skipped_while_another_process_holds_the_lock(tmp_path):
+    sessions, runs = scheduler(tmp_path), []
+    with open(sessions.lock_path, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        sessions.ensure_horizon(lambda: runs.append(1), today=date(2026, 3, 2)).join(5)
+    assert runs == []
+
+
+def test_holidays_cancel_and_restore_sessions(main):
+    first = date.today() + timedelta(days=1)
+    holiday = first + timedelta(days=2)
+    with main.app.app_context():
+        admin = main.User.query.filter_by(username='admin').first()
+        series = main.CourseSeries(course_name='Holidays', course_code='H100', class_location='Hall',
+                                   instructor_id=admin.id, department_id=1, year=100, session='regular',
+                                   weekdays='0,1,2,3,4,5,6', start_clock=time(9, 0), duration_minutes=60,
+                                   first_date=first, last_date=first + timedelta(days=4),
+                                   generated_until=first - timedelta(days=1))
+        main.db.session.add(series)
+        main.db.session.commit()
+        series_id = series.id
+        assert main.materialize_sessions([series_id])['sessions'] == 5
+
+    def sessions():
+        with main.app.app_context():
+            return {c.start_time.date(): c.id for c in main.Course.query.filter_by(series_id=series_id)}
+
+    before = sessions()
+    cli = main.app.test_cli_runner()
+    assert 'removed 1 upcoming sessions' in cli.invoke(args=['add-holiday', holiday.isoformat(), 'Founders Day']).output
+    cancelled = sessions()
+    assert holiday not in cancelled
+    # The other sessions keep their ids, and so their QR codes
+    assert cancelled == {day: course_id for day, course_id in before.items() if day != holiday}
+
+    assert 'already a holiday' in cli.invoke(args=['add-holiday', holiday.isoformat(), 'Founders Day']).output
+    assert 'restored 1 upcoming sessions' in cli.invoke(args=['remove-holiday', holiday.isoformat()]).output
+    restored = sessions()
+    assert set(restored) == set(before)
+    assert {day: restored[day] for day in cancelled} == cancelled
+    assert 'is not a holiday' in cli.invoke(args=['remove-holiday', holiday.isoformat()]).output
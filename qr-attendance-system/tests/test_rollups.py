@@ -0,0 +1,69 @@
+"""Daily rollups kept in step with attendance inserts, moves and deletes."""
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import event
+
+DAY = date(2025, 6, 2)
+
+
+def rollup(main, course_code):
+    with main.app.app_context(), main.db.get_engine(main.app).connect() as conn:
+        return [(row['day'], row['checkins'], row['verified'], row['on_time'])
+                for row in main.daily_rollups.course_days(conn, 3, course_code)]
+
+
+def rebuilt(main, course_code):
+    """The rollup of ``course_code`` after recomputing its days from attendance."""
+    with main.app.app_context(), main.db.get_engine(main.app).begin() as conn:
+        main.daily_rollups.rebuild(conn, DAY, DAY + timedelta(days=1))
+    return rollup(main, course_code)
+
+
+def checkin(main, course_id, student_id, minutes, verified=True):
+    return main.Attendance(student_id=student_id, student_name='Adwoa Mensah', course_id=course_id,
+                           timestamp=datetime.combine(DAY, datetime.min.time()) + timedelta(hours=9, minutes=minutes),
+                           photo_path='seed.jpg', latitude=5.0, longitude=-0.2, location_verified=verified)
+
+
+def test_rollups_follow_orm_and_core_writes(main, make_course):
+    first = make_course(start=datetime(2025, 6, 2, 9, 0), department_id=3, course_code='R100')
+    second = make_course(start=datetime(2025, 6, 3, 9, 0), department_id=3, course_code='R200')
+    with main.app.app_context():
+        checkins = [checkin(main, first, 'R1', 5), checkin(main, first, 'R2', 40), checkin(main, first, 'R3', 5, False)]
+        main.db.session.add_all(checkins)
+        main.db.session.commit()
+        moved_id, deleted_id = checkins[0].id, checkins[2].id
+    assert rollup(main, 'R100') == [(DAY, 3, 2, 2)]
+
+    with main.app.app_context():
+
+        course = main.course_cache.get(first)
+        values = {column: getattr(checkin(main, first, 'R4', 1), column)
+                  for column in ('student_id', 'student_name', 'course_id', 'timestamp', 'photo_path',
+                                 'latitude', 'longitude', 'location_verified')}
+        row = dict(values, department_id=course.department_id, course_code=course.course_code,
+                   start_time=course.start_time)
+        statements = []
+        engine = main.db.get_engine(main.app)
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(engine, 'before_cursor_execute', listener)
+        try:
+            with engine.begin() as conn:
+                conn.execute(main.Attendance.__table__.insert(), [row])
+                main.record_core_inserts(conn, main.Attendance, [row])
+        finally:
+            event.remove(engine, 'before_cursor_execute', listener)
+        # The session fields come with the row, so no course is looked up
+        assert not any(statement.lstrip().upper().startswith('SELECT') for statement in statements)
+    assert rollup(main, 'R100') == [(DAY, 4, 3, 3)]
+
+    with main.app.app_context():
+        moved, deleted = main.Attendance.query.get(moved_id), main.Attendance.query.get(deleted_id)
+        moved.course_id = str(second)
+        main.db.session.delete(deleted)
+        main.db.session.commit()
+
+    assert rollup(main, 'R100') == [(DAY, 2, 2, 1)]
+    # Checked in the day before the session it moved to, so not on time there
+    assert rollup(main, 'R200') == [(DAY + timedelta(days=1), 1, 1, 0)]
+    assert rebuilt(main, 'R100') == [(DAY, 2, 2, 1)] and rollup(main, 'R200') == [(DAY + timedelta(days=1), 1, 1, 0)]
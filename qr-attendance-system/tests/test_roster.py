@@ -0,0 +1,80 @@
+"""Bulk roster import: parsing, batched upserts and the rejected-rows report."""
+import io
+import json
+
+import pytest
+
+from roster import parse_roster
+
+
+def roster(main, rows, upsert=False):
+    """Import ``rows`` (header first) two rows per batch; returns the report."""
+    importer = main.student_import(upsert=upsert, batch_rows=2)
+    with main.app.app_context():
+        for _ in importer.run(parse_roster(rows)):
+            pass
+    return importer.report()
+
+
+def students(main, *student_ids):
+    with main.app.app_context():
+        return {s.student_id: (s.full_name, s.department_id)
+                for s in main.Student.query.filter(main.Student.student_id.in_(student_ids))}
+
+
+def test_headers_are_matched_by_alias_and_required_columns_enforced():
+    records = list(parse_roster([['Index Number', 'Name', 'Department Code'], [], ['R1', 'Ama', 'CS']]))
+    assert records == [(3, {'student_id': 'R1', 'full_name': 'Ama', 'department': 'CS'})]
+    with pytest.raises(ValueError, match='full_name'):
+        parse_roster([['student_id', 'email']])
+    with pytest.raises(ValueError, match='empty'):
+        parse_roster([[''], []])
+
+
+def test_bad_rows_are_reported_and_the_rest_imported(main):
+    report = roster(main, [
+        ['student_id', 'full_name', 'department', 'phone'],
+        ['E1', 'Kwame Mensah', 'CS', ''],
+        ['E2', '', 'CS', ''],
+        ['E3', 'Akua Asante', 'NOPE', ''],
+        ['E4', 'Kojo Addo', '', '0' * 21],
+        ['E1', 'Kwame Again', 'CS', ''],
+        ['E5', 'Abena Osei', 'math', ''],
+    ])
+    assert (report['rows'], report['inserted'], report['updated'], report['failed']) == (6, 2, 0, 4)
+    assert [(e['row'], e['student_id'], e['error']) for e in report['errors']] == [
+        (3, 'E2', 'full_name is required'),
+        (4, 'E3', 'Unknown department NOPE'),
+        (5, 'E4', 'phone is longer than 20 characters'),
+        (6, 'E1', 'Duplicate of row 2'),
+    ]
+    assert set(students(main, 'E1', 'E2', 'E3', 'E4', 'E5')) == {'E1', 'E5'}
+
+
+def test_registered_students_are_rejected_unless_upserting(main):
+    roster(main, [['student_id', 'full_name', 'department'], ['U1', 'Yaa Boakye', 'CS'], ['U2', 'Kofi Ansah', 'CS']])
+    rows = [['student_id', 'full_name', 'department'], ['U1', 'Yaa Boakye-Mensah', 'PHYS'], ['U3', 'Efua Quaye', '']]
+
+    report = roster(main, rows)
+    assert (report['inserted'], report['updated']) == (1, 0)
+    assert [(e['student_id'], e['error']) for e in report['errors']] == [('U1', 'Student ID already exists')]
+    assert students(main, 'U1')['U1'][0] == 'Yaa Boakye'
+
+    report = roster(main, rows, upsert=True)
+    # U3 went in on the first pass, so both rows are updates now
+    assert (report['inserted'], report['updated'], report['failed']) == (0, 2, 0)
+    with main.app.app_context():
+        physics = main.Department.query.filter_by(code='PHYS').one().id
+    assert students(main, 'U1', 'U2') == {'U1': ('Yaa Boakye-Mensah', physics), 'U2': ('Kofi Ansah', 1)}
+
+
+def test_admin_upload_streams_progress_then_the_report(admin_client):
+    data = b'student_id,full_name\nW1,Nana Yeboah\nW2,\n'
+    response = admin_client.post('/admin/students/import', content_type='multipart/form-data',
+                                 data={'roster': (io.BytesIO(data), 'intake.csv')})
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert lines[-1]['success'] and (lines[-1]['inserted'], lines[-1]['failed']) == (1, 1)
+
+    response = admin_client.post('/admin/students/import', content_type='multipart/form-data',
+                                 data={'roster': (io.BytesIO(data), 'intake.txt')})
+    assert response.status_code == 400
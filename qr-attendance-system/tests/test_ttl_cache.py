@@ -0,0 +1,26 @@
+"""The read-through TTL cache behind the course and user caches."""
+from ttl_cache import TTLCache
+
+
+def test_loads_once_until_invalidated_and_skips_missing_keys():
+    loads = []
+
+    def loader(key):
+        loads.append(key)
+        return None if key == 'missing' else key.upper()
+
+    cache = TTLCache(loader)
+    assert cache.get('a') == 'A' and cache.get('a') == 'A'
+    assert cache.get('missing') is None and cache.get('missing') is None
+    cache.invalidate('a')
+    assert cache.get('a') == 'A'
+    assert loads == ['a', 'missing', 'missing', 'a']
+    assert cache.stats() == {'size': 1, 'ttl_seconds': 60, 'hits': 1, 'misses': 4, 'invalidations': 1}
+
+
+def test_entries_expire_after_the_ttl():
+    loads = []
+    cache = TTLCache(lambda key: loads.append(key) or key, ttl=0)
+    cache.get('a')
+    cache.get('a')
+    assert loads == ['a', 'a']
@@ -0,0 +1,61 @@
+"""Per-process read-through cache with a TTL safety net.
+
+The course and user caches keep detached snapshots of rows that the hot
+paths read far more often than anyone changes them. Routes that change a
+row invalidate its entry; the TTL bounds how long another gunicorn worker
+keeps serving the old snapshot, since invalidation only reaches the worker
+that handled the edit.
+"""
+import threading
+import time
+
+
+class TTLCache:
+    """Thread-safe ``key -> value`` cache with a TTL and hit/miss counters.
+
+    ``loader(key)`` returns a value or None and is only called on a miss or
+    after expiry. None is not cached.
+    """
+
+    def __init__(self, loader, ttl=60):
+        self.loader = loader
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                self._hits += 1
+                return entry[0]
+            self._misses += 1
+
+        value = self.loader(key)
+        if value is not None:
+            with self._lock:
+                self._entries[key] = (value, now + self.ttl)
+        return value
+
+    def invalidate(self, key=None):
+        """Drop one entry, or everything when ``key`` is None."""
+        with self._lock:
+            self._invalidations += 1
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'ttl_seconds': self.ttl,
+                'hits': self._hits,
+                'misses': self._misses,
+                'invalidations': self._invalidations,
+            }
@@ -0,0 +1,29 @@
+"""Per-process cache of the logged-in user for Flask-Login.
+
+Flask-Login calls the user loader on every request that touches
+current_user: every admin page, every admin_required check and every
+attendee list refresh. Loading the User row each time is a query per
+request for data that almost never changes, so the loader reads a detached
+UserSnapshot from here instead. Routes that change or delete a user
+invalidate its entry; the TTL (see ttl_cache.py) bounds how long another
+gunicorn worker keeps serving the old role or a deleted account.
+"""
+from collections import namedtuple
+
+from flask_login import UserMixin
+
+from ttl_cache import TTLCache
+
+
+class UserSnapshot(UserMixin, namedtuple('UserSnapshot', ['id', 'username', 'role', 'title', 'fullname', 'email'])):
+    """Detached, read-only copy of the User fields read through current_user."""
+
+    __slots__ = ()
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(user.id, user.username, user.role, user.title, user.fullname, user.email)
+
+
+class UserCache(TTLCache):
+    """``user_id -> UserSnapshot`` cache; ``loader(user_id)`` returns a snapshot or None."""